@@ -85,18 +85,20 @@ class Game:
       ui     - game ui instance
       update - engine update cycle instance
     """
-    def __init__(self, uilib, uiparams):
+    def __init__(self, uilib, uiparams, wrldparams={}):
         """
         Initialize game engine, UI included.
 
         Arguments:
-          uilib    : name of the UI lib to use
-          uiparams : params for the UI lib (see ui.py doc for more
-                     info)
+          uilib      : name of the UI lib to use
+          uiparams   : params for the UI lib (see ui.py doc for more
+                       info)
+          wrldparams : params for the world (see world.World). Default:
+                       no params
         """
         self.state = STATES['MAINMENU']
 
-        self.world = world.World()
+        self.world = world.World(**wrldparams)
         self.curp = None
         self.curl = None
 
@@ -154,7 +156,7 @@ class Game:
         if util.debug:
             self.util.add_message("x:%d,y:%d" % (self.curp.x, self.curp.y), MESSAGETYPES['ALERT'])
 
-        self.ui.refresh_map(self.curl[0], self.curp.x, self.curp.y, self.curp.fov_map,self)
+        self.ui.refresh_map(self.curl[0], self.curp.x, self.curp.y, self.curp.fov_map, self)
 
     def exit(self):
         """
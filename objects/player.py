@@ -9,14 +9,22 @@ The Player should be a Fighter object.
 """
 
 import logging
-import libtcod.libtcodpy as tcod
 
 from world import mapa
-from world.tile import TILETYPES
+from world import fovmap
 import objeto
 
 log = logging.getLogger('roguelike.player')
 
+"""Radius of the field of view of a player."""
+FOV_RADIUS = 15
+
+"""
+Cells the player may move, on chunked maps, before another FOV window
+of the level is used (see fovmap.LevelFov).
+"""
+FOV_MARGIN = 16
+
 class Player(objeto.Object):
     """
     Player class.
@@ -25,11 +33,19 @@ class Player(objeto.Object):
     controlled by the user, is named a 'monster' and has an AI
     associated with it.
 
+    The FOV maps (transparent and walkable cells) belong to the level,
+    shared by every player on it (see mapa.Map.get_fov): a player just
+    keeps the result of its field of view, the cells in view around
+    it.
+
     Methods:
       __init__
+      move
+      ini_fov_map
+      compute_fov_map
 
     Variables:
-      fov_map : a player has a field of view
+      fov_map : a player has a field of view (fovmap.Visibility)
 
     TODO:
       - refactor to add actions specific to the player here. Also, the
@@ -57,20 +73,21 @@ class Player(objeto.Object):
         Moves player.
 
         Moves the player coordinates by dx and dy.
-        After moving, FOV map is recomputed
+        After moving, the map gets ready what is ahead of the player (see
+        mapa.Map.prefetch) and FOV map is recomputed
         """
         super(Player,self).move(dx, dy)
+        self.curlevel[0].mapa.prefetch((self.x, self.y), (dx, dy))
         self.compute_fov_map()
 
     def ini_fov_map(self):
         """
-        Inits the FOV map for player's current level.
+        Inits the field of view for player's current level, nothing
+        in view until computed.
         """
-        self.fov_map = tcod.map_new(self.curlevel[0].mapa.w, self.curlevel[0].mapa.h)
-        for y in range(self.curlevel[0].mapa.h):
-            for x in range(self.curlevel[0].mapa.w):
-                tcod.map_set_properties(self.fov_map, x, y, not TILETYPES[self.curlevel[0].mapa.mapa[x][y].tipo]['block_sight'], not TILETYPES[self.curlevel[0].mapa.mapa[x][y].tipo]['block_pass'])
+        self.fov_map = fovmap.Visibility()
 
     def compute_fov_map(self):
         """Recompute FOV map for player."""
-        tcod.map_compute_fov(self.fov_map, self.x, self.y, radius=15, light_walls=True, algo=tcod.FOV_BASIC)
+        fov = self.curlevel[0].mapa.get_fov()
+        fov.compute(self.fov_map, (self.x, self.y), FOV_RADIUS, FOV_MARGIN)
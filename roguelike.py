@@ -25,6 +25,13 @@ PARAMETERS:
                               the game - warning, very low res might
                               not render things well)
 
+  --seed=num                : world seed, the same seed gives the same world
+
+  --cache=dir               : cache generated levels in the directory dir
+
+  --workers=num             : generate every level of the world at start,
+                              in parallel using num worker processes
+
   --debug                   : enable debug mode
 
   -v                        : game version
@@ -114,17 +121,19 @@ class RogueLike:
     Variables:
       game - the game engine
     """
-    def __init__(self, uilib = "libtcod", uiparams = (False, False)):
+    def __init__(self, uilib = "libtcod", uiparams = (False, False), wrldparams = {}):
         """
         Initialize the game engine, UI included.
 
         Arguments:
-          uilib    : the name of the UI library to use. Default: 'libtcod'
-          uiparams : tuple with parameters for the UI lib (see ui.py
-                     doc for more info). Default: (False, False)
+          uilib      : the name of the UI library to use. Default: 'libtcod'
+          uiparams   : tuple with parameters for the UI lib (see ui.py
+                       doc for more info). Default: (False, False)
+          wrldparams : dictionary with parameters for the game world
+                       (see world.py doc for more info). Default: {}
         """
         try:
-            self.game = game.Game(uilib, uiparams)
+            self.game = game.Game(uilib, uiparams, wrldparams)
         except Exception as e:
             log.error(tbck.format_exc())
             raise util.RogueLikeException("initerror:" + str(e))
@@ -176,6 +185,9 @@ def usage():
     print '   --maximize                : maximize display in screen'
     print '   --forcedim                : forces display size to maximum allowed by current screen'
     print '                               (allows low-res screens to run the game - warning, very low res might not render things well)'
+    print '   --seed=num                : world seed, the same seed gives the same world'
+    print '   --cache=dir               : cache generated levels in the directory dir'
+    print '   --workers=num             : generate every level of the world at start, in parallel using num worker processes'
     print '   --debug                   : enable debug mode'
     print '   -v                        : game version'
     print '   -h | -? | --help          : this help screen'
@@ -201,10 +213,12 @@ if __name__ == '__main__':
     library = "libtcod"
     maximize = False
     forcedim = False
+    wrldparams = {}
 
     # command line args
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "?hl:v", ['library=', 'help', 'debug', 'verbose', 'maximize', 'forcedim'])
+        opts, args = getopt.getopt(sys.argv[1:], "?hl:v", ['library=', 'help', 'debug', 'verbose', 'maximize', 'forcedim',
+                                                           'seed=', 'workers=', 'cache='])
     except getopt.GetoptError, err:
         print str(err)
         usage()
@@ -217,6 +231,22 @@ if __name__ == '__main__':
             maximize = True
         elif opt in("--forcedim"):
             forcedim = True
+        elif opt in ("--seed"):
+            try:
+                wrldparams['seed'] = int(arg)
+            except ValueError:
+                print 'invalid seed:', arg
+                usage()
+                sys.exit(2)
+        elif opt in ("--cache"):
+            wrldparams['cachedir'] = arg
+        elif opt in ("--workers"):
+            try:
+                wrldparams['workers'] = int(arg)
+            except ValueError:
+                print 'invalid number of workers:', arg
+                usage()
+                sys.exit(2)
         elif opt in ("-?", "-h", "--help"):
             help()
             sys.exit()
@@ -235,7 +265,7 @@ if __name__ == '__main__':
 
     # main
     try:
-        rw = RogueLike(library, (maximize, forcedim))
+        rw = RogueLike(library, (maximize, forcedim), wrldparams)
     except util.RogueLikeException as e:
         try:
             rw.finish()
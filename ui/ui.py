@@ -224,7 +224,8 @@ class UI:
         Arguments:
           level   : the level which map will be rendered
           (x,y)   : intended center coordinates of the map
-          fov_map : field of view (fov) map
+          fov_map : field of view (fov) of the player
+                    (fovmap.Visibility)
 
         TODO:
           - should manage the internals of the main area in here
@@ -252,23 +253,15 @@ class UI:
 
             # determine map coordinates to begin rendering according to map size
             # fitting in console size and (x,y) which are given to try and center
-            # the map in the console. If it's not possible to center, render the
-            # map and put (x,y) in an offset to a side of the map
-            (minx, miny) = (level.mapa.w > conarea_w and # if map is smaller than console...
-                            (x - conarea_w//2 > 0 and # if not, if coordinate is beyond left half of console...
-                             (x + conarea_w//2 < level.mapa.w and # see if it's beyond right half of console...
-                              x - conarea_w//2 or # if it is, draw map from x - half console
-                              level.mapa.w - conarea_w) # if it is not beyond right half (but it is beyond left half), draw from map width-half console
-                             or 0) # if it's not beyond left half, map will be rendered from the beginning left
-                            or 0, # if map was smaller than console, it will be rendered all
-                            level.mapa.h > conarea_h and
-                            (y - conarea_h//2 > 0 and # the same applies for y coord and map height
-                            (y + conarea_h//2 < level.mapa.h and
-                             y - conarea_h//2 or
-                             level.mapa.h - conarea_h)
-                            or 0) or 0)
-            (maxx, maxy) = (level.mapa.w if level.mapa.w <= conarea_w else conarea_w + minx,
-                            level.mapa.h if level.mapa.h <= conarea_h else conarea_h + miny)
+            # the map in the console. If it's not possible to center (near the
+            # map borders), render the map and put (x,y) in an offset to a side
+            # of the map. If the map is smaller than the console, render it all.
+            # Only the drawn box of the map gets touched, whatever the map size
+            # (chunked and endless maps are way bigger than the console).
+            (minx, miny) = (min(max(0, x - conarea_w//2), level.mapa.w - conarea_w) if level.mapa.w > conarea_w else 0,
+                            min(max(0, y - conarea_h//2), level.mapa.h - conarea_h) if level.mapa.h > conarea_h else 0)
+            (maxx, maxy) = (min(level.mapa.w, minx + conarea_w),
+                            min(level.mapa.h, miny + conarea_h))
 
             # draw objects in map...
 
@@ -354,13 +354,21 @@ class curses_wrapper:
           (x,y)       : the coordinates to be the center of the drawing
           (minx,miny) : the minimum coordinates from the map to be drawn
           (maxx,maxy) : the maximum coordinates from the map to be drawn
-          fov_map     : fov map
+          fov_map     : field of view of the player (fovmap.Visibility)
           main_area   : the area where the map is to be drawn
         """
-        from world.tile import TILETYPES
+        from world.tile import TILEREG
         main_area['con'].clear()
 
         map_ = level.mapa
+        # just the part of the map to draw, so only its chunks get
+        # touched on chunked maps
+        grid = map_.mapa.window((minx, miny), (maxx - minx, maxy - miny))
+
+        # per tile id lookups, instead of per tile ones
+        chars     = [ c.encode('utf8') for c in TILEREG.char ]
+        colors    = [ curses.color_pair(curses_wrapper.COLORS[c]['n']) for c in TILEREG.color ]
+        nv_colors = [ curses.color_pair(curses_wrapper.COLORS[c]['n']) for c in TILEREG.nv_color ]
 
         # determine console coordinates to begin rendering according to map size
         (conx, cony) = ((main_area['w'] - map_.w)//2 if map_.w < main_area['w'] else 0,
@@ -369,11 +377,13 @@ class curses_wrapper:
         # draw map tiles
         if util.debug:
             c = 0
-        for my, cy in zip(range(miny, maxy), range(cony, map_.h + cony)):
-            for mx, cx in zip(range(minx, maxx), range(conx, map_.w + conx)):
+        for my, cy in zip(xrange(miny, maxy), xrange(cony, cony + maxy - miny)):
+            row = (my - miny) * grid.w - minx
+            for mx, cx in zip(xrange(minx, maxx), xrange(conx, conx + maxx - minx)):
                 try:
-                    visible = libtcod.map_is_in_fov(fov_map, mx, my)
-                    tile = map_.mapa[mx][my]
+                    visible = fov_map.is_in_fov(mx, my)
+                    i = row + mx
+                    tid = grid.cells[i]
                 # BUG: sometimes None appears on the map(?!)
                 except Exception as e:
                     if util.debug:
@@ -381,10 +391,9 @@ class curses_wrapper:
                     continue
                 # it's out of the player's FOV, player will see it only if explored
                 if not visible:
-                    if tile.explored:
+                    if grid.explored[i]:
                         # draw map tile with char/color <- modifications for explored/not visible
-                        main_area['con'].addstr(cy, cx, TILETYPES[tile.tipo]['char'].encode('utf8'),
-                                                curses.color_pair(curses_wrapper.COLORS[TILETYPES[tile.tipo]['nv_color']]['n']))
+                        main_area['con'].addstr(cy, cx, chars[tid], nv_colors[tid])
                     else:
                         # main_area['con'].addstr(cy, cx, ' ',
                         #                         curses.color_pair(curses_wrapper.COLORS['black']['n']))
@@ -393,14 +402,14 @@ class curses_wrapper:
                 else:
                     # draw map tile with char/color <- as is since it is visible
                     try:
-                        main_area['con'].addstr(cy, cx, TILETYPES[tile.tipo]['char'].encode('utf8'),
-                                                curses.color_pair(curses_wrapper.COLORS[TILETYPES[tile.tipo]['color']]['n']))
+                        main_area['con'].addstr(cy, cx, chars[tid], colors[tid])
                         main_area['con'].addstr(cony + y - miny, conx + x - minx, '@',
                                                 curses.color_pair(curses_wrapper.COLORS['blue']['n']))
                     except Exception as e:
                         pass
                     # since now it's visible, mark it as explored
-                    tile.explored = True
+                    if not grid.explored[i]:
+                        map_.mapa.set_explored(mx, my)
 
         if util.debug:
             log.debug("none appeared %d times" % c)
@@ -253,35 +253,45 @@ class libtcod_wrapper:
           (x,y)       : the coordinates to be the center of the drawing
           (minx,miny) : the minimum coordinates from the map to be drawn
           (maxx,maxy) : the maximum coordinates from the map to be drawn
-          fov_map
+          fov_map     : field of view of the player (fovmap.Visibility)
           main_area   : the area where the map is to be drawn
         """
-        from world.tile import TILETYPES
+        from world.tile import TILEREG
         libtcod.console_clear(main_area['con'])
 
         map_ = level.mapa
+        # just the part of the map to draw, so only its chunks get
+        # touched on chunked maps
+        grid = map_.mapa.window((minx, miny), (maxx - minx, maxy - miny))
+
+        # per tile id lookups, instead of per tile ones
+        glyphs    = TILEREG.glyph
+        colors    = [ getcolorbyname(c) for c in TILEREG.color ]
+        nv_colors = [ getcolorbyname(c) for c in TILEREG.nv_color ]
 
         # determine console coordinates to begin rendering according to map size
         (conx, cony) = ((main_area['w'] - map_.w)//2 if map_.w < main_area['w'] else 0,
                         (main_area['h'] - map_.h)//2 if map_.h < main_area['h'] else 0)
 
         # draw map tiles
-        for my, cy in zip(range(miny, maxy), range(cony, map_.h + cony)):
-            for mx, cx in zip(range(minx, maxx), range(conx, map_.w + conx)):
+        for my, cy in zip(xrange(miny, maxy), xrange(cony, cony + maxy - miny)):
+            row = (my - miny) * grid.w - minx
+            for mx, cx in zip(xrange(minx, maxx), xrange(conx, conx + maxx - minx)):
                 try:
-                    visible = libtcod.map_is_in_fov(fov_map, mx, my)
-                    tile = map_.mapa[mx][my]
+                    visible = fov_map.is_in_fov(mx, my)
+                    i = row + mx
+                    tid = grid.cells[i]
                 except Exception as e:
                     continue
                 # it's out of the player's FOV, player will see it only if explored
                 if not visible:
-                    if tile.explored:
+                    if grid.explored[i]:
                         # draw map tile with char/color <- modifications for explored/not visible
                         libtcod.console_put_char_ex(main_area['con'],
                                                     cx, cy,
-                                                    ' ' if TILETYPES[tile.tipo]['just_color'] else TILETYPES[tile.tipo]['char'].encode('utf8'),
+                                                    glyphs[tid],
                                                     libtcod.white,
-                                                    getcolorbyname(TILETYPES[tile.tipo]['nv_color']))
+                                                    nv_colors[tid])
                     else:
                         libtcod.console_put_char_ex(main_area['con'],
                                                     cx, cy,
@@ -293,11 +303,12 @@ class libtcod_wrapper:
                     # draw map tile with char/color <- as is since it is visible
                     libtcod.console_put_char_ex(main_area['con'],
                                                 cx, cy,
-                                                ' ' if TILETYPES[tile.tipo]['just_color'] else TILETYPES[tile.tipo]['char'].encode('utf8'),
+                                                glyphs[tid],
                                                 libtcod.white,
-                                                getcolorbyname(TILETYPES[tile.tipo]['color']))
+                                                colors[tid])
                     # since now it's visible, mark it as explored
-                    tile.explored = True
+                    if not grid.explored[i]:
+                        map_.mapa.set_explored(mx, my)
         for p in level.players:
             libtcod.console_set_char(main_area['con'],
                                      conx+x-minx, cony+y-miny,
@@ -0,0 +1,72 @@
+"""
+Benchmark of the cave cellular automaton (mapa.Cave): the whole-grid
+bit grid implementation (bitgrid.automaton) against a per cell python
+loop implementation of the same automaton, checking both give the same
+cave.
+
+Usage, from the game root directory:
+
+  python util/bench/bench_cave.py [repetitions]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from world import bitgrid
+
+"""(map dims, iterations) cases."""
+CASES = [ ((320, 240), 5),
+          ((640, 480), 5),
+          ((1280, 960), 5) ]
+
+FILL, BIRTH, SURVIVAL = 0.45, 5, 4
+
+def cave_loop(mask, w, h, iterations):
+    cells = [ [ mask[x + y * w] == chr(1) for x in range(w) ] for y in range(h) ]
+    for i in range(iterations):
+        new = []
+        for y in range(h):
+            row = []
+            for x in range(w):
+                count = 0
+                for dy in (-1, 0, 1):
+                    for dx in (-1, 0, 1):
+                        if dx or dy:
+                            (nx, ny) = (x + dx, y + dy)
+                            if nx < 0 or ny < 0 or nx >= w or ny >= h or cells[ny][nx]:
+                                count += 1
+                row.append(count >= (SURVIVAL if cells[y][x] else BIRTH))
+            new.append(row)
+        cells = new
+    return ''.join(chr(1) if c else chr(0) for row in cells for c in row)
+
+def cave_bits(mask, w, h, iterations):
+    return bitgrid.to_mask(bitgrid.automaton(bitgrid.from_mask(mask), w, h, BIRTH, SURVIVAL, iterations), w * h)
+
+def timeit(f, args, reps):
+    best = None
+    for i in range(reps):
+        t0 = time.time()
+        result = f(*args)
+        t = time.time() - t0
+        best = t if best is None else min(best, t)
+    return best, result
+
+def main(reps):
+    print '%-10s %5s %10s %12s %12s %9s' % ('map', 'iter', 'noise (s)', 'loop (s)', 'bitgrid (s)', 'speedup')
+    for (w, h), iterations in CASES:
+        rnd = random.Random(w)
+        (tnoise, bits) = timeit(bitgrid.random_bits, (rnd, w * h, FILL), reps)
+        mask = bitgrid.to_mask(bits, w * h)
+        (tloop, rloop) = timeit(cave_loop, (mask, w, h, iterations), 1)
+        (tbits, rbits) = timeit(cave_bits, (mask, w, h, iterations), reps)
+        assert rloop == rbits
+        print '%-10s %5d %10.4f %12.4f %12.4f %8.0fx' % ('%dx%d' % (w, h), iterations, tnoise, tloop, tbits, tloop / max(tbits, 1e-9))
+
+
+if __name__=="__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
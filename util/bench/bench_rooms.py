@@ -0,0 +1,109 @@
+"""
+Benchmark of the room placement in a map: time to place rooms with
+the rejection loop of mapa.Dungeon2, checking each candidate room
+against every accepted room (list scan) and against a room.RoomIndex
+(spatial index), as the number of candidate rooms and the map size
+grow. Then, the time to place rooms of each geometry (room.Rect,
+room.Circle, room.Hexag) with the RoomIndex. Last, the room graph of
+some Dungeon2 maps (roomgraph.RoomMap), checking rooms have just a few
+neighbours (the rooms their corridors lead to, not every room the
+crossing corridors touch).
+
+Usage, from the game root directory:
+
+  python util/bench/bench_rooms.py [repetitions]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+import libtcod.libtcodpy as tcod
+from world import mapa, room
+
+"""(map dims, candidate rooms) cases, with DUNG_ROOM_LIMS like room sizes."""
+CASES = [ ((320, 240), 50),
+          ((320, 240), 1000),
+          ((1280, 960), 1000),
+          ((1280, 960), 10000),
+          ((4096, 4096), 10000) ]
+
+ROOM_MIN, ROOM_MAX = 10, 30
+
+"""Room geometries compared."""
+SHAPES = (room.Rect, room.Circle, room.Hexag)
+
+"""Seeds of the Dungeon2 maps whose room graph is checked."""
+GRAPH_SEEDS = (1, 2, 3, 4, 5)
+
+"""Maximum neighbours of a room in the room graph."""
+MAX_DEGREE = 8
+
+def candidates((w, h), n, seed, geo=room.Rect):
+    rnd = random.Random(seed)
+    rooms = []
+    for i in range(n):
+        rw = rnd.randint(ROOM_MIN, ROOM_MAX)
+        rh = rnd.randint(ROOM_MIN, ROOM_MAX)
+        rooms.append(geo((rnd.randint(0, w - rw - 1), rnd.randint(0, h - rh - 1)), (rw, rh)))
+    return rooms
+
+def place_scan(dims, rooms):
+    placed = []
+    for r in rooms:
+        for other in placed:
+            if r.intersect(other):
+                break
+        else:
+            placed.append(r)
+    return placed
+
+def place_index(dims, rooms):
+    index = room.RoomIndex(dims, ROOM_MAX)
+    for r in rooms:
+        if not index.intersects(r):
+            index.insert(r)
+    return index.rooms
+
+def timeit(f, dims, rooms, reps):
+    best = None
+    for i in range(reps):
+        t0 = time.time()
+        placed = f(dims, rooms)
+        t = time.time() - t0
+        best = t if best is None else min(best, t)
+    return best, len(placed)
+
+def main(reps):
+    print '%-12s %10s %8s %12s %12s %8s' % ('map', 'candidates', 'placed', 'scan (s)', 'index (s)', 'speedup')
+    for dims, n in CASES:
+        rooms = candidates(dims, n, n)
+        (tscan, nscan) = timeit(place_scan, dims, rooms, reps)
+        (tindex, nindex) = timeit(place_index, dims, rooms, reps)
+        assert nscan == nindex
+        print '%-12s %10d %8d %12.4f %12.4f %7.1fx' % ('%dx%d' % dims, n, nindex, tscan, tindex, tscan / max(tindex, 1e-9))
+
+    print
+    print '%-12s %10s' % ('map', 'candidates') + ''.join('%16s' % geo.__name__ for geo in SHAPES)
+    for dims, n in CASES:
+        times = [ timeit(place_index, dims, candidates(dims, n, n, geo), reps)[0] for geo in SHAPES ]
+        print '%-12s %10d' % ('%dx%d' % dims, n) + ''.join('%16.4f' % t for t in times)
+
+    print
+    print '%-12s %6s %8s %12s %12s' % ('dungeon2', 'rooms', 'graph (s)', 'avg degree', 'max degree')
+    for seed in GRAPH_SEEDS:
+        m = mapa.Dungeon2(mapa.MAPTYPES.dungeon2, tcod.random_new_from_seed(seed))
+        t0 = time.time()
+        roommap = m.get_room_map()
+        t = time.time() - t0
+        degrees = [ len(roommap.neighbours(k)) for k in range(1, len(m.rooms) + 1) ]
+        assert max(degrees) <= MAX_DEGREE
+        print '%-12s %6d %8.4f %12.2f %12d' % ('seed %d' % seed, len(m.rooms), t,
+                                               sum(degrees) / float(len(degrees)), max(degrees))
+
+
+if __name__=="__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3)
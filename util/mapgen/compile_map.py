@@ -0,0 +1,45 @@
+"""
+Compila niveles (.lev de world/levels o .png de util/mapgen) al
+formato binario .levc que el juego carga sin parsear (ver
+world/levfile.py).
+
+Uso, desde el directorio raiz del juego:
+
+  python util/mapgen/compile_map.py [archivo.lev|archivo.png ...]
+
+Sin argumentos compila todos los world/levels/*.lev. Un .png se compila
+a world/levels/<nombre>.levc.
+"""
+
+import glob
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from world import levfile
+from world.mapa import DEF_MAP_DIMS
+from world.tile import TileGrid
+
+def compile_png(fname):
+    import import_map
+
+    name = os.path.splitext(os.path.basename(fname))[0]
+    grid = TileGrid(DEF_MAP_DIMS, 'air')
+    initpoint = levfile.decode('\n'.join(import_map.png_rows(os.path.splitext(fname)[0])), grid, name)
+
+    dst = os.path.join(levfile.LEVELS_DIR, name + '.levc')
+    levfile.write_compiled(dst, grid, initpoint)
+    return dst
+
+def main(fnames):
+    for fname in fnames or sorted(glob.glob(os.path.join(levfile.LEVELS_DIR, '*.lev'))):
+        if fname.endswith('.png'):
+            dst = compile_png(fname)
+        else:
+            dst = levfile.compile_lev(fname, DEF_MAP_DIMS)
+        print fname, '->', dst
+
+
+if __name__=="__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+bitgrid.py
+
+RogueLike bit grids.
+
+A bit grid packs a boolean grid (a mask) into a single python long,
+one bit per cell in row-major order (cell (x,y) is bit x + y*w). Any
+bitwise operation on it works on the whole grid at once, so cellular
+automata and similar whole-grid algorithms run without per cell python
+loops: shifting the grid by 1 or by w gives every cell its left/right
+or up/down neighbour.
+
+Masks are str/bytearray buffers with a byte per cell, chr(0) or
+chr(1) (see tile.TileGrid.mask).
+
+  function from_mask  : packs a mask into a bit grid
+
+  function to_mask    : unpacks a bit grid into a mask
+
+  function random_bits : random bit grid, each bit set with a given
+                         probability
+
+  function pad        : adds a border around a mask
+
+  function unpad      : removes the border around a mask
+
+  function count_neighbours : counts the set neighbours of every cell,
+                              as bit planes
+
+  function at_least   : compares bit planes counts with a constant
+
+  function dilate     : grows the set cells of a bit grid
+
+  function automaton  : runs a birth/survival cellular automaton
+"""
+
+"""Translation table from mask bytes to binary digits."""
+MASK_TO_DIGITS = '0' + '1' * 255
+
+"""Translation table from binary digits to mask bytes."""
+DIGITS_TO_MASK = ''.join(chr(1) if chr(c) == '1' else chr(0) for c in range(256))
+
+"""Bits of precision for the probability of random_bits."""
+RANDOM_PRECISION = 16
+
+def from_mask(mask):
+    """
+    Packs a mask into a bit grid.
+
+    Arguments:
+      mask - str/bytearray, a byte per cell, non zero for set cells
+
+    Returns:
+      long with the bit grid
+    """
+    if not len(mask):
+        return 0
+    return int(str(mask).translate(MASK_TO_DIGITS)[::-1], 2)
+
+def to_mask(bits, n):
+    """
+    Unpacks a bit grid into a mask.
+
+    Arguments:
+      bits - the bit grid
+      n    - number of cells in the grid
+
+    Returns:
+      str with the mask, chr(1) for set cells, chr(0) for the rest
+    """
+    if n == 0:
+        return ''
+    digits = bin(bits & ((1 << n) - 1))[2:]
+    return digits.zfill(n)[::-1].translate(DIGITS_TO_MASK)
+
+def random_bits(rnd, n, p):
+    """
+    Builds a random bit grid, each bit set with probability p.
+
+    Draws RANDOM_PRECISION random bit grids and combines them
+    following the binary digits of p (from the least significant one:
+    OR with the next random grid for a 1 digit, AND for a 0 digit),
+    so each resulting bit is set with probability p, rounded to
+    RANDOM_PRECISION binary digits.
+
+    Arguments:
+      rnd - random.Random like generator (needs getrandbits)
+      n   - number of cells in the grid
+      p   - probability of each bit to be set
+
+    Returns:
+      long with the random bit grid
+    """
+    full = (1 << n) - 1
+    q = int(round(min(max(p, 0.0), 1.0) * (1 << RANDOM_PRECISION)))
+    if q >= 1 << RANDOM_PRECISION:
+        return full
+    bits = 0
+    for i in range(RANDOM_PRECISION):
+        if q & (1 << i):
+            bits |= rnd.getrandbits(n)
+        else:
+            bits &= rnd.getrandbits(n)
+    return bits & full
+
+def pad(mask, w, h, fill=chr(1)):
+    """
+    Adds a one cell border around a mask.
+
+    Arguments:
+      mask  - the mask, w*h bytes
+      (w,h) - mask dimensions
+      fill  - mask byte for the border cells. Default: chr(1)
+
+    Returns:
+      str with the (w+2)*(h+2) padded mask
+    """
+    mask = str(mask)
+    border = fill * (w + 2)
+    return ''.join([border] +
+                   [ fill + mask[y * w:(y + 1) * w] + fill for y in range(h) ] +
+                   [border])
+
+def unpad(mask, w, h):
+    """
+    Removes the one cell border around a padded mask.
+
+    Arguments:
+      mask  - the padded mask, (w+2)*(h+2) bytes
+      (w,h) - dimensions of the mask without border
+
+    Returns:
+      str with the w*h mask
+    """
+    W = w + 2
+    return ''.join(mask[(y + 1) * W + 1:(y + 1) * W + 1 + w] for y in range(h))
+
+def count_neighbours(bits, W, n):
+    """
+    Counts the set neighbours (8 directions) of every cell.
+
+    The count is returned as bit planes: plane i holds bit i of the
+    count of every cell. The planes are computed adding the 8 shifted
+    grids with bitwise ripple-carry adders. Shifting does not take
+    rows into account, so cells in the first/last column get
+    neighbours from the previous/next row: use padded grids (see pad)
+    and don't trust the border cells counts.
+
+    Arguments:
+      bits - the bit grid
+      W    - grid width
+      n    - number of cells in the grid
+
+    Returns:
+      list with the bit planes of the counts, least significant first
+    """
+    full = (1 << n) - 1
+    planes = []
+    for s in (1, W - 1, W, W + 1):
+        for shifted in ((bits << s) & full, bits >> s):
+            carry = shifted
+            for i in range(len(planes)):
+                (planes[i], carry) = (planes[i] ^ carry, planes[i] & carry)
+                if not carry:
+                    break
+            if carry:
+                planes.append(carry)
+    return planes
+
+def at_least(planes, k, n):
+    """
+    Compares counts given as bit planes with a constant.
+
+    Arguments:
+      planes - bit planes of the counts (see count_neighbours)
+      k      - the constant
+      n      - number of cells in the grid
+
+    Returns:
+      bit grid with the cells whose count is >= k set
+    """
+    full = (1 << n) - 1
+    if k <= 0:
+        return full
+    if k >= 1 << len(planes):
+        return 0
+    gt = 0
+    eq = full
+    for i in reversed(range(len(planes))):
+        if (k >> i) & 1:
+            eq &= planes[i]
+        else:
+            gt |= eq & planes[i]
+            eq &= full ^ planes[i]
+    return gt | eq
+
+def dilate(bits, w, h, r=1):
+    """
+    Grows the set cells of a bit grid, r times to its 8 neighbours.
+
+    Arguments:
+      bits  - the bit grid, w*h cells
+      (w,h) - grid dimensions
+      r     - number of cells to grow. Default: 1
+
+    Returns:
+      the dilated bit grid
+    """
+    (W, H) = (w + 2, h + 2)
+    n = W * H
+    full = (1 << n) - 1
+    border = from_mask(pad(chr(0) * (w * h), w, h))
+
+    bits = from_mask(pad(to_mask(bits, w * h), w, h, chr(0)))
+    for i in range(r):
+        for s in (1, W):
+            bits |= ((bits << s) | (bits >> s)) & full
+        bits &= full ^ border
+    return from_mask(unpad(to_mask(bits, n), w, h))
+
+def automaton(bits, w, h, birth, survival, iterations):
+    """
+    Runs a birth/survival cellular automaton over a bit grid.
+
+    Each iteration, a clear cell gets set if it has at least birth
+    set neighbours, and a set cell stays set if it has at least
+    survival set neighbours. Cells out of the grid count as set.
+
+    Arguments:
+      bits       - the bit grid, w*h cells
+      (w,h)      - grid dimensions
+      birth      - minimum set neighbours for a clear cell to get set
+      survival   - minimum set neighbours for a set cell to stay set
+      iterations - number of iterations
+
+    Returns:
+      the resulting bit grid
+    """
+    (W, H) = (w + 2, h + 2)
+    n = W * H
+    full = (1 << n) - 1
+    border = from_mask(pad(chr(0) * (w * h), w, h))
+
+    bits = from_mask(pad(to_mask(bits, w * h), w, h))
+    for i in range(iterations):
+        planes = count_neighbours(bits, W, n)
+        bits = (((bits & at_least(planes, survival, n)) |
+                 ((full ^ bits) & at_least(planes, birth, n))) | border) & full
+    return from_mask(unpad(to_mask(bits, n), w, h))
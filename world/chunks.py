@@ -0,0 +1,695 @@
+# -*- coding: utf-8 -*-
+"""
+chunks.py
+
+RogueLike chunked tile storage, for maps too big to be held whole.
+
+A chunked grid splits the map into square chunks of CHUNK_SIZE x
+CHUNK_SIZE cells. Each chunk is a small buffer with the same layout
+as a tile.TileGrid (tile ids, then explored flags, row-major), and is
+allocated only when some cell in it differs from the default tile or
+has been explored: big maps are mostly solid rock, which takes no
+memory at all.
+
+Allocated chunks live in a ChunkStore: the most recently used ones
+stay in memory, the rest may be written to a memory-mapped backing
+file, from where they are read back when needed again.
+
+  int CHUNK_SIZE       : side of a chunk, in cells
+
+  int DEF_MAXRESIDENT  : default number of chunks kept in memory
+
+  class ChunkStore     : chunk buffers, with a LRU of the resident ones
+                         and an optional memory-mapped backing file
+
+  class ChunkedGrid    : 2D grid of tiles stored in chunks, duck-types
+                         tile.TileGrid
+
+  class StreamStore    : chunk buffers generated on demand, some of
+                         them in the background
+
+  class StreamedGrid   : chunked grid whose chunks are generated on
+                         demand
+"""
+
+import collections
+import logging
+import mmap
+import Queue
+import tempfile
+import threading
+import zlib
+
+from tile import TILEIDS, TILENAMES, TileColumn, TileGrid
+
+log = logging.getLogger('roguelike.chunks')
+
+"""Side of a chunk, in cells (a power of 2)."""
+CHUNK_SHIFT = 6
+CHUNK_SIZE  = 1 << CHUNK_SHIFT
+CHUNK_MASK  = CHUNK_SIZE - 1
+CHUNK_CELLS = CHUNK_SIZE * CHUNK_SIZE
+
+"""Default number of chunks kept in memory by a ChunkStore."""
+DEF_MAXRESIDENT = 256
+
+class ChunkStore:
+    """
+    Storage for the chunks of a grid.
+
+    Chunks are bytearrays, identified by an int key (their position in
+    the grid). The resident ones are kept in least recently used
+    order; when there are more than maxresident and the store has a
+    backing file, the oldest ones are written to the file, at a fixed
+    offset per key, and dropped from memory. The backing file is
+    sparse and memory-mapped, so only the pages of the chunks written
+    take space, and reading a chunk back is a slice of the map.
+
+    Without a backing file, every chunk stays in memory.
+
+    Methods:
+      __init__
+      __len__
+      __contains__
+      get
+      put
+      discard
+      keys
+      close
+
+    Variables:
+      nchunks     - number of chunks of the grid
+      chunkbytes  - size of a chunk
+      maxresident - max number of chunks in memory
+      resident    - ordered dictionary of the chunks in memory, least
+                    recently used first
+      stored      - set of keys of the chunks written to the backing
+                    file
+    """
+    def __init__(self, nchunks, chunkbytes, maxresident=DEF_MAXRESIDENT, backing=None):
+        """
+        Initializes an empty store.
+
+        Arguments:
+          nchunks     - number of chunks of the grid
+          chunkbytes  - size of a chunk
+          maxresident - max number of chunks in memory. Default:
+                        DEF_MAXRESIDENT
+          backing     - path of the backing file, True for an anonymous
+                        temporary file, or None for no backing
+                        file. Default: None
+        """
+        self.nchunks     = nchunks
+        self.chunkbytes  = chunkbytes
+        self.maxresident = maxresident
+        self.resident    = collections.OrderedDict()
+        self.stored      = set()
+        (self._file, self._mm) = (None, None)
+
+        if backing is not None:
+            self._file = tempfile.TemporaryFile() if backing is True else open(backing, 'w+b')
+            self._file.truncate(nchunks * chunkbytes)
+            self._mm = mmap.mmap(self._file.fileno(), nchunks * chunkbytes)
+
+    def __len__(self):
+        """
+        Number of chunks allocated, in memory or in the backing file.
+        """
+        return len(self.stored.union(self.resident))
+
+    def __contains__(self, k):
+        return k in self.resident or k in self.stored
+
+    def get(self, k):
+        """
+        Gets a chunk.
+
+        Arguments:
+          k - key of the chunk
+
+        Returns:
+          bytearray with the chunk, None if it is not allocated
+        """
+        chunk = self.resident.pop(k, None)
+        if chunk is None:
+            if k not in self.stored:
+                return None
+            offset = k * self.chunkbytes
+            chunk = bytearray(self._mm[offset:offset + self.chunkbytes])
+        self._keep(k, chunk)
+        return chunk
+
+    def put(self, k, chunk):
+        """
+        Stores a chunk.
+
+        Arguments:
+          k     - key of the chunk
+          chunk - bytearray of chunkbytes bytes
+        """
+        self.resident.pop(k, None)
+        self._keep(k, chunk)
+
+    def discard(self, k):
+        """
+        Frees a chunk, if allocated.
+        """
+        self.resident.pop(k, None)
+        self.stored.discard(k)
+
+    def keys(self):
+        """
+        Gets the keys of the allocated chunks, sorted.
+        """
+        return sorted(self.stored.union(self.resident))
+
+    def close(self):
+        """
+        Closes the backing file, if any. Chunks which were not
+        resident are lost.
+        """
+        if self._mm is not None:
+            self._mm.close()
+            self._file.close()
+            (self._file, self._mm) = (None, None)
+            self.stored.clear()
+
+    def _keep(self, k, chunk):
+        """
+        Makes a chunk the most recently used one, writing the least
+        recently used ones to the backing file if there are too many.
+        """
+        self.resident[k] = chunk
+        if self._mm is None:
+            return
+        while len(self.resident) > self.maxresident:
+            (old, data) = self.resident.popitem(last=False)
+            offset = old * self.chunkbytes
+            self._mm[offset:offset + self.chunkbytes] = str(data)
+            self.stored.add(old)
+
+class ChunkedGrid:
+    """
+    2D grid of tiles, stored in chunks.
+
+    Duck-types tile.TileGrid for per cell access (get, set, tipo,
+    set_tipo, explored flags, grid[x][y]), and for bulk access through
+    windows: window copies a box of the grid into a TileGrid, blit
+    writes a TileGrid into the grid, touching only the chunks under
+    the box. Chunks of just default tiles, never explored, are not
+    allocated (and get freed when written back to that state by
+    blit).
+
+    Whole grid operations (mask, find_all of the default tile) are
+    supported but build the full grid in memory, and should be
+    avoided on big grids.
+
+    Methods:
+      __init__
+      __len__
+      __getitem__
+      get
+      set
+      tipo
+      set_tipo
+      is_explored
+      set_explored
+      window
+      blit
+      mask
+      find_all
+      dump
+      load
+
+    Variables:
+      (w,h)   - grid dimensions
+      (cw,ch) - grid dimensions, in chunks
+      deftile - tile id of the default tile
+      store   - ChunkStore of the chunks
+    """
+    def __init__(self, (w, h), tipo='wall', maxresident=DEF_MAXRESIDENT, backing=None):
+        """
+        Initializes the grid, every cell with the default tile.
+
+        Arguments:
+          (w, h)      - grid dimensions
+          tipo        - the default type of tile. Default:
+                        TILETYPES.wall
+          maxresident - max number of chunks in memory. Default:
+                        DEF_MAXRESIDENT
+          backing     - backing file for the chunks (see
+                        ChunkStore). Default: None
+        """
+        (self.w, self.h)   = (w, h)
+        (self.cw, self.ch) = ((w + CHUNK_MASK) >> CHUNK_SHIFT, (h + CHUNK_MASK) >> CHUNK_SHIFT)
+        self.deftile       = TILEIDS[tipo]
+        self.store         = ChunkStore(self.cw * self.ch, 2 * CHUNK_CELLS, maxresident, backing)
+        self._blank        = bytearray(chr(self.deftile)) * CHUNK_CELLS + bytearray(CHUNK_CELLS)
+
+    def __len__(self):
+        """
+        Grid width, as the length of the old list of columns.
+        """
+        return self.w
+
+    def __getitem__(self, x):
+        """
+        Gets a column of the grid (compatibility accessor, see
+        tile.TileGrid).
+        """
+        if not 0 <= x < self.w:
+            raise IndexError("x coordinate out of grid: %s" % str(x))
+        return TileColumn(self, x)
+
+    def _chunk(self, x, y, alloc=False):
+        """
+        Gets the chunk holding some coordinates, and the offset of the
+        cell in it.
+
+        Arguments:
+          (x,y) - coordinates
+          alloc - allocate the chunk if it is not. Default: False
+
+        Returns:
+          (chunk, offset), chunk is None if not allocated
+        """
+        if not (0 <= x < self.w and 0 <= y < self.h):
+            raise IndexError("coordinates out of grid: (%s,%s)" % (str(x), str(y)))
+        k = (y >> CHUNK_SHIFT) * self.cw + (x >> CHUNK_SHIFT)
+        chunk = self.store.get(k)
+        if chunk is None and alloc:
+            chunk = bytearray(self._blank)
+            self.store.put(k, chunk)
+        return (chunk, (x & CHUNK_MASK) + ((y & CHUNK_MASK) << CHUNK_SHIFT))
+
+    def get(self, x, y):
+        """
+        Gets the tile id at some coordinates.
+        """
+        (chunk, o) = self._chunk(x, y)
+        return self.deftile if chunk is None else chunk[o]
+
+    def set(self, x, y, tid):
+        """
+        Sets the tile id at some coordinates.
+        """
+        (chunk, o) = self._chunk(x, y, tid != self.deftile)
+        if chunk is not None:
+            chunk[o] = tid
+
+    def tipo(self, x, y):
+        """
+        Gets the type of tile (TILETYPES key) at some coordinates.
+        """
+        return TILENAMES[self.get(x, y)]
+
+    def set_tipo(self, x, y, tipo):
+        """
+        Sets the type of tile (TILETYPES key) at some coordinates.
+        """
+        self.set(x, y, TILEIDS[tipo])
+
+    def is_explored(self, x, y):
+        """
+        Tells if the tile at some coordinates has been explored.
+        """
+        (chunk, o) = self._chunk(x, y)
+        return chunk is not None and chunk[CHUNK_CELLS + o] == 1
+
+    def set_explored(self, x, y, explored = True):
+        """
+        Sets the explored flag for the tile at some coordinates.
+        """
+        (chunk, o) = self._chunk(x, y, explored)
+        if chunk is not None:
+            chunk[CHUNK_CELLS + o] = 1 if explored else 0
+
+    def _boxes(self, (x, y), (w, h)):
+        """
+        Splits a box of the grid by chunks.
+
+        Raises IndexError if the box is not inside the grid.
+
+        Returns:
+          list of (chunk key, (x1,y1), (x2,y2)) for every chunk under
+          the box, with the part of the box in the chunk (grid
+          coordinates, x2 and y2 not included)
+        """
+        if w <= 0 or h <= 0:
+            return []
+        if x < 0 or y < 0 or x + w > self.w or y + h > self.h:
+            raise IndexError("box out of grid: (%d,%d)-(%d,%d)" % (x, y, x + w - 1, y + h - 1))
+        boxes = []
+        for cy in range(y >> CHUNK_SHIFT, ((y + h - 1) >> CHUNK_SHIFT) + 1):
+            (y1, y2) = (max(y, cy << CHUNK_SHIFT), min(y + h, (cy + 1) << CHUNK_SHIFT))
+            for cx in range(x >> CHUNK_SHIFT, ((x + w - 1) >> CHUNK_SHIFT) + 1):
+                (x1, x2) = (max(x, cx << CHUNK_SHIFT), min(x + w, (cx + 1) << CHUNK_SHIFT))
+                boxes.append((cy * self.cw + cx, (x1, y1), (x2, y2)))
+        return boxes
+
+    def window(self, (x, y), (w, h)):
+        """
+        Copies a box of the grid.
+
+        Arguments:
+          (x,y) - top left corner of the box
+          (w,h) - dimensions of the box
+
+        Returns:
+          tile.TileGrid with the tiles and explored flags of the box
+        """
+        grid = TileGrid((w, h), TILENAMES[self.deftile])
+        for (k, (x1, y1), (x2, y2)) in self._boxes((x, y), (w, h)):
+            chunk = self.store.get(k)
+            if chunk is None:
+                continue
+            n = x2 - x1
+            for yy in range(y1, y2):
+                o = (x1 & CHUNK_MASK) + ((yy & CHUNK_MASK) << CHUNK_SHIFT)
+                i = (x1 - x) + (yy - y) * w
+                grid.cells[i:i + n]    = chunk[o:o + n]
+                grid.explored[i:i + n] = chunk[CHUNK_CELLS + o:CHUNK_CELLS + o + n]
+        return grid
+
+    def blit(self, grid, (x, y)):
+        """
+        Writes a tile.TileGrid (tiles and explored flags) into a box of
+        the grid.
+
+        Arguments:
+          grid  - tile.TileGrid
+          (x,y) - top left corner of the box
+        """
+        for (k, (x1, y1), (x2, y2)) in self._boxes((x, y), (grid.w, grid.h)):
+            chunk = self.store.get(k)
+            if chunk is None:
+                chunk = bytearray(self._blank)
+            n = x2 - x1
+            for yy in range(y1, y2):
+                o = (x1 & CHUNK_MASK) + ((yy & CHUNK_MASK) << CHUNK_SHIFT)
+                i = (x1 - x) + (yy - y) * grid.w
+                chunk[o:o + n] = grid.cells[i:i + n]
+                chunk[CHUNK_CELLS + o:CHUNK_CELLS + o + n] = grid.explored[i:i + n]
+            if self._blank is not None and chunk == self._blank:
+                self.store.discard(k)
+            else:
+                self.store.put(k, chunk)
+
+    def mask(self, table):
+        """
+        Gets a property mask for the whole grid (see tile.TileGrid).
+        """
+        return self.window((0, 0), (self.w, self.h)).mask(table)
+
+    def find_all(self, tipo):
+        """
+        Finds every tile of a given type in the grid (see
+        tile.TileGrid).
+        """
+        if TILEIDS[tipo] == self.deftile:
+            return self.window((0, 0), (self.w, self.h)).find_all(tipo)
+        tid = chr(TILEIDS[tipo])
+        found = []
+        for k in self.store.keys():
+            (cx, cy) = ((k % self.cw) << CHUNK_SHIFT, (k // self.cw) << CHUNK_SHIFT)
+            chunk = self.store.get(k)
+            i = chunk.find(tid, 0, CHUNK_CELLS)
+            while i != -1:
+                (x, y) = (cx + (i & CHUNK_MASK), cy + (i >> CHUNK_SHIFT))
+                if x < self.w and y < self.h:
+                    found.append((x, y))
+                i = chunk.find(tid, i + 1, CHUNK_CELLS)
+        return sorted(found, key=lambda (x, y): (y, x))
+
+    def dump(self):
+        """
+        Gets the contents of the grid, compact and picklable.
+
+        Returns:
+          dictionary of chunk key -> str with the chunk, for the
+          allocated chunks
+        """
+        return dict((k, str(self.store.get(k))) for k in self.store.keys())
+
+    def load(self, data):
+        """
+        Restores the contents of the grid.
+
+        Arguments:
+          data - contents, as given by dump
+        """
+        for k in self.store.keys():
+            self.store.discard(k)
+        for (k, chunk) in data.iteritems():
+            self.store.put(k, bytearray(chunk))
+
+class StreamStore:
+    """
+    Storage for the chunks of a streamed grid.
+
+    Chunks are generated on demand by a function of their key, which
+    must always give the same chunk for the same key. The resident
+    chunks are kept in least recently used order, along with their
+    generated contents; when there are more than maxresident, the
+    oldest ones are dropped if they did not change (they can be
+    generated again), or else kept compressed.
+
+    Chunks may be asked for in advance (prefetch): a background thread
+    generates them, so they are ready when needed.
+
+    Duck-types ChunkStore.
+
+    Methods:
+      __init__
+      __len__
+      __contains__
+      get
+      put
+      discard
+      keys
+      prefetch
+      close
+
+    Variables:
+      generator   - function of a chunk key giving the chunk tile ids
+                    (CHUNK_CELLS bytes)
+      maxresident - max number of chunks in memory
+      resident    - ordered dictionary of key -> (chunk, generated
+                    tile ids) of the chunks in memory, least recently
+                    used first, generated tile ids are None for chunks
+                    not generated (restored or put)
+      saved       - dictionary of key -> compressed chunk, of the
+                    changed chunks not in memory
+      ready       - ordered dictionary of key -> chunk, of the chunks
+                    generated in the background not yet used
+    """
+    def __init__(self, generator, maxresident=DEF_MAXRESIDENT):
+        """
+        Initializes an empty store.
+
+        Arguments:
+          generator   - function of a chunk key giving its tile ids
+          maxresident - max number of chunks in memory. Default:
+                        DEF_MAXRESIDENT
+        """
+        self.generator   = generator
+        self.maxresident = maxresident
+        self.resident    = collections.OrderedDict()
+        self.saved       = {}
+        self.ready       = collections.OrderedDict()
+        self._lock       = threading.Lock()
+        self._queue      = None
+        self._pending    = set()
+
+    def __len__(self):
+        """
+        Number of chunks held, in memory or compressed.
+        """
+        return len(self.resident) + len(self.saved)
+
+    def __contains__(self, k):
+        return k in self.resident or k in self.saved
+
+    def get(self, k):
+        """
+        Gets a chunk, generating it if needed.
+
+        Arguments:
+          k - key of the chunk
+
+        Returns:
+          bytearray with the chunk
+        """
+        entry = self.resident.pop(k, None)
+        if entry is None:
+            if k in self.saved:
+                entry = (bytearray(zlib.decompress(self.saved.pop(k))), None)
+            else:
+                with self._lock:
+                    cells = self.ready.pop(k, None)
+                if cells is None:
+                    cells = self.generator(k)
+                entry = (bytearray(cells) + bytearray(CHUNK_CELLS), cells)
+        self._keep(k, entry)
+        return entry[0]
+
+    def put(self, k, chunk):
+        """
+        Stores a chunk.
+        """
+        self.resident.pop(k, None)
+        self.saved.pop(k, None)
+        self._keep(k, (chunk, None))
+
+    def discard(self, k):
+        """
+        Drops a chunk, it will be generated again.
+        """
+        self.resident.pop(k, None)
+        self.saved.pop(k, None)
+
+    def keys(self):
+        """
+        Gets the keys of the chunks held, sorted.
+        """
+        return sorted(set(self.saved).union(self.resident))
+
+    def prefetch(self, keys):
+        """
+        Asks for some chunks to be generated in the background, if not
+        held yet.
+
+        Arguments:
+          keys - keys of the chunks
+        """
+        with self._lock:
+            keys = [ k for k in keys if k not in self.resident and k not in self.saved and
+                     k not in self.ready and k not in self._pending ]
+            self._pending.update(keys)
+        if not keys:
+            return
+        if self._queue is None:
+            self._queue = Queue.Queue()
+            worker = threading.Thread(target=self._work, name='chunk-prefetch')
+            worker.daemon = True
+            worker.start()
+        for k in keys:
+            self._queue.put(k)
+
+    def close(self):
+        """
+        Stops the background thread, if any.
+        """
+        if self._queue is not None:
+            self._queue.put(None)
+            self._queue = None
+
+    def _work(self):
+        """
+        Background thread, generates the prefetched chunks.
+        """
+        queue = self._queue
+        while True:
+            k = queue.get()
+            if k is None:
+                return
+            try:
+                cells = self.generator(k)
+            except Exception as e:
+                log.error("could not generate chunk %s: %s" % (str(k), str(e)))
+                cells = None
+            with self._lock:
+                self._pending.discard(k)
+                if cells is not None:
+                    self.ready[k] = cells
+                    while len(self.ready) > self.maxresident:
+                        self.ready.popitem(last=False)
+
+    def _keep(self, k, entry):
+        """
+        Makes a chunk the most recently used one, dropping (or
+        compressing) the least recently used ones if there are too
+        many.
+        """
+        self.resident[k] = entry
+        while len(self.resident) > self.maxresident:
+            (old, (chunk, cells)) = self.resident.popitem(last=False)
+            if cells is None or chunk[:CHUNK_CELLS] != cells or chunk.find(chr(1), CHUNK_CELLS) != -1:
+                self.saved[old] = zlib.compress(str(chunk))
+
+class StreamedGrid(ChunkedGrid):
+    """
+    2D grid of tiles stored in chunks, generated on demand.
+
+    The grid may be huge (virtually infinite): chunks are generated
+    the first time a cell in them is accessed, by a function of the
+    chunk coordinates, and only the chunks changed or explored (plus
+    the ones recently used) are held (see StreamStore).
+
+    Duck-types tile.TileGrid, as ChunkedGrid.
+
+    Methods:
+      __init__
+      prefetch
+      dump
+      load
+
+    Variables:
+      generator - function of (cx, cy) giving the tile ids of the
+                  chunk at those chunk coordinates
+    """
+    def __init__(self, (w, h), generator, maxresident=DEF_MAXRESIDENT):
+        """
+        Initializes the grid.
+
+        Arguments:
+          (w, h)      - grid dimensions
+          generator   - function of the chunk coordinates (cx, cy),
+                        giving the CHUNK_CELLS tile ids of the chunk
+                        (row-major)
+          maxresident - max number of chunks in memory. Default:
+                        DEF_MAXRESIDENT
+        """
+        ChunkedGrid.__init__(self, (w, h))
+        self.generator = generator
+        self.store     = StreamStore(lambda k: self.generator(k % self.cw, k // self.cw), maxresident)
+        self._blank    = None
+
+    def prefetch(self, (x, y), radius=1):
+        """
+        Asks for the chunks around some coordinates to be generated in
+        the background.
+
+        Arguments:
+          (x,y)  - coordinates
+          radius - chunks around the one holding the coordinates, in
+                   every direction. Default: 1
+        """
+        (cx, cy) = (x >> CHUNK_SHIFT, y >> CHUNK_SHIFT)
+        self.store.prefetch([ j * self.cw + i
+                              for j in range(max(0, cy - radius), min(self.ch, cy + radius + 1))
+                              for i in range(max(0, cx - radius), min(self.cw, cx + radius + 1)) ])
+
+    def dump(self):
+        """
+        Gets the contents of the grid, compact and picklable: just the
+        chunks changed or explored, which could not be generated again.
+
+        Returns:
+          dictionary of chunk key -> compressed str with the chunk
+        """
+        data = dict(self.store.saved)
+        for (k, (chunk, cells)) in self.store.resident.iteritems():
+            if cells is None or chunk[:CHUNK_CELLS] != cells or chunk.find(chr(1), CHUNK_CELLS) != -1:
+                data[k] = zlib.compress(str(chunk))
+        return data
+
+    def load(self, data):
+        """
+        Restores the contents of the grid.
+
+        Arguments:
+          data - contents, as given by dump
+        """
+        self.store.resident.clear()
+        self.store.saved = dict(data)
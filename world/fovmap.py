@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+fovmap.py
+
+RogueLike field of view maps.
+
+The libtcod FOV maps hold, for every cell, whether it is transparent
+and walkable. Setting them cell by cell (tcod.map_set_properties, a
+ctypes call per cell) is far too slow for big maps, so the properties
+of a whole grid are computed at once, as a bytes buffer (see
+TileRegistry.fov_table), and copied into the map in bulk.
+
+The buffer holds a byte per cell, with the layout libtcod uses for the
+cells of its maps (bit 0 transparent, bit 1 walkable, bit 2 in the
+field of view), so it is copied straight into the cells of the map
+when the map structure is the expected one. Otherwise the map is
+cleared with the most common value, and only the cells with a
+different one are set.
+
+The FOV maps of a level are shared by every player on it, and kept
+while the level is (see mapa.Map.get_fov): a LevelFov holds them, and
+computes the field of view of a player into a Visibility, a small
+buffer with just the cells around the player, which is all a player
+keeps.
+
+  class LevelFov        : the FOV maps of a level
+
+  class Visibility      : field of view of a player
+
+  function fill_fov_map : sets the cells of a FOV map from a buffer
+"""
+
+import ctypes
+import logging
+import re
+from collections import OrderedDict
+
+import libtcod.libtcodpy as tcod
+from tile import TILEREG
+
+log = logging.getLogger('roguelike.fovmap')
+
+"""Values of the cells of a FOV map (as in TileRegistry.fov_table)."""
+TRANSPARENT = 1
+WALKABLE = 2
+
+"""Bit of the cells of a libtcod FOV map set when in the field of view."""
+IN_FOV = 4
+
+"""Translation table, FOV map cell to chr(1) if in the field of view."""
+IN_FOV_TABLE = ''.join(chr(1) if c & IN_FOV else chr(0) for c in range(256))
+
+"""Maximum number of FOV windows kept for a chunked map."""
+MAX_WINDOWS = 16
+
+"""
+Tells if the field of view computed by libtcod can be read straight
+from the IN_FOV bit of the map cells, None until checked (see
+_in_fov_readable).
+"""
+_IN_FOV_READABLE = None
+
+class _MapData(ctypes.Structure):
+    """
+    Head of the libtcod map structure.
+    """
+    _fields_ = [('width', ctypes.c_int),
+                ('height', ctypes.c_int),
+                ('nbcells', ctypes.c_int),
+                ('cells', ctypes.c_void_p)]
+
+class Visibility:
+    """
+    Field of view of a player: which cells of a box of the map, around
+    the player, are in view.
+
+    Methods:
+      __init__
+      is_in_fov
+
+    Variables:
+      (x0,y0) - map coordinates of the first cell of the box
+      (w,h)   - box dimensions
+      cells   - bytearray, 1 for the cells in view (row-major)
+    """
+    def __init__(self):
+        """
+        Initializes an empty field of view, with nothing in view.
+        """
+        (self.x0, self.y0, self.w, self.h) = (0, 0, 0, 0)
+        self.cells = bytearray()
+
+    def is_in_fov(self, x, y):
+        """
+        Tells if a cell is in view.
+
+        Arguments:
+          (x,y) - map coordinates of the cell
+
+        Returns:
+          True if in the field of view
+        """
+        (x, y) = (x - self.x0, y - self.y0)
+        return 0 <= x < self.w and 0 <= y < self.h and self.cells[x + y * self.w] == 1
+
+class LevelFov:
+    """
+    FOV maps of a level (transparent and walkable cells), shared by
+    every player on it.
+
+    Maps which are not chunked get a single FOV map, covering the whole
+    map. Chunked maps get windows just big enough for a field of view
+    plus a margin (so only the chunks near the players get touched),
+    whose origins are multiples of the margin: players near each other
+    share the same window, and a window is used until a player moves
+    the margin out of it. The last MAX_WINDOWS windows used are kept.
+
+    Changes to the tiles of the map must be told (see set_tile).
+
+    Methods:
+      __init__
+      compute
+      set_tile
+
+    Variables:
+      mapa    - mapa.Map of the level
+      windows - OrderedDict of (x0,y0,w,h) box -> (FOV map, direct),
+                least recently used first, direct telling if the field
+                of view can be read straight from the cells of the FOV
+                map (its layout checked, see fill_fov_map and
+                _in_fov_readable), else it is read with map_is_in_fov
+    """
+    def __init__(self, mapa):
+        """
+        Initializes the FOV maps of a level, built when first needed.
+
+        Arguments:
+          mapa - mapa.Map of the level
+        """
+        self.mapa = mapa
+        self.windows = OrderedDict()
+
+    def _window(self, (x, y), radius, margin):
+        """
+        Gets the FOV map for a field of view, built if needed.
+
+        Returns:
+          ((x0,y0,w,h) box of the FOV map, FOV map, direct)
+        """
+        map_ = self.mapa
+        if not map_.is_chunked():
+            box = (0, 0, map_.w, map_.h)
+        else:
+            size = 2 * (radius + margin) + 1
+            (w, h) = (min(size, map_.w), min(size, map_.h))
+            box = (min(max(0, (x - radius - margin) // margin * margin), map_.w - w),
+                   min(max(0, (y - radius - margin) // margin * margin), map_.h - h), w, h)
+
+        entry = self.windows.pop(box, None)
+        if entry is None:
+            (x0, y0, w, h) = box
+            grid = map_.mapa if not map_.is_chunked() else map_.mapa.window((x0, y0), (w, h))
+            fov_map = tcod.map_new(w, h)
+            copied = fill_fov_map(fov_map, grid.mask(TILEREG.fov_table))
+            entry = (fov_map, copied and _in_fov_readable())
+            while len(self.windows) >= MAX_WINDOWS:
+                tcod.map_delete(self.windows.popitem(last=False)[1][0])
+        self.windows[box] = entry
+        return (box,) + entry
+
+    def compute(self, vis, (x, y), radius, margin=16):
+        """
+        Computes a field of view.
+
+        Arguments:
+          vis    - Visibility to leave the field of view in
+          (x,y)  - map coordinates of the viewer
+          radius - radius of the field of view
+          margin - cells a viewer may move, on chunked maps, before
+                   another window is used. Default: 16
+        """
+        ((x0, y0, ww, wh), fov_map, direct) = self._window((x, y), radius, max(1, margin))
+        tcod.map_compute_fov(fov_map, x - x0, y - y0, radius=radius, light_walls=True, algo=tcod.FOV_BASIC)
+
+        # just the box around the viewer
+        (bx1, by1) = (max(x0, x - radius), max(y0, y - radius))
+        (bx2, by2) = (min(x0 + ww, x + radius + 1), min(y0 + wh, y + radius + 1))
+        (w, h) = (bx2 - bx1, by2 - by1)
+        (vis.x0, vis.y0, vis.w, vis.h) = (bx1, by1, w, h)
+        if direct:
+            data = _MapData.from_address(getattr(fov_map, 'value', fov_map))
+            vis.cells = bytearray(''.join(ctypes.string_at(data.cells + (yy - y0) * ww + bx1 - x0, w)
+                                          for yy in xrange(by1, by2)).translate(IN_FOV_TABLE))
+        else:
+            vis.cells = bytearray(w * h)
+            for yy in xrange(by1, by2):
+                for xx in xrange(bx1, bx2):
+                    if tcod.map_is_in_fov(fov_map, xx - x0, yy - y0):
+                        vis.cells[(xx - bx1) + (yy - by1) * w] = 1
+
+    def set_tile(self, x, y):
+        """
+        Updates the FOV maps after a cell of the map changed.
+
+        Arguments:
+          (x,y) - map coordinates of the cell
+        """
+        v = ord(TILEREG.fov_table[self.mapa.mapa.get(x, y)])
+        for ((x0, y0, w, h), (fov_map, direct)) in self.windows.iteritems():
+            if x0 <= x < x0 + w and y0 <= y < y0 + h:
+                tcod.map_set_properties(fov_map, x - x0, y - y0, v & TRANSPARENT != 0, v & WALKABLE != 0)
+
+def fill_fov_map(fov_map, cells):
+    """
+    Sets the properties of every cell of a FOV map.
+
+    Arguments:
+      fov_map - libtcod FOV map
+      cells   - str or bytearray with a byte per cell (row-major), as
+                given by TileRegistry.fov_table
+
+    Returns:
+      True if the buffer was copied straight into the map cells (so
+      they can be read back the same way, see LevelFov)
+    """
+    cells = str(cells)
+    if _copy_cells(fov_map, cells):
+        return True
+
+    (w, h) = (tcod.map_get_width(fov_map), tcod.map_get_height(fov_map))
+    counts = [ cells.count(chr(v)) for v in range(4) ]
+    common = counts.index(max(counts))
+    tcod.map_clear(fov_map, common & TRANSPARENT != 0, common & WALKABLE != 0)
+    # runs of cells not holding the common value
+    for m in re.finditer('[^%s]+' % re.escape(chr(common)), cells):
+        for i in xrange(m.start(), m.end()):
+            v = ord(cells[i])
+            tcod.map_set_properties(fov_map, i % w, i // w, v & TRANSPARENT != 0, v & WALKABLE != 0)
+    return False
+
+def _copy_cells(fov_map, cells):
+    """
+    Copies the cells buffer straight into the libtcod map structure,
+    when it is laid out as expected.
+
+    The layout is checked before writing anything: the head of the
+    structure must match the libtcod accessors, and two cells set
+    through libtcod must read back as a byte each, with the
+    transparent and walkable bits where the buffer has them. After
+    the copy, the whole cells of the map are compared with the
+    buffer.
+
+    Returns:
+      True if copied
+    """
+    lib = getattr(tcod, '_lib', None)
+    if lib is None:
+        return False
+    ptr = getattr(fov_map, 'value', fov_map)
+    if not isinstance(ptr, (int, long)) or not ptr:
+        return False
+    (w, h) = (tcod.map_get_width(fov_map), tcod.map_get_height(fov_map))
+    data = _MapData.from_address(ptr)
+    if (data.width, data.height, data.nbcells) != (w, h, w * h) or not data.cells or len(cells) != w * h:
+        return False
+    if w * h < 2 or not _probe_cells(fov_map, data):
+        log.warning("Unexpected libtcod map cells layout, FOV maps set cell by cell")
+        return False
+
+    ctypes.memmove(data.cells, cells, w * h)
+    if ctypes.string_at(data.cells, w * h) != cells:
+        log.warning("libtcod map cells differ after the copy, FOV maps set cell by cell")
+        return False
+    return True
+
+def _in_fov_readable():
+    """
+    Tells if the field of view computed by libtcod is left in the
+    IN_FOV bit of the cells of its maps. Checked once, on a small map
+    (a wall in a row of floor) whose cells are compared with
+    map_is_in_fov after computing its field of view.
+    """
+    global _IN_FOV_READABLE
+    if _IN_FOV_READABLE is None:
+        _IN_FOV_READABLE = False
+        probe = tcod.map_new(5, 1)
+        try:
+            floor = chr(TRANSPARENT | WALKABLE)
+            if _copy_cells(probe, floor * 2 + chr(0) + floor * 2):
+                tcod.map_compute_fov(probe, 0, 0, radius=4, light_walls=True, algo=tcod.FOV_BASIC)
+                data = _MapData.from_address(getattr(probe, 'value', probe))
+                bits = [ ord(c) & IN_FOV != 0 for c in ctypes.string_at(data.cells, 5) ]
+                infov = [ bool(tcod.map_is_in_fov(probe, x, 0)) for x in range(5) ]
+                _IN_FOV_READABLE = bits == infov and True in infov and False in infov
+        finally:
+            tcod.map_delete(probe)
+        if not _IN_FOV_READABLE:
+            log.warning("Unexpected libtcod field of view layout, read cell by cell")
+    return _IN_FOV_READABLE
+
+def _probe_cells(fov_map, data):
+    """
+    Tells if the first two cells of a libtcod map, set through
+    libtcod, read back as one byte per cell with TRANSPARENT and
+    WALKABLE bits.
+    """
+    tcod.map_set_properties(fov_map, 0, 0, True, False)
+    tcod.map_set_properties(fov_map, 1 % data.width, 1 // data.width, False, True)
+    probe = [ ord(c) & ~IN_FOV for c in ctypes.string_at(data.cells, 2) ]
+    return probe == [TRANSPARENT, WALKABLE]
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+genrandom.py
+
+RogueLike random numbers for the map generators.
+
+Generators need lots of random numbers (millions, for big maps), and
+drawing them one by one from the level random number generator (a
+libtcod one, through ctypes) costs more than using them. The level
+generator only gives the seed of a GenRandom, which draws its numbers
+in batches, whole arrays at once.
+
+The sequence is stable, part of the maps format (changing it changes
+every generated map, see mapa.GENERATOR_VERSION): a GenRandom is a
+stream of 32 bits words, the outputs of the MT19937 generator seeded
+with the seed (as python's random.Random(seed), whose getrandbits gives
+the words least significant first). Every draw takes the next words of
+the stream:
+
+  int in [lo, hi]      - one word w: lo + (w * (hi - lo + 1)) >> 32
+  float in [0, 1)      - one word w: w / 2**32
+  k random bits        - ceil(k / 32) words, least significant first
+  shuffle of n items   - n - 1 words, swapping item i (from the last
+                         one down to 1) with item randint(0, i)
+
+  class GenRandom : batched random numbers generator
+"""
+
+import binascii
+import random
+import sys
+from array import array
+
+"""Words drawn at once to serve single draws."""
+BATCH = 1024
+
+class GenRandom:
+    """
+    Random numbers generator drawing its numbers in batches.
+
+    Arrays of numbers (words, ints, floats) are drawn in a single call;
+    single numbers (randint, random...) are served from a buffer of
+    BATCH words. Both take the words in the same order (see module
+    documentation), so mixing them does not change the sequence.
+
+    It duck-types the random.Random methods used by the generators
+    (randint, randrange, random, choice, shuffle, getrandbits).
+
+    Methods:
+      __init__
+      words
+      ints
+      floats
+      getrandbits
+      randint
+      randrange
+      random
+      choice
+      shuffle
+
+    Variables:
+      seed - the seed
+    """
+    def __init__(self, seed):
+        """
+        Initializes the generator.
+
+        Arguments:
+          seed - int seed, usually drawn from the level random number
+                 generator
+        """
+        self.seed = seed
+        self._mt = random.Random(seed)
+        self._buf = array('i')
+        self._pos = 0
+
+    def _draw(self, n):
+        """
+        Draws the next n words straight from the stream, as signed
+        ints (so they are python ints, not longs: mask them with
+        0xffffffff to get the words).
+        """
+        bits = self._mt.getrandbits(32 * n)
+        words = array('i', binascii.unhexlify('%0*x' % (8 * n, bits))[::-1])
+        if sys.byteorder == 'big':
+            words.byteswap()
+        return words
+
+    def _words(self, n):
+        """
+        Draws the next n words, as signed ints (see _draw).
+        """
+        if n <= 0:
+            return array('i')
+        left = len(self._buf) - self._pos
+        if left == 0:
+            return self._draw(n)
+        take = min(left, n)
+        words = self._buf[self._pos:self._pos + take]
+        self._pos += take
+        if n > take:
+            words.extend(self._draw(n - take))
+        return words
+
+    def words(self, n):
+        """
+        Draws n words.
+
+        Returns:
+          array('I') with n ints in [0, 2**32)
+        """
+        return array('I', self._words(n).tostring())
+
+    def ints(self, n, lo, hi):
+        """
+        Draws n ints in [lo, hi] (hi - lo < 2**32).
+
+        Returns:
+          list of n ints
+        """
+        span = hi - lo + 1
+        return [ lo + (((w & 0xffffffff) * span) >> 32) for w in self._words(n) ]
+
+    def floats(self, n):
+        """
+        Draws n floats in [0, 1).
+
+        Returns:
+          list of n floats
+        """
+        return [ (w & 0xffffffff) / 4294967296.0 for w in self._words(n) ]
+
+    def getrandbits(self, k):
+        """
+        Draws a k bits int.
+        """
+        n = (k + 31) // 32
+        words = self._words(n)
+        if sys.byteorder == 'big':
+            words.byteswap()
+        return int(binascii.hexlify(words.tostring()[::-1]) or '0', 16) & ((1 << k) - 1)
+
+    def _word(self):
+        """
+        Draws a single word, from the buffer.
+        """
+        if self._pos == len(self._buf):
+            self._buf = self._draw(BATCH)
+            self._pos = 0
+        self._pos += 1
+        return self._buf[self._pos - 1] & 0xffffffff
+
+    def randint(self, lo, hi):
+        """
+        Draws an int in [lo, hi] (hi - lo < 2**32).
+        """
+        return lo + ((self._word() * (hi - lo + 1)) >> 32)
+
+    def randrange(self, n):
+        """
+        Draws an int in [0, n).
+        """
+        return (self._word() * n) >> 32
+
+    def random(self):
+        """
+        Draws a float in [0, 1).
+        """
+        return self._word() / 4294967296.0
+
+    def choice(self, seq):
+        """
+        Picks an item of a (non empty) sequence.
+        """
+        return seq[(self._word() * len(seq)) >> 32]
+
+    def shuffle(self, seq):
+        """
+        Shuffles a sequence in place.
+        """
+        n = len(seq)
+        words = self._words(n - 1)
+        for i in xrange(n - 1, 0, -1):
+            j = ((words[n - 1 - i] & 0xffffffff) * (i + 1)) >> 32
+            (seq[i], seq[j]) = (seq[j], seq[i])
@@ -19,19 +19,30 @@ import time, calendar
 
 import mapa
 import game.util as util
-from tile import TILETYPES
+from tile import TILEREG
 
 log = logging.getLogger('roguelike.level')
 
 """Maximum number of objects to be generated in a given room, by type"""
 MAX_ROOM_OBJECTS = {'monster': 3, 'item': 2}
 
-class Level:
+class Level(object):
     """
     A level in the world class.
 
+    A level is created as a lightweight descriptor of itself (its id,
+    name, branch and type of map), its map gets built (materialized)
+    only when it is first needed: when a player enters the level or
+    anything asks for the level map.
+
     Methods:
       __init__
+      materialize
+      is_materialized
+      cache_key
+      is_blocked
+      same_region
+      room_at
       place_objects
 
     Variables:
@@ -43,20 +54,27 @@ class Level:
       ismaraudable - tells if this level can be displayed in a
                      Marauder's map
       branch       - The world's branch to which the level belongs
-      mapa         - The associated map of the level
+      maptype      - mapa.MAPTYPES of the associated map of the level
+      seed         - seed for the random number generator of the level
+      rng          - the random number generator for the level map
+                     (created along with the map)
+      cache        - levelcache.LevelCache for the level map, or None
+      mapa         - The associated map of the level (built on first
+                     access)
 
     TODO:
       - make __str__ method to print the level as a map with objects
         (perhaps returning a tile.Tile array)
     """
-    def __init__(self, numlevel, name, branch, rng):
+    def __init__(self, numlevel, name, branch, seed, cache=None):
         """
         Initialize the level.
 
         -A new level is 'empty' (has no objects).
         -A new level must have an id (numlevel) and a name.
         -A new level must belong to a given world's branch.
-        -A new level must have an associated map.
+        -A new level must have an associated map, but it is not built
+         yet (see materialize).
 
         Given a branch, the type of map to be associated must be
         decided.
@@ -65,7 +83,10 @@ class Level:
           numlevel - the level id number
           name     - the generic name for the level
           branch   - the branch in the world to which this level belongs
-          rng      - the world's random number generator
+          seed     - seed for the level random number generator,
+                     given by the world
+          cache    - levelcache.LevelCache where the level map may
+                     be found/stored. Default: None (no cache)
 
         TODO:
           - Right now the rules for deciding the type of map to
@@ -88,14 +109,16 @@ class Level:
             maptype = self.branch['maptypes'][0] if numlevel < 5 else self.branch['maptypes'][1]
 
         elif self.branch['name'] == 'dungeons':
-            maptype = self.branch['maptypes'][0] if numlevel > -5 else self.branch['maptypres'][1]
+            maptype = self.branch['maptypes'][0] if numlevel > -5 else self.branch['maptypes'][1]
 
         elif self.branch['name'] == 'woods':
             maptype = self.branch['maptypes'][0]
 
         elif self.branch['name'] == 'from_file':
             maptype = self.branch['maptypes'][0]
-            maptype['makeparams']['numlevel'] = numlevel
+            # own copy of the makeparams, the MAPTYPES ones are shared
+            # between every level
+            maptype = dict(maptype, makeparams=dict(maptype['makeparams'], numlevel=numlevel))
 
         if numlevel > 10 or numlevel < -10:
             maptype = mapa.MAPTYPES.labyrinth
@@ -104,7 +127,85 @@ class Level:
         if False and util.debug:
             maptype=mapa.MAPTYPES.dungeon2
 
-        self.mapa = getattr(mapa, maptype['name'])(maptype, rng)
+        self.maptype = maptype
+        self.seed    = seed
+        self.rng     = None
+        self.cache   = cache
+        self._mapa   = None
+
+    @property
+    def mapa(self):
+        """
+        The associated map of the level, built on first access.
+        """
+        if self._mapa is None:
+            self.materialize()
+        return self._mapa
+
+    def materialize(self, state=None):
+        """
+        Builds the associated map of the level, if not already built.
+
+        The map gets its own random number generator, from the level
+        seed, so the map is always the same for the same seed no
+        matter when (or where) it is built.
+
+        If the level has a cache, the map is restored from it when
+        possible, else the built map gets stored in it. Cache entries
+        which do not fit the map (see mapa.Map.set_state) are dropped
+        and the map generated again.
+
+        Arguments:
+          state - generated state for the map (see
+                  mapa.Map.get_state), if the map was already
+                  generated elsewhere. Default: None
+
+        Returns:
+          the map of the level
+        """
+        if self._mapa is None:
+            key = self.cache_key()
+            cached = False
+            if state is None and key is not None:
+                state = self.cache.get(key)
+                cached = state is not None
+
+            log.debug("Building map for level %s (%s), seed %d" % (str(self.numlevel), self.name, self.seed))
+            self.rng = tcod.random_new_from_seed(self.seed)
+            try:
+                self._mapa = getattr(mapa, self.maptype['name'])(self.maptype, self.rng, state=state)
+            except ValueError as e:
+                if not cached:
+                    raise
+                # a cached state not fitting the map, as a corrupted
+                # entry: dropped, and the map generated again
+                log.warning("Level cache entry does not fit level %s: %s" % (str(self.numlevel), str(e)))
+                self.cache.discard(key)
+                cached = False
+                self.rng = tcod.random_new_from_seed(self.seed)
+                self._mapa = getattr(mapa, self.maptype['name'])(self.maptype, self.rng)
+
+            if key is not None and not cached:
+                self.cache.put(key, self._mapa.get_state())
+        return self._mapa
+
+    def is_materialized(self):
+        """
+        Tells if the map of the level has already been built.
+        """
+        return self._mapa is not None
+
+    def cache_key(self):
+        """
+        Gets the key of the level map in the level cache.
+
+        Returns:
+          the cache key, or None if the level has no cache or its type
+          of map is not cacheable
+        """
+        if self.cache is None or not getattr(mapa, self.maptype['name']).CACHEABLE:
+            return None
+        return self.cache.key(self.seed, self.branch['name'], self.numlevel, self.maptype)
 
     def is_blocked(self, x, y):
         """
@@ -116,7 +217,7 @@ class Level:
         Returns:
           Boolean indicating if coordinates are blocked for movement.
         """
-        if TILETYPES[self.mapa.mapa[x][y].tipo]['block_pass'] == True:
+        if TILEREG.block_pass[self.mapa.mapa.get(x, y)]:
             return True
 
         for objeto in self.objects:
@@ -125,6 +226,41 @@ class Level:
 
         return False
 
+    def same_region(self, a, b):
+        """
+        Determines if a cell of the level can be reached from other one
+        (regardless of the objects in the way).
+
+        Arguments:
+          a - (x,y) coordinates of a cell
+          b - (x,y) coordinates of the other cell
+
+        Returns:
+          Boolean indicating if both cells are passable and connected.
+
+        Raises:
+          Exception, on levels with chunked maps (see
+          mapa.Map.get_regions)
+        """
+        return self.mapa.same_region(a, b)
+
+    def room_at(self, x, y):
+        """
+        Determines the room a cell of the level is in.
+
+        Arguments:
+          (x,y) - coordinates of the cell
+
+        Returns:
+          the room (room.roomgeo instance), None if the cell is not in
+          any room (see mapa.Map.get_room_map, for the room ids and
+          their adjacency graph)
+
+        Raises:
+          Exception, on levels with chunked maps
+        """
+        return self.mapa.room_at(x, y)
+
     def place_objects(self):
         """
         Place random objects in level.
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+levelcache.py
+
+RogueLike persistent cache of generated levels.
+
+Generating a map may be expensive, and the same map is generated again
+for the same level and seed on every run. The cache stores the
+generated state of the maps (see mapa.Map.get_state: tile ids, rooms,
+stairs...) in a directory, so a known level gets restored instead of
+generated.
+
+Entries are keyed by everything the generated map depends on: the
+level seed (which is derived from the world seed and the level branch
+and number), the level branch and number, the whole map type (name,
+default tile, dimensions, split, makeparams and stages), and the
+generators version (mapa.GENERATOR_VERSION and the tile ids,
+tile.TILEREG.hash).
+
+Each entry is a file holding a checksum of its contents, so corrupted
+entries are detected (and removed) instead of restored. The cache is
+size bounded: when it grows beyond its maximum size, the least
+recently used entries are removed.
+
+  class LevelCache : the cache of generated levels
+"""
+
+import cPickle as pickle
+import hashlib
+import logging
+import os
+import zlib
+
+import mapa
+from tile import TILEREG
+
+log = logging.getLogger('roguelike.levelcache')
+
+class LevelCache:
+    """
+    Persistent, size bounded, cache of generated levels.
+
+    Entries are files named after their key in the cache directory,
+    their modification time is their last use time (for the LRU
+    eviction).
+
+    Entry file format:
+      magic   - 4 chars, ENTRY_MAGIC
+      digest  - 20 chars, sha1 digest of the payload
+      payload - the pickled map state, zlib compressed
+
+    Methods:
+      __init__
+      key
+      has
+      get
+      put
+      discard
+      evict
+
+    Variables:
+      path    - cache directory
+      maxsize - maximum size of the cache, in bytes
+    """
+
+    """Cache entries magic string."""
+    ENTRY_MAGIC = 'RLCE'
+
+    """Cache entries extension."""
+    ENTRY_EXT = '.lvl'
+
+    """Default maximum size of the cache, in bytes."""
+    DEF_MAXSIZE = 64 * 1024 * 1024
+
+    def __init__(self, path, maxsize=DEF_MAXSIZE):
+        """
+        Initializes the cache, creating its directory if needed.
+
+        Arguments:
+          path    - cache directory
+          maxsize - maximum size of the cache, in bytes. Default:
+                    DEF_MAXSIZE
+        """
+        self.path    = path
+        self.maxsize = maxsize
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def key(self, seed, branch, numlevel, maptype):
+        """
+        Gets the key for a level map.
+
+        Arguments:
+          seed     - the level seed
+          branch   - name of the level branch
+          numlevel - the level id number
+          maptype  - mapa.MAPTYPES of the level map
+
+        Returns:
+          str with the key
+        """
+        params = sorted(maptype['makeparams'].items())
+        stages = [ (name, sorted(p.items())) for (name, p) in maptype.get('stages', []) ]
+        split = sorted(maptype['split'].items()) if 'split' in maptype else None
+        tipo = (maptype['name'], maptype['deftile'], tuple(maptype.get('dims', mapa.DEF_MAP_DIMS)), split,
+                params, stages)
+        return hashlib.sha1(repr((seed, branch, numlevel, tipo,
+                                  mapa.GENERATOR_VERSION, TILEREG.hash))).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.path, key + self.ENTRY_EXT)
+
+    def has(self, key):
+        """
+        Tells if there is an entry for some key (it may be corrupted
+        though).
+        """
+        return os.path.exists(self._entry(key))
+
+    def get(self, key):
+        """
+        Gets the map state stored for some key.
+
+        A corrupted entry is removed.
+
+        Arguments:
+          key - the entry key (see key)
+
+        Returns:
+          the map state, or None if there is no valid entry for the key
+        """
+        entry = self._entry(key)
+        try:
+            with open(entry, 'rb') as f:
+                data = f.read()
+        except IOError:
+            return None
+
+        hdr = len(self.ENTRY_MAGIC) + 20
+        try:
+            if (data[:len(self.ENTRY_MAGIC)] != self.ENTRY_MAGIC or
+                hashlib.sha1(data[hdr:]).digest() != data[len(self.ENTRY_MAGIC):hdr]):
+                raise ValueError("bad checksum")
+            state = pickle.loads(zlib.decompress(data[hdr:]))
+        except Exception as e:
+            log.warning("Removing corrupted level cache entry %s: %s" % (entry, str(e)))
+            self._remove(entry)
+            return None
+
+        # touch it, for the LRU eviction
+        try:
+            os.utime(entry, None)
+        except OSError:
+            pass
+
+        log.debug("Level cache hit: %s" % key)
+        return state
+
+    def put(self, key, state):
+        """
+        Stores a map state.
+
+        The entry is written aside and then renamed, so readers never
+        see a half written entry. Evicts old entries if the cache grows
+        beyond its maximum size.
+
+        Arguments:
+          key   - the entry key (see key)
+          state - the map state (see mapa.Map.get_state)
+        """
+        payload = zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL), 1)
+        entry = self._entry(key)
+        tmp = entry + '.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(self.ENTRY_MAGIC)
+                f.write(hashlib.sha1(payload).digest())
+                f.write(payload)
+            os.rename(tmp, entry)
+        except (IOError, OSError) as e:
+            log.warning("Could not store level cache entry %s: %s" % (entry, str(e)))
+            self._remove(tmp)
+            return
+
+        log.debug("Level cache store: %s" % key)
+        self.evict()
+
+    def discard(self, key):
+        """
+        Removes the entry for some key, if any (a valid entry which
+        turned out not to fit its level, say).
+
+        Arguments:
+          key - the entry key (see key)
+        """
+        log.warning("Removing level cache entry %s" % key)
+        self._remove(self._entry(key))
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits
+        in its maximum size.
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            if not name.endswith(self.ENTRY_EXT):
+                continue
+            entry = os.path.join(self.path, name)
+            try:
+                st = os.stat(entry)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry))
+            total += st.st_size
+
+        entries.sort()
+        for (mtime, size, entry) in entries:
+            if total <= self.maxsize:
+                break
+            log.debug("Level cache evict: %s" % entry)
+            self._remove(entry)
+            total -= size
+
+    def _remove(self, entry):
+        try:
+            os.remove(entry)
+        except OSError:
+            pass
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+levfile.py
+
+RogueLike level files.
+
+Predesigned levels are stored as text files in the levels subdir, one
+line per row of the map and one character per tile (see the file_char
+of each tile.TILETYPES).
+
+A level may also be compiled into a binary file (same name, .levc
+extension) which is loaded with no parsing at all: a small header
+followed by the raw grid of tile ids, which gets memory mapped and
+copied straight into the map grid. The compiled file is used only if
+it is newer than the text file and was compiled with the same
+COMPILED_VERSION and tile ids (tile.TILEREG.hash), else the text file
+is loaded instead.
+
+Compiled header (little endian):
+  magic     - 4 chars, COMPILED_MAGIC
+  version   - uint16, COMPILED_VERSION
+  (w,h)     - uint16 x2, grid dimensions
+  reghash   - 20 chars, tile.TILEREG.hash at compile time
+  (ix,iy)   - int16 x2, init point coordinates, (-1,-1) if none
+  nstairs   - uint32, number of stairs
+  stairs    - (uint16,uint16) x nstairs, stairs coordinates
+followed by w*h uint8 tile ids, row-major.
+
+  function level_name     : base filename for a level number
+
+  function level_path     : path of the file for a level number
+
+  function decode         : decodes the contents of a level text file
+                            into a tile.TileGrid
+
+  function compile_grid   : builds the compiled binary form of a tile
+                            grid
+
+  function compile_lev    : compiles a level text file
+
+  function write_compiled : writes the compiled file of a tile grid
+
+  function load_compiled  : loads a compiled level file into a
+                            tile.TileGrid, if it is not stale
+
+  function load           : loads a level into a tile.TileGrid, from
+                            its compiled file or else from its text
+                            file
+"""
+
+import logging
+import mmap
+import os
+import struct
+
+from tile import TILEREG, TileGrid
+
+log = logging.getLogger('roguelike.levfile')
+
+"""Directory holding the level files."""
+LEVELS_DIR = 'world/levels'
+
+def level_name(numlevel):
+    """
+    Gets the base filename (no extension) for a level number.
+
+    Negative numbers get an 'm' instead of the minus sign.
+    """
+    return str(numlevel).replace('-', 'm')
+
+"""Compiled level files magic string."""
+COMPILED_MAGIC = 'RLVC'
+
+"""Compiled level files format version."""
+COMPILED_VERSION = 1
+
+"""Compiled level files fixed header format."""
+COMPILED_HEADER = struct.Struct('<4sHHH20shhI')
+
+"""Compiled level files stairs coordinates format."""
+COMPILED_STAIR = struct.Struct('<HH')
+
+def level_path(numlevel, ext = 'lev'):
+    """
+    Gets the path of the file for a level number.
+
+    Arguments:
+      numlevel - level number
+      ext      - file extension. Default: 'lev'
+    """
+    return '{}/{}.{}'.format(LEVELS_DIR, level_name(numlevel), ext)
+
+def decode(data, grid, name = '?'):
+    """
+    Decodes the contents of a level text file into a tile grid.
+
+    Each line of the file is translated into tile ids in a single
+    pass with the registry file_table, and written as a whole row of
+    the grid. Every unknown character is collected and reported at
+    once, with its coordinates.
+
+    Arguments:
+      data - contents (str) of the level file
+      grid - tile.TileGrid to fill, its dimensions are the maximum
+             dimensions for the file
+      name - name of the level file, for error messages. Default: '?'
+
+    Returns:
+      (x,y) coordinates of the init point ('h' file_char) in the
+      level, or None if the level has no init point. If there are
+      several, the last one is returned.
+    """
+    unknown = chr(TILEREG.FILE_UNKNOWN)
+
+    rows = data.split('\n')
+    if rows[-1] == '':
+        rows.pop()
+    if len(rows) > grid.h:
+        raise Exception("ydim exceeds max in file {}.lev: {}".format(name, len(rows)))
+
+    errors = []
+    for y, row in enumerate(rows):
+        if len(row) > grid.w:
+            raise Exception("xdim exceeds max in file {}.lev: ({},{})".format(name, len(row), y))
+        ids = row.translate(TILEREG.file_table)
+        start = y * grid.w
+        grid.cells[start:start + len(ids)] = ids
+
+        x = ids.find(unknown)
+        while x != -1:
+            errors.append("({},{}) '{}'".format(x, y, row[x]))
+            x = ids.find(unknown, x + 1)
+
+    if errors:
+        raise Exception("unrecognizable characters in file {}.lev: {}".format(name, ', '.join(errors)))
+
+    i = grid.cells.rfind(chr(TILEREG.ids['initpoint']))
+    if i == -1:
+        return None
+    return (i % grid.w, i // grid.w)
+
+def compile_grid(grid, initpoint = None):
+    """
+    Builds the compiled binary form of a tile grid.
+
+    Arguments:
+      grid      - tile.TileGrid with the level tiles
+      initpoint - (x,y) coordinates of the init point of the level, or
+                  None. Default: None
+
+    Returns:
+      str with the contents of the compiled file
+    """
+    (ix, iy) = initpoint if initpoint is not None else (-1, -1)
+    stairs = grid.find_all('stairs')
+
+    header = COMPILED_HEADER.pack(COMPILED_MAGIC, COMPILED_VERSION, grid.w, grid.h,
+                                  TILEREG.hash, ix, iy, len(stairs))
+    return ''.join([header] +
+                   [ COMPILED_STAIR.pack(x, y) for (x, y) in stairs ] +
+                   [str(grid.cells)])
+
+def compile_lev(src, dims, dst = None):
+    """
+    Compiles a level text file.
+
+    Arguments:
+      src  - path of the level text file
+      dims - maximum dimensions of the level (the grid dimensions)
+      dst  - path of the compiled file. Default: src with .levc
+             extension
+
+    Returns:
+      path of the compiled file
+    """
+    if dst is None:
+        dst = os.path.splitext(src)[0] + '.levc'
+
+    grid = TileGrid(dims, 'air')
+    with open(src, 'rb') as f:
+        initpoint = decode(f.read(), grid, os.path.splitext(os.path.basename(src))[0])
+
+    write_compiled(dst, grid, initpoint)
+    return dst
+
+def write_compiled(dst, grid, initpoint = None):
+    """
+    Writes the compiled file of a tile grid.
+
+    The file is written aside and then renamed, so a reader never sees
+    a half written file.
+
+    Arguments:
+      dst       - path of the compiled file
+      grid      - tile.TileGrid with the level tiles
+      initpoint - (x,y) coordinates of the init point, or
+                  None. Default: None
+    """
+    tmp = dst + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(compile_grid(grid, initpoint))
+    os.rename(tmp, dst)
+    log.debug("Compiled level %s" % dst)
+
+def load_compiled(path, grid, src = None):
+    """
+    Loads a compiled level file into a tile grid.
+
+    The file is memory mapped and, after checking its header, its tile
+    ids are copied straight into the grid buffer.
+
+    Arguments:
+      path - path of the compiled file
+      grid - tile.TileGrid to fill, its dimensions are the maximum
+             dimensions for the level
+      src  - path of the level text file, the compiled file is stale
+             if older than it. Default: None (not checked)
+
+    Returns:
+      tuple (initpoint, stairs) with the init point coordinates (None
+      if the level has none) and the list of stairs coordinates, or
+      None if the compiled file is missing, stale or invalid.
+    """
+    try:
+        if src is not None and os.path.getmtime(path) < os.path.getmtime(src):
+            log.debug("Compiled level %s is stale" % path)
+            return None
+        f = open(path, 'rb')
+    except (IOError, OSError):
+        return None
+
+    with f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            return None
+        try:
+            if len(mm) < COMPILED_HEADER.size:
+                return None
+            (magic, version, w, h, reghash, ix, iy, nstairs) = COMPILED_HEADER.unpack_from(mm, 0)
+            if magic != COMPILED_MAGIC or version != COMPILED_VERSION or reghash != TILEREG.hash:
+                log.debug("Compiled level %s has another version or tile ids" % path)
+                return None
+            if w > grid.w or h > grid.h:
+                log.debug("Compiled level %s exceeds the map dimensions" % path)
+                return None
+
+            offset = COMPILED_HEADER.size + nstairs * COMPILED_STAIR.size
+            if len(mm) != offset + w * h:
+                log.debug("Compiled level %s is truncated" % path)
+                return None
+
+            stairs = [ COMPILED_STAIR.unpack_from(mm, COMPILED_HEADER.size + n * COMPILED_STAIR.size)
+                       for n in range(nstairs) ]
+
+            if w == grid.w:
+                grid.cells[:w * h] = buffer(mm, offset, w * h)
+            else:
+                for y in range(h):
+                    grid.cells[y * grid.w:y * grid.w + w] = buffer(mm, offset + y * w, w)
+        finally:
+            mm.close()
+
+    initpoint = (ix, iy) if ix >= 0 else None
+    return (initpoint, stairs)
+
+def load(numlevel, grid):
+    """
+    Loads a level into a tile grid.
+
+    Uses the compiled level file if it exists and is not stale, else
+    the level text file.
+
+    Arguments:
+      numlevel - level number
+      grid     - tile.TileGrid to fill
+
+    Returns:
+      tuple (initpoint, stairs) with the init point coordinates (None
+      if the level has none) and the list of stairs coordinates
+    """
+    src = level_path(numlevel)
+    loaded = load_compiled(level_path(numlevel, 'levc'), grid, src)
+    if loaded is not None:
+        return loaded
+
+    with open(src, 'rb') as f:
+        initpoint = decode(f.read(), grid, level_name(numlevel))
+    return (initpoint, grid.find_all('stairs'))
@@ -9,9 +9,17 @@ defined in here.
 
   tuple DEF_MAP_DIMS : default maximum dimensions for the map.
 
+  int CHUNKED_MIN_CELLS : maps bigger than this are stored in chunks.
+
+  int SPLIT_WORKERS : worker processes to generate split maps in.
+
+  int GENERATOR_VERSION : version of the map generators.
+
   map DUNG_ROOM_LIMS : limit constants for rooms (currently max, min
                        dims and total num).
 
+  list DUNG_ROOMS_STAGES : generation stages of a 'roguelike' dungeon.
+
   class MAPTYPES     : holds dictionaries to define each type of map a
                        level can have.
 
@@ -30,29 +38,80 @@ defined in here.
 
   class Cave         : Cave/Wood map.
 
+  class Wood         : Wood map.
+
+  class Overworld    : Endless wood map, generated while walked.
+
   class Labyrinth    : Labyrinthic corridors map
 
   class map_util     : Map utilities.
 
-TODO:
-  - implement generation for maps other than the Dungeon2 one.
+  function generate_state : builds a map and gets its generated state
+                            (for worker processes)
 """
 
+import heapq
+import itertools
 import libtcod.libtcodpy as tcod
 import logging
-from codecs import open as copen
-
+import multiprocessing
+import re
+from array import array
+
+import chunks
+import fovmap
+import genrandom
+import levfile
+import noise
+import pipeline
+import prefab
+import regions
 import room
+import roomgraph
 import tile
+import unionfind
 
 log = logging.getLogger('roguelike.map')
 
 """Default maximum size of the map."""
 DEF_MAP_DIMS = (320,240)
 
+"""
+Maps with more cells than this are stored in chunks (see chunks
+module), the default tile taking no memory, instead of a whole
+tile.TileGrid.
+"""
+CHUNKED_MIN_CELLS = 1024 * 1024
+
+"""
+Number of worker processes to generate the tiles of split maps in (see
+Map.make_split). None for one per CPU, 1 to generate them serially.
+Serial by default, since maps are usually built while the game runs
+(entering a level), and forking the game process then is not wanted:
+world.World.pregenerate raises it while building the levels at start.
+"""
+SPLIT_WORKERS = 1
+
 """Default limits constants concerning rooms in the map."""
 DUNG_ROOM_LIMS = {'max': 30, 'min': 10, 'num': 50}
 
+"""
+Generation stages of a 'roguelike' dungeon: random rooms, each one
+joined with the previous one (see stages module).
+"""
+DUNG_ROOMS_STAGES = [('fill',          {}),
+                     ('scatter_rooms', {'maxrooms'      : DUNG_ROOM_LIMS['num'],
+                                        'room_min_size' : DUNG_ROOM_LIMS['min'],
+                                        'room_max_size' : DUNG_ROOM_LIMS['max']}),
+                     ('chain_rooms',   {})]
+
+"""
+Version of the map generators. Must be increased whenever a change in
+any generator makes it build different maps for the same parameters
+(cached maps from older versions are then ignored, see levelcache).
+"""
+GENERATOR_VERSION = 13
+
 class MAPTYPES:
     """
     Types for different kind of level maps.
@@ -64,19 +123,34 @@ class MAPTYPES:
                    methods
       deftile    - a type of tile to cover all the map by default
       makeparams - parameters dictionary, used when building the map
+
+    And may have:
+      stages     - list of (stage name, parameters dictionary), to
+                   build the map with a pipeline of stages instead of
+                   make_map (see pipeline and stages modules)
+      dims       - map dimensions. Default: DEF_MAP_DIMS. Maps with
+                   more than CHUNKED_MIN_CELLS cells are stored in
+                   chunks (see chunks module)
+      split      - dictionary to generate big maps as independent
+                   tiles, in parallel (see Map.make_split):
+                     size - (w,h) maximum dimensions of a tile
+                     seam - type of tile for the corridors joining
+                            neighbour tiles
     """
 
     # classrooms, side by side, with central hallway
     classrooms   = {'name'       : 'Classrooms',
                     'deftile'    : 'air',
-                    'makeparams' : {}
+                    'makeparams' : {'hall'      : 3,
+                                    'templates' : ('classroom', 'classroom_small', 'lab', 'office')}
                     }
 
     # classrooms, side by side, with hallway at a side surrounding a
     # central geometric empty (maybe with stairs) hole
     classrooms2 = {'name'       : 'Classrooms2',
                    'deftile'    : 'air',
-                   'makeparams' : {}
+                   'makeparams' : {'hall'      : 3,
+                                   'templates' : ('classroom', 'classroom_small', 'lab', 'office')}
                    }
 
     # dungeon with rooms built side by side
@@ -90,27 +164,77 @@ class MAPTYPES:
     # standard 'roguelike' dungeon
     dungeon2    = {'name'       : 'Dungeon2',
                    'deftile'    : 'rock',
-                   'makeparams' : {'maxrooms'      : DUNG_ROOM_LIMS['num'],
-                                   'room_min_size' : DUNG_ROOM_LIMS['min'],
-                                   'room_max_size' : DUNG_ROOM_LIMS['max']}
+                   'makeparams' : {},
+                   'stages'     : DUNG_ROOMS_STAGES + [('stairs',   {'where' : 'first_room'}),
+                                                       ('validate', {})],
+                   'split'      : {'size' : (512, 512),
+                                   'seam' : 'dung_floor'}
                    }
 
+    # standard 'roguelike' dungeon, morphed into a cave (sharing its
+    # first stages with dungeon2)
+    dungeon2_cave = {'name'       : 'Cave',
+                     'deftile'    : 'rock',
+                     'makeparams' : {},
+                     'stages'     : DUNG_ROOMS_STAGES + [('morph',     {'noise' : 0.35, 'reach' : 3}),
+                                                         ('automaton', {'birth' : 5, 'survival' : 4, 'iterations' : 5}),
+                                                         ('connect',   {'min_region' : 12}),
+                                                         ('stairs',    {'where' : 'first_room'}),
+                                                         ('validate',  {})],
+                     'split'      : {'size' : (512, 512),
+                                     'seam' : 'dung_floor'}
+                     }
+
     # a cave
     cave         = {'name'       : 'Cave',
                     'deftile'    : 'rock',
-                    'makeparams' : {}
+                    'makeparams' : {},
+                    'stages'     : [('fill',      {}),
+                                    ('noise',     {'fill' : 0.45}),
+                                    ('automaton', {'birth' : 5, 'survival' : 4, 'iterations' : 5}),
+                                    ('connect',   {'min_region' : 12}),
+                                    ('stairs',    {}),
+                                    ('validate',  {})],
+                    'split'      : {'size' : (512, 512),
+                                    'seam' : 'dung_floor'}
                     }
 
     # a wood
     wood         = {'name'       : 'Wood',
                     'deftile'    : 'tree',
-                    'makeparams' : {}
+                    'makeparams' : {'density'      : 0.5,
+                                    'scale'        : 24,
+                                    'octaves'      : 4,
+                                    'persistence'  : 0.5,
+                                    'clearings'    : 8,
+                                    'clearing_min' : 3,
+                                    'clearing_max' : 8,
+                                    'min_region'   : 8}
+                    }
+
+    # an endless wood, generated while walked
+    overworld    = {'name'       : 'Overworld',
+                    'deftile'    : 'tree',
+                    'dims'       : (1 << 24, 1 << 24),
+                    'makeparams' : {'scale'          : 24,
+                                    'octaves'        : 4,
+                                    'persistence'    : 0.5,
+                                    'tree_level'     : 132,
+                                    'clearing_ratio' : 0.4,
+                                    'clearing_min'   : 3,
+                                    'clearing_max'   : 8,
+                                    'path_wobble'    : 8}
                     }
 
     # labyrinth between rooms (instead of standard corridors/hallways)
     labyrinth    = {'name'       : 'Labyrinth',
                     'deftile'    : 'wall',
-                    'makeparams' : {}
+                    'makeparams' : {'rooms'         : 10,
+                                    'room_min_size' : 5,
+                                    'room_max_size' : 15,
+                                    'loops'         : 0.05},
+                    'split'      : {'size' : (511, 511),
+                                    'seam' : 'dung_floor'}
                     }
 
     # special map, probably loaded from data file
@@ -132,47 +256,286 @@ class Map:
       __init__
       make_map   - overriden in daughter classes
       get_stairs - overriden in daughter classes
+      make_stages
+      make_split
+      new_random
+      get_state
+      set_state
+      new_grid
+      store_grid
+      is_chunked
+      prefetch
+      get_regions
+      same_region
+      get_room_map
+      room_at
+      get_fov
+      set_tile
 
     Variables:
       (w,h)     - map dimensions
-      mapa      - 2D array of tile.Tile
+      mapa      - tile.TileGrid (or chunks.ChunkedGrid, for big maps),
+                  the tiles of the map
       util      - map utils class
       tipo      - MAPTYPES name
       rg        - level's random number generator
       roomgeo   - geometrics for the rooms in the map
       rooms     - list of room.roomgeo instances, the rooms in the map
+      links     - list of (i,j) indices in rooms of the rooms joined by
+                  the corridors the generator carved (empty for maps
+                  whose generator does not tell them)
       (stx,sty) - initial-stairs-for-the-map coordinates
+      timings   - for maps built by stages, list of (stage name,
+                  seconds, memory growth in KB, restored from the
+                  cache) (see pipeline.Pipeline)
     """
-    def __init__(self, tipo, rg, roomgeo=room.Rect):
+    """Attributes of a map which are not part of its generated state."""
+    NOT_STATE = ('mapa', 'util', 'tipo', 'rg', 'roomgeo', '_regions', '_roommap', '_fov', 'timings')
+
+    """Tells if the generated maps of this class may be cached."""
+    CACHEABLE = True
+
+    def __init__(self, tipo, rg, roomgeo=room.Rect, state=None):
         """
         Initialize the map.
 
         -By default, it assumes rectangular shaped rooms.
-        -Fills the map 2D array with Tiles given by the 'default'
+        -Fills the map grid with the tile given by the 'default'
          according to map type
+        -If a generated state is given (see get_state), the map is
+         restored from it instead of being generated again.
+        -Big maps are generated in a tile.TileGrid, as any other, and
+         then moved to a chunks.ChunkedGrid.
+        -Maps bigger than the tiles given by the 'split' of their map
+         type are generated in tiles, in parallel (see make_split).
+        -Map types with 'stages' are built by them (see make_stages),
+         instead of by make_map.
 
         Arguments:
           tipo    - MAPTYPES name
           rg      - level's random number generator
           roomgeo - geometrics for the rooms in this map. Default:
                     room.Rect
+          state   - generated state of the map. Default: None
         """
-        (self.w, self.h)     = DEF_MAP_DIMS
+        (self.w, self.h)     = tipo.get('dims', DEF_MAP_DIMS)
         self.mapa            = None
         self.util            = map_util()
         self.tipo            = tipo
         self.rg              = rg
         self.roomgeo         = roomgeo
         (self.stx, self.sty) = (0,0)
+        self.links           = []
+        self._regions        = None
+        self._roommap        = None
+        self._fov            = None
+        self.timings         = []
 
         try:
-            self.mapa = [[ tile.Tile(tipo['deftile'])
-                           for y in range(self.h) ]
-                         for x in range(self.w) ]
-            self.rooms = self.make_map((self.w,self.h), mapa = self.mapa, **tipo['makeparams'])
+            self.mapa = self.new_grid(state is None)
+            if state is None:
+                split = tipo.get('split')
+                if split and (self.w > split['size'][0] or self.h > split['size'][1]):
+                    self.rooms = self.make_split((self.w,self.h), self.mapa, **split)
+                elif 'stages' in tipo:
+                    self.rooms = self.make_stages(self.mapa, tipo['stages'])
+                else:
+                    self.rooms = self.make_map((self.w,self.h), mapa = self.mapa, **tipo['makeparams'])
+                self.mapa = self.store_grid(self.mapa)
         except Exception as e:
             log.critical(str(e))
             raise Exception("ERROR: could not build map")
+        if state is not None:
+            self.set_state(state)
+
+    def get_state(self):
+        """
+        Gets the generated state of the map.
+
+        The state is compact and picklable: the tile ids of the map
+        (see dump in tile.TileGrid and chunks.ChunkedGrid), plus every
+        other attribute set by the generation (rooms, stairs, ...).
+
+        Returns:
+          dictionary with the generated state
+        """
+        state = dict((k, v) for (k, v) in self.__dict__.iteritems() if k not in self.NOT_STATE)
+        state['mapa'] = self.mapa.dump()
+        return state
+
+    def set_state(self, state):
+        """
+        Restores the generated state of the map.
+
+        Arguments:
+          state - generated state of the map, as given by get_state
+
+        Raises:
+          ValueError, if the state is not one of a map with the
+          dimensions of this one (see tile.TileGrid.load too)
+        """
+        if (state.get('w'), state.get('h')) != (self.w, self.h):
+            raise ValueError("map state dimensions (%s,%s) do not match the map (%d,%d)" %
+                             (state.get('w'), state.get('h'), self.w, self.h))
+        for (k, v) in state.iteritems():
+            if k == 'mapa':
+                self.mapa.load(v)
+            else:
+                setattr(self, k, v)
+
+    def new_grid(self, generating):
+        """
+        Creates the (empty) tile storage for the map.
+
+        Arguments:
+          generating - True for the storage to generate the map in, a
+                       tile.TileGrid, False for the storage to restore
+                       a generated state in
+
+        Returns:
+          tile.TileGrid, or chunks.ChunkedGrid for chunked maps being
+          restored
+        """
+        if self.is_chunked() and not generating:
+            return chunks.ChunkedGrid((self.w, self.h), self.tipo['deftile'], backing=True)
+        return tile.TileGrid((self.w, self.h), self.tipo['deftile'])
+
+    def store_grid(self, grid):
+        """
+        Gets the tile storage to keep a generated map in.
+
+        Arguments:
+          grid - the tile storage the map was generated in (see
+                 new_grid)
+
+        Returns:
+          the same grid, or a chunks.ChunkedGrid with its contents for
+          chunked maps
+        """
+        if not self.is_chunked():
+            return grid
+        chunked = chunks.ChunkedGrid((self.w, self.h), self.tipo['deftile'], backing=True)
+        chunked.blit(grid, (0, 0))
+        return chunked
+
+    def is_chunked(self):
+        """
+        Tells if the map is stored in chunks (see CHUNKED_MIN_CELLS).
+        """
+        return self.w * self.h > CHUNKED_MIN_CELLS
+
+    def prefetch(self, (x, y), (dx, dy)):
+        """
+        Tells the map a player moved, so it may get ready the parts of
+        the map ahead of it. Overriden by maps generated while played.
+
+        Arguments:
+          (x,y)   - new coordinates of the player
+          (dx,dy) - direction of the movement
+        """
+        pass
+
+    def get_regions(self):
+        """
+        Gets the connected regions of the map, labeled the first time
+        they are asked for. Labels take a word per cell of the map, so
+        they are not available for chunked maps.
+
+        Returns:
+          regions.RegionIndex of the map
+
+        Raises:
+          Exception, if the map is chunked
+        """
+        if self.is_chunked():
+            raise Exception("map regions not supported on chunked maps: %s" % self.tipo['name'])
+        if self._regions is None:
+            self._regions = regions.RegionIndex(self.mapa)
+        return self._regions
+
+    def same_region(self, a, b):
+        """
+        Tells if a cell of the map can be reached from other one.
+
+        Arguments:
+          a - (x,y) coordinates of a cell
+          b - (x,y) coordinates of the other cell
+
+        Returns:
+          True if both cells are passable and connected
+
+        Raises:
+          Exception, if the map is chunked (see get_regions)
+        """
+        return self.get_regions().same_region(a, b)
+
+    def get_room_map(self):
+        """
+        Gets the room ids of the cells of the map and the adjacency
+        graph of its rooms, built the first time they are asked for
+        (and again after the map changes). As get_regions, they are
+        not available for chunked maps.
+
+        Returns:
+          roomgraph.RoomMap of the map
+
+        Raises:
+          Exception, if the map is chunked
+        """
+        if self.is_chunked():
+            raise Exception("room map not supported on chunked maps: %s" % self.tipo['name'])
+        if self._roommap is None:
+            self._roommap = roomgraph.RoomMap(self.mapa, self.rooms, self.links)
+        return self._roommap
+
+    def room_at(self, x, y):
+        """
+        Gets the room a cell of the map is in.
+
+        Arguments:
+          (x,y) - coordinates of the cell
+
+        Returns:
+          the room (room.roomgeo instance), None if the cell is not in
+          any room
+
+        Raises:
+          Exception, if the map is chunked (see get_room_map)
+        """
+        roommap = self.get_room_map()
+        k = roommap.room_at(x, y)
+        return roommap.room(k) if k else None
+
+    def get_fov(self):
+        """
+        Gets the FOV maps of the map, shared by every player on the
+        level and kept while the map is, so entering the level again
+        does not build them again.
+
+        Returns:
+          fovmap.LevelFov of the map
+        """
+        if self._fov is None:
+            self._fov = fovmap.LevelFov(self)
+        return self._fov
+
+    def set_tile(self, x, y, tipo):
+        """
+        Changes the tile of a cell, once the map is built (doors
+        opening, walls digged, ...), keeping the regions and the FOV
+        maps up to date (the room map gets built again when next asked
+        for).
+
+        Arguments:
+          (x,y) - coordinates of the cell
+          tipo  - type of tile (TILETYPES key)
+        """
+        self.mapa.set_tipo(x, y, tipo)
+        if self._regions is not None:
+            self._regions.update(x, y)
+        if self._fov is not None:
+            self._fov.set_tile(x, y)
+        self._roommap = None
 
     def make_map(self, dims, mapa):
         """
@@ -180,7 +543,7 @@ class Map:
 
         Arguments:
           (width, height) - map dimensions
-          mapa            - a 2D list which holds tile.Tile instances
+          mapa            - a tile.TileGrid which holds the map tiles
 
         Returns:
           room.roomgeo list of the generated rooms in the map
@@ -202,6 +565,194 @@ class Map:
         """
         return (self.stx, self.sty)
 
+    def new_random(self):
+        """
+        Gets a random numbers generator for the map generator, seeded
+        from the level random number generator. Generators should draw
+        their numbers from it (in batches, when possible) instead of
+        from the level one.
+
+        Returns:
+          genrandom.GenRandom
+        """
+        return genrandom.GenRandom(tcod.random_get_int(self.rg, 0, 0x7fffffff))
+
+    def make_stages(self, mapa, stagelist):
+        """
+        Make the map with a pipeline of generation stages.
+
+        The pipeline gets its seed from the level random number
+        generator, and the stages may be restored from the cache of
+        intermediate builds (see pipeline module).
+
+        Arguments:
+          mapa      - a tile.TileGrid which holds the map tiles
+          stagelist - list of (stage name, parameters dictionary)
+
+        Returns:
+          room.roomgeo list of the rooms placed by the stages
+        """
+        build = pipeline.Build(mapa, self.tipo['deftile'], self.util, self.roomgeo)
+        line = pipeline.Pipeline(stagelist)
+        line.run(build, tcod.random_get_int(self.rg, 0, 0x7fffffff))
+        if build.stairs is not None:
+            (self.stx, self.sty) = build.stairs
+        self.links = build.links
+        self.timings = line.timings
+        return build.rooms
+
+    def make_split(self, (width, height), mapa, size, seam):
+        """
+        Make a big map as a mosaic of independent tiles.
+
+        The map is cut in a grid of tiles (no bigger than the given
+        ones), and each tile is a whole map of this same type, built
+        with make_map from its own seed (see generate_state). The seeds
+        are all drawn first from the level random number generator, so
+        tiles can be built in any order, and they are built in a pool
+        of SPLIT_WORKERS worker processes: the map is the same whatever
+        the number of workers (and when built serially, as done inside
+        worker processes, which cannot have their own pool).
+
+        Tiles are copied into the map as they come, and then a seam
+        pass joins every tile with its right and bottom neighbours,
+        carving an L shaped corridor between the passable cells of both
+        tiles nearest to a random point of their common side. Since the
+        map types split this way build connected maps, the whole map
+        is connected too.
+
+        The stairs are the ones of the first tile, the stairs of the
+        other tiles are replaced with seam tiles. The links of the rooms
+        are the ones of every tile, plus the rooms nearest to the ends
+        of each seam corridor (see map_util.nearest_room).
+
+        Arguments:
+          (width, height) - map dimensions
+          mapa            - a tile.TileGrid which holds the map tiles
+          size            - (w,h) maximum dimensions of the tiles
+          seam            - type of tile for the seam corridors
+                            (TILETYPES key)
+
+        Returns:
+          room.roomgeo list of the rooms of every tile
+        """
+        (tw, th) = size
+        (nx, ny) = (-(-width // tw), -(-height // th))
+        xs = [ i * width // nx for i in range(nx + 1) ]
+        ys = [ j * height // ny for j in range(ny + 1) ]
+
+        rnd = self.new_random()
+        jobs = []
+        for j in range(ny):
+            for i in range(nx):
+                subtipo = dict(self.tipo, dims=(xs[i + 1] - xs[i], ys[j + 1] - ys[j]))
+                del subtipo['split']
+                jobs.append((subtipo, rnd.randint(0, 0x7fffffff)))
+
+        log.debug("Building a split map: %d x %d tiles" % (nx, ny))
+        pool = None
+        if SPLIT_WORKERS != 1 and not multiprocessing.current_process().daemon:
+            pool = multiprocessing.Pool(SPLIT_WORKERS)
+        try:
+            states = pool.imap(generate_state, jobs) if pool else itertools.imap(generate_state, jobs)
+            rooms = []
+            # rooms of each tile, as a slice of rooms
+            tiles = []
+            for (n, state) in enumerate(states):
+                (ox, oy) = (xs[n % nx], ys[n // nx])
+                sub = tile.TileGrid((state['w'], state['h']), self.tipo['deftile'])
+                sub.load(state['mapa'])
+                mapa.blit(sub, (ox, oy))
+                self.links.extend((i + len(rooms), j + len(rooms)) for (i, j) in state.get('links', []))
+                tiles.append((len(rooms), len(rooms) + len(state.get('rooms', []))))
+                for r in state.get('rooms', []):
+                    (r.x1, r.y1, r.x2, r.y2) = (r.x1 + ox, r.y1 + oy, r.x2 + ox, r.y2 + oy)
+                    rooms.append(r)
+                if n == 0:
+                    (self.stx, self.sty) = (state['stx'], state['sty'])
+                else:
+                    mapa.set_tipo(state['stx'] + ox, state['sty'] + oy, seam)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        mask = str(mapa.mask(tile.TILEREG.walkable_table))
+        ops = []
+        for j in range(ny):
+            for i in range(nx):
+                if i + 1 < nx:
+                    y = rnd.randint(ys[j], ys[j + 1] - 1)
+                    a = self._seam_cell(mask, width, (xs[i], xs[i + 1]), (ys[j], ys[j + 1]), y, True, True)
+                    b = self._seam_cell(mask, width, (xs[i + 1], xs[i + 2]), (ys[j], ys[j + 1]), y, True, False)
+                    if a and b:
+                        ops.append(('l', a, b, seam, True))
+                        self._seam_link(rooms, tiles[i + j * nx], a, tiles[i + 1 + j * nx], b)
+                if j + 1 < ny:
+                    x = rnd.randint(xs[i], xs[i + 1] - 1)
+                    a = self._seam_cell(mask, width, (xs[i], xs[i + 1]), (ys[j], ys[j + 1]), x, False, True)
+                    b = self._seam_cell(mask, width, (xs[i], xs[i + 1]), (ys[j + 1], ys[j + 2]), x, False, False)
+                    if a and b:
+                        ops.append(('l', a, b, seam, False))
+                        self._seam_link(rooms, tiles[i + j * nx], a, tiles[i + (j + 1) * nx], b)
+        self.util.carve(mapa, ops)
+
+        log.debug(" Dimensions: (%s,%s)" % (str(width) , str(height)))
+        log.debug(" Seam corridors: %d" % len(ops))
+
+        return rooms
+
+    def _seam_link(self, rooms, (s1, e1), a, (s2, e2), b):
+        """
+        Adds to links the rooms of two tiles nearest to the ends of the
+        seam corridor joining them, if both tiles have rooms.
+
+        Arguments:
+          rooms   - list of the rooms of every tile
+          (s1,e1) - slice of rooms of the first tile
+          a       - (x,y) end of the corridor in the first tile
+          (s2,e2) - slice of rooms of the second tile
+          b       - (x,y) end of the corridor in the second tile
+        """
+        (i, j) = (self.util.nearest_room(rooms[s1:e1], a), self.util.nearest_room(rooms[s2:e2], b))
+        if i is not None and j is not None:
+            self.links.append((s1 + i, s2 + j))
+
+    def _seam_cell(self, mask, width, (x1, x2), (y1, y2), p, horizontal, last):
+        """
+        Finds the passable cell of a tile nearest to a point of one of
+        its sides, looking in the rows (for a side between horizontal
+        neighbours) or columns nearest to it first.
+
+        Arguments:
+          mask       - walkable mask of the whole map
+          width      - map width
+          (x1,x2)    - columns of the tile (x2 not included)
+          (y1,y2)    - rows of the tile (y2 not included)
+          p          - row (or column) of the point
+          horizontal - True for the right or left side, False for the
+                       bottom or top side
+          last       - True for the right (bottom) side, False for the
+                       left (top) side
+
+        Returns:
+          (x,y) coordinates of the cell, None if the tile has no
+          passable cell
+        """
+        (lo, hi) = (y1, y2) if horizontal else (x1, x2)
+        for d in xrange(max(p - lo, hi - 1 - p) + 1):
+            for q in (p - d, p + d) if d else (p,):
+                if not lo <= q < hi:
+                    continue
+                if horizontal:
+                    line = mask[q * width + x1:q * width + x2]
+                else:
+                    line = mask[y1 * width + q:y2 * width:width]
+                k = line.rfind(chr(1)) if last else line.find(chr(1))
+                if k != -1:
+                    return (x1 + k, q) if horizontal else (q, y1 + k)
+        return None
+
 class Dungeon(Map):
     """
     Builds a dungeon map.
@@ -218,16 +769,33 @@ class Dungeon(Map):
     #....######........#
     ######    ##########
 
+    The map is cut with a binary space partition: the biggest region
+    is split in two, along its longer side, until there are maxrooms
+    regions or no one can be split without going under
+    room_min_size. A room is carved in every leaf, and then sibling
+    subtrees are connected bottom-up with corridors. Rooms never
+    overlap by construction, so there is no rejection sampling, and
+    generation is O(n log n) in the number of rooms.
+
+    The tree is held in flat arrays, a node per index, the two
+    children of a node being always contiguous and after it.
+
     Methods:
       make_map
     """
-    def make_map(self, dims, mapa):
+    def make_map(self, (width, height), mapa, maxrooms=50, room_min_size=10, room_max_size=30):
         """
         Make a dungeon map.
 
         Arguments:
-          dims - map dimensions
-          mapa - a 2D list which holds tile.Tile instances
+          (width, height) - map dimensions
+          mapa            - a tile.TileGrid which holds the map tiles
+          maxrooms        - parameter, max number of rooms to be
+                            generated. Default: 50
+          room_min_size   - parameter, min size for the generated
+                            rooms. Default: 10
+          room_max_size   - parameter, max size for the generated
+                            rooms. Default: 30
 
         Returns:
           room.roomgeo list of the generated rooms in the map
@@ -235,7 +803,76 @@ class Dungeon(Map):
           for).
         """
         log.debug("Building a dungeon map")
-        return []
+        rnd = self.new_random()
+
+        # nodes: region (x, y, w, h) and index of the first child (-1 for
+        # leaves), the second child is always next to the first one
+        (nx, ny, nw, nh, child) = (array('i', [0]), array('i', [0]),
+                                   array('i', [width]), array('i', [height]),
+                                   array('i', [-1]))
+        # leaves by area, the biggest one is split first
+        leaves = [(-width * height, 0)]
+        nleaves = 1
+        while leaves and nleaves < maxrooms:
+            (area, n) = heapq.heappop(leaves)
+            (x, y, w, h) = (nx[n], ny[n], nw[n], nh[n])
+            if w <= room_max_size and h <= room_max_size:
+                continue
+            vertical = w > h if w != h else rnd.randint(0, 1) == 1
+            size = w if vertical else h
+            if size < 2 * room_min_size:
+                continue
+            cut = rnd.randint(room_min_size, size - room_min_size)
+            if vertical:
+                halves = ((x, y, cut, h), (x + cut, y, w - cut, h))
+            else:
+                halves = ((x, y, w, cut), (x, y + cut, w, h - cut))
+            child[n] = len(nx)
+            for (hx, hy, hw, hh) in halves:
+                heapq.heappush(leaves, (-hw * hh, len(nx)))
+                nx.append(hx); ny.append(hy); nw.append(hw); nh.append(hh)
+                child.append(-1)
+            nleaves += 1
+
+        # rooms in the leaves, walls included, so rooms in neighbour
+        # leaves get a wall between them
+        rooms = []
+        ops = [] # carving operations, applied all at once at the end
+        (px, py) = (array('i', [0]) * len(nx), array('i', [0]) * len(nx))
+        # room each node is reached through (index in rooms)
+        rep = array('i', [0]) * len(nx)
+        for n in xrange(len(nx) - 1, -1, -1):
+            if child[n] == -1:
+                (w, h) = (nw[n] - 1, nh[n] - 1)
+                rw = rnd.randint(min(room_min_size, w), min(room_max_size, w))
+                rh = rnd.randint(min(room_min_size, h), min(room_max_size, h))
+                new_room = self.roomgeo((nx[n] + rnd.randint(0, w - rw), ny[n] + rnd.randint(0, h - rh)), (rw, rh))
+                ops.append(('rect', (new_room.x1 + 1, new_room.y1 + 1), (new_room.x2 - 1, new_room.y2 - 1), 'dung_floor'))
+                rep[n] = len(rooms)
+                rooms.append(new_room)
+                (px[n], py[n]) = new_room.center()
+            else:
+                # children are done already, connect them and go on
+                # through one of them
+                (l, r) = (child[n], child[n] + 1)
+                ops.append(('l', (px[l], py[l]), (px[r], py[r]), 'dung_floor', rnd.randint(0, 1) == 1))
+                self.links.append((rep[l], rep[r]))
+                c = rnd.choice((l, r))
+                (px[n], py[n], rep[n]) = (px[c], py[c], rep[c])
+
+        self.util.carve(mapa, ops)
+        rooms.reverse()
+        last = len(rooms) - 1
+        self.links = [ (last - i, last - j) for (i, j) in self.links ]
+
+        log.debug(" Dimensions: (%s,%s)" % (str(width) , str(height)))
+        log.debug(" Number of generated rooms: %s" % str(len(rooms)))
+
+        self.stx,self.sty = (rnd.randint(rooms[0].x1 + 1, rooms[0].x2 - 1),
+                             rnd.randint(rooms[0].y1 + 1, rooms[0].y2 - 1))
+        mapa.set_tipo(self.stx, self.sty, 'stairs')
+
+        return rooms
 
 class Dungeon2(Map):
     """
@@ -260,89 +897,14 @@ class Dungeon2(Map):
     #####           #...#
                     #####
 
+    It is built by stages (see MAPTYPES.dungeon2 and stages module):
+    rooms at random places (dropping the ones overlapping others),
+    each one joined with the previous one by an L shaped corridor, and
+    the stairs in the first room.
+
     Methods:
-      make_map
+      get_stairs
     """
-    def make_map(self, (width,height), mapa, maxrooms=50, room_min_size=30, room_max_size=10):
-        """
-        Make a standard roguelike dungeon map.
-
-        Arguments:
-          (width, height) - map dimensions
-          mapa            - a 2D list which holds tile.Tile instances
-          maxrooms        - parameter, max number of rooms to be
-                            generated. Default: 50
-          room_min_size   - parameter, min size for the generated
-                            rooms. Default: 30
-          room_max_size   - parameter, max size for the generated
-                            rooms. Default: 10
-
-        Returns:
-          room.roomgeo list of the generated rooms in the map
-          (corridors may be generated too, but they are not accounted
-          for).
-        """
-        rooms = []
-        num_rooms = 0
-
-        for r in range(maxrooms):
-            # random room width and height
-            rw = tcod.random_get_int(self.rg, room_min_size, room_max_size)
-            rh = tcod.random_get_int(self.rg, room_min_size, room_max_size)
-            # random position without going out of the boundaries of the map
-            x = tcod.random_get_int(self.rg, 0, width - rw - 1)
-            y = tcod.random_get_int(self.rg, 0, height - rh - 1)
-
-            # "Rect" class makes rectangles easiert to work with
-            new_room = self.roomgeo((x, y), (rw, rh))
-
-            # run through the other rooms and see if they intersect with this one
-            failed = False
-            for other_room in rooms:
-                if new_room.intersect(other_room):
-                    failed = True
-                    break
-
-            if not failed:
-                # this means there are no intersections, so this room is valid
-
-                # "paint" it to the map's tiles
-                self.util.fill_rect_room(mapa, new_room, 'dung_floor')
-
-                # center coordinates of new room, will be useful later
-                (new_x, new_y) = new_room.center()
-
-                if num_rooms > 0:
-                    # all rooms after the first
-                    # connect it to the previous room with a tunnel
-
-                    # center coordinates of previous room
-                    (prev_x, prev_y) = rooms[num_rooms - 1].center()
-
-                    # draw a coin (random number that is either 0 or 1)
-                    if tcod.random_get_int(self.rg, 0, 1) == 1:
-                        # first move horizontally, then vertically
-                        self.util.create_h_tunnel(mapa, prev_x, new_x, prev_y, 'dung_floor')
-                        self.util.create_v_tunnel(mapa, prev_y, new_y, new_x, 'dung_floor')
-                    else:
-                        # first move vertically, then horizontally
-                        self.util.create_v_tunnel(mapa, prev_y, new_y, prev_x, 'dung_floor')
-                        self.util.create_h_tunnel(mapa, prev_x, new_x, new_y, 'dung_floor')
-
-                # finally, append the new room to the list
-                rooms.append(new_room)
-                num_rooms += 1
-
-        log.debug("Building a standard 'roguelike' dungeon map")
-        log.debug(" Dimensions: (%s,%s)" % (str(width) , str(height)))
-        log.debug(" Number of generated rooms: %s" % str(len(rooms)))
-
-        self.stx,self.sty = (tcod.random_get_int(self.rg, rooms[0].x1 + 1, rooms[0].x2),
-                             tcod.random_get_int(self.rg, rooms[0].y1 + 1, rooms[0].y2))
-        mapa[self.stx][self.sty] = tile.Tile('inistairs')
-
-        return rooms
-
     def get_stairs(self, st='start'):
         """
         Gets the coordinates for the stairs in the level
@@ -378,24 +940,58 @@ class Classrooms(Map):
     #........#.....#
     ################
 
+    The rooms are prefab templates (see prefab), stamped in rows at
+    both sides of horizontal hallways, the doors facing them. The
+    hallways are joined by two vertical ones at the ends of the rows.
+
     Methods:
       make_map
     """
-    def make_map(self, dims, mapa):
+    def make_map(self, (width, height), mapa, hall=3, templates=('classroom', 'classroom_small', 'lab', 'office')):
         """
-        Make a dungeon map.
+        Make a classrooms map.
 
         Arguments:
-          dims - map dimensions
-          mapa - a 2D list which holds tile.Tile instances
+          (width, height) - map dimensions
+          mapa            - a tile.TileGrid which holds the map tiles
+          hall            - parameter, width of the hallways. Default: 3
+          templates       - parameter, names of the prefabs for the
+                            rooms. Default: classroom, classroom_small,
+                            lab and office
 
         Returns:
           room.roomgeo list of the generated rooms in the map
-          (corridors may be generated too, but they are not accounted
-          for).
+          (corridors are not accounted for).
         """
         log.debug("Building a classrooms map")
-        return []
+        rnd = self.new_random()
+        depth = max(prefab.PREFABS.get(name).h for name in templates)
+        band = 2 * depth + hall
+        if band > height or 2 * hall + max(prefab.PREFABS.get(name).w for name in templates) > width:
+            raise Exception("map too small for classrooms: (%d,%d)" % (width, height))
+
+        rooms = []
+        ops = []
+        y = 0
+        # bands of rooms - hallway - rooms, sharing the walls between them
+        while y + band <= height:
+            rooms.extend(self.util.stamp_strip(mapa, rnd, templates, (hall, y), width - 2 * hall, 's'))
+            rooms.extend(self.util.stamp_strip(mapa, rnd, templates, (hall, y + depth + hall), width - 2 * hall, 'n'))
+            ops.append(('rect', (0, y + depth), (width - 1, y + depth + hall - 1), 'dung_floor'))
+            y += band - 1
+        (first, last) = (depth, y - depth)
+        ops.append(('rect', (0, first), (hall - 1, last), 'dung_floor'))
+        ops.append(('rect', (width - hall, first), (width - 1, last), 'dung_floor'))
+        self.util.carve(mapa, ops)
+
+        (self.stx, self.sty) = (rnd.randint(0, hall - 1), rnd.randint(first, last))
+        mapa.set_tipo(self.stx, self.sty, 'stairs')
+        self.util.check_rooms(mapa, rooms, (self.stx, self.sty))
+
+        log.debug(" Dimensions: (%s,%s)" % (str(width) , str(height)))
+        log.debug(" Number of generated rooms: %s" % str(len(rooms)))
+
+        return rooms
 
 class Classrooms2(Map):
     """
@@ -426,21 +1022,63 @@ class Classrooms2(Map):
     Methods:
       make_map
     """
-    def make_map(self, dims, mapa):
+    def make_map(self, (width, height), mapa, hall=3, templates=('classroom', 'classroom_small', 'lab', 'office')):
         """
-        Make a dungeon map.
+        Make a classrooms map with a hole in the center.
+
+        A strip of prefab rooms (see prefab) runs along each side of
+        the map, rotated so their doors face a hallway ring inside
+        them, which surrounds the hole (left as the default tile).
 
         Arguments:
-          dims - map dimensions
-          mapa - a 2D list which holds tile.Tile instances
+          (width, height) - map dimensions
+          mapa            - a tile.TileGrid which holds the map tiles
+          hall            - parameter, width of the hallway. Default: 3
+          templates       - parameter, names of the prefabs for the
+                            rooms. Default: classroom, classroom_small,
+                            lab and office
 
         Returns:
           room.roomgeo list of the generated rooms in the map
-          (corridors may be generated too, but they are not accounted
-          for).
+          (corridors are not accounted for).
         """
-        log.debug("Building a classrooms type 2 map")
-        return []
+        log.debug("Building a classrooms map with a central hole")
+        rnd = self.new_random()
+        depth = max(prefab.PREFABS.get(name).h for name in templates)
+        room_len = max(prefab.PREFABS.get(name).w for name in templates)
+        if 2 * (depth + hall) + 1 > min(width, height) or 2 * depth + room_len > min(width, height):
+            raise Exception("map too small for classrooms: (%d,%d)" % (width, height))
+
+        # solid corners, the strips go between them sharing walls
+        ops = [('rect', (0, 0), (depth - 1, depth - 1), 'wall'),
+               ('rect', (width - depth, 0), (width - 1, depth - 1), 'wall'),
+               ('rect', (0, height - depth), (depth - 1, height - 1), 'wall'),
+               ('rect', (width - depth, height - depth), (width - 1, height - 1), 'wall')]
+        self.util.carve(mapa, ops)
+
+        rooms = []
+        (hlen, vlen) = (width - 2 * depth + 2, height - 2 * depth + 2)
+        rooms.extend(self.util.stamp_strip(mapa, rnd, templates, (depth - 1, 0), hlen, 's'))
+        rooms.extend(self.util.stamp_strip(mapa, rnd, templates, (depth - 1, height - depth), hlen, 'n'))
+        rooms.extend(self.util.stamp_strip(mapa, rnd, templates, (0, depth - 1), vlen, 'e'))
+        rooms.extend(self.util.stamp_strip(mapa, rnd, templates, (width - depth, depth - 1), vlen, 'w'))
+
+        # hallway ring
+        (x1, y1, x2, y2) = (depth, depth, width - depth - 1, height - depth - 1)
+        ops = [('rect', (x1, y1), (x2, y1 + hall - 1), 'dung_floor'),
+               ('rect', (x1, y2 - hall + 1), (x2, y2), 'dung_floor'),
+               ('rect', (x1, y1), (x1 + hall - 1, y2), 'dung_floor'),
+               ('rect', (x2 - hall + 1, y1), (x2, y2), 'dung_floor')]
+        self.util.carve(mapa, ops)
+
+        (self.stx, self.sty) = (rnd.randint(x1, x2), rnd.randint(y1, y1 + hall - 1))
+        mapa.set_tipo(self.stx, self.sty, 'stairs')
+        self.util.check_rooms(mapa, rooms, (self.stx, self.sty))
+
+        log.debug(" Dimensions: (%s,%s)" % (str(width) , str(height)))
+        log.debug(" Number of generated rooms: %s" % str(len(rooms)))
+
+        return rooms
 
 class Cave(Map):
     """
@@ -468,25 +1106,262 @@ class Cave(Map):
     #####......######...#
     ##################.##
 
+    It is built by stages (see MAPTYPES.cave and stages module): a
+    cellular automaton over the whole map at once, as a bit grid (see
+    bitgrid module), where a cell becomes wall if it has at least
+    'birth' wall neighbours, and a wall stays if it has at least
+    'survival' wall neighbours. Starting from random noise it gives a
+    cave (MAPTYPES.cave); starting from a Dungeon2 layout plus some
+    noise it gives a 'morphed' dungeon (MAPTYPES.dungeon2_cave), whose
+    rooms and corridors are kept while the walls around them get
+    eroded. Finally, tiny caves are filled and the rest connected (see
+    map_util.connect_regions).
+    """
+
+class Wood(Map):
+    """
+    Builds a wood map.
+
+    Trees and grass come from a fractal noise field (see noise module)
+    evaluated over the whole map: the highest values of the field are
+    trees, as many as the density asks for, the rest grass. Then some
+    round clearings are carved, joined by winding paths, and any grass
+    patch left apart gets a path too (or trees, if it is tiny).
+
+    TTTTT^^^^TTTTTTTT^^^TT
+    TTT^^^^^^^^TTTTT^^^^^T
+    TT^^^^__________^^^^TT
+    TTT^^^_TTTTT^^T_^^^TTT
+    TTTTT^_TTTTTTTT____TTT
+    TTTTT^_^^TTTTTTTTT_TTT
+    TTTT^^^^^^^TTTTTT^__TT
+
     Methods:
       make_map
     """
-    def make_map(self, dims, mapa):
+    def make_map(self, (width, height), mapa, density=0.5, scale=24, octaves=4, persistence=0.5,
+                 clearings=8, clearing_min=3, clearing_max=8, min_region=8):
         """
-        Make a dungeon map.
+        Make a wood map.
 
         Arguments:
-          dims - map dimensions
-          mapa - a 2D list which holds tile.Tile instances
+          (width, height) - map dimensions
+          mapa            - a tile.TileGrid which holds the map tiles
+          density         - parameter, ratio of trees in the
+                            map (before carving clearings and
+                            paths). Default: 0.5
+          scale           - parameter, size (in cells) of the biggest
+                            features of the noise. Default: 24
+          octaves         - parameter, octaves of the noise. Default: 4
+          persistence     - parameter, amplitude ratio between
+                            octaves of the noise. Default: 0.5
+          clearings       - parameter, number of clearings. Default: 8
+          clearing_min    - parameter, min radius of the
+                            clearings. Default: 3
+          clearing_max    - parameter, max radius of the
+                            clearings. Default: 8
+          min_region      - parameter, grass patches with fewer cells
+                            are filled with trees, the rest get
+                            connected with paths. Default: 8
 
         Returns:
-          room.roomgeo list of the generated rooms in the map
-          (corridors may be generated too, but they are not accounted
-          for).
+          room.roomgeo list of the clearings (bounding boxes), paths
+          are not accounted for.
         """
-        log.debug("Building a cave/wood map")
+        log.debug("Building a wood map")
+        rnd = self.new_random()
+
+        field = noise.fbm(rnd.getrandbits(31), (0, 0), (width, height), scale, octaves, persistence)
+        level = noise.quantile(field, 1 - density)
+        mapa.cells[:] = field.translate(noise.threshold(level, chr(tile.TILEIDS['grass']), chr(tile.TILEIDS['tree'])))
+
+        rooms = []
+        ops = []
+        for c in range(clearings):
+            r = rnd.randint(clearing_min, clearing_max)
+            (cx, cy) = (rnd.randint(r, width - r - 1), rnd.randint(r, height - r - 1))
+            # a disc, a row at a time
+            for dy in range(-r, r + 1):
+                dx = int((r * r - dy * dy) ** 0.5)
+                ops.append(('hline', cx - dx, cx + dx, cy + dy, 'grass'))
+            rooms.append(self.roomgeo((cx - r, cy - r), (2 * r, 2 * r)))
+
+        # paths join the clearings in order, through a random waypoint
+        for (a, b) in zip(rooms, rooms[1:]):
+            ((ax, ay), (bx, by)) = (a.center(), b.center())
+            (wx, wy) = (rnd.randint(min(ax, bx), max(ax, bx)), rnd.randint(min(ay, by), max(ay, by)))
+            ops.append(('l', (ax, ay), (wx, wy), 'floor', rnd.randint(0, 1) == 1))
+            ops.append(('l', (wx, wy), (bx, by), 'floor', rnd.randint(0, 1) == 1))
+        self.util.carve(mapa, ops)
+        self.util.connect_regions(mapa, regions.RegionIndex(mapa), 'floor', 'tree', min_region)
+
+        if rooms:
+            (self.stx, self.sty) = rooms[0].center()
+        else:
+            (self.stx, self.sty) = self.util.random_cell(mapa, rnd, tile.TILEREG.walkable_table)
+        mapa.set_tipo(self.stx, self.sty, 'stairs')
+
+        log.debug(" Dimensions: (%s,%s)" % (str(width) , str(height)))
+        log.debug(" Number of clearings: %s" % str(len(rooms)))
+
+        return rooms
+
+class Overworld(Map):
+    """
+    Builds an endless wood map, generated chunk by chunk while walked.
+
+    The map is virtually infinite (see its MAPTYPES dims) and stored in
+    a chunks.StreamedGrid: every chunk is a function of the map seed
+    and the chunk coordinates alone, generated the first time it is
+    needed, dropped when not used for a while and generated again,
+    identical, if needed again (chunks changed or explored are kept).
+    Chunks ahead of the players are generated in the background (see
+    prefetch), so walking into a new chunk does not have to wait for
+    it.
+
+    Trees and grass come from the same fractal noise as Wood maps
+    (evaluated for the chunk only, the noise is seamless between
+    chunks). Every column of chunks has a winding north-south path,
+    every row of chunks a west-east one, so paths go on forever and
+    cross in every chunk. Some chunks get a clearing, joined to the
+    north-south path.
+
+    Methods:
+      make_map
+      new_grid
+      store_grid
+      make_chunk
+      prefetch
+    """
+
+    """The map is endless, there is nothing to cache but the seed."""
+    CACHEABLE = False
+
+    def make_map(self, (width, height), mapa, **params):
+        """
+        Make the map: just picks the seed of the chunks, and puts the
+        stairs in the middle of the map.
+
+        Arguments:
+          (width, height) - map dimensions
+          mapa            - chunks.StreamedGrid which holds the map tiles
+          params          - parameters for the chunks (see make_chunk)
+
+        Returns:
+          empty list, the map has no rooms
+        """
+        log.debug("Building an overworld map")
+        self.noiseseed = tcod.random_get_int(self.rg, 0, 0x7fffffff)
+        (cx, cy) = (width // 2 // chunks.CHUNK_SIZE, height // 2 // chunks.CHUNK_SIZE)
+        self.sty = cy * chunks.CHUNK_SIZE + chunks.CHUNK_SIZE // 2
+        self.stx = self._path(cx, self.sty, 0)
+        mapa.set_tipo(self.stx, self.sty, 'stairs')
         return []
 
+    def new_grid(self, generating):
+        """
+        Creates the tile storage for the map, a chunks.StreamedGrid.
+        """
+        return chunks.StreamedGrid((self.w, self.h), self.make_chunk)
+
+    def store_grid(self, grid):
+        """
+        Gets the tile storage to keep the generated map in, the same
+        one it was generated in.
+        """
+        return grid
+
+    def make_chunk(self, cx, cy):
+        """
+        Generates a chunk of the map.
+
+        The chunk depends only on the map seed, its coordinates and the
+        map type parameters (makeparams):
+          scale          - size (in cells) of the biggest features of
+                           the noise
+          octaves        - octaves of the noise
+          persistence    - amplitude ratio between octaves of the
+                           noise
+          tree_level     - noise value (0-255) from which cells are
+                           trees
+          clearing_ratio - ratio of chunks with a clearing
+          clearing_min   - min radius of the clearings
+          clearing_max   - max radius of the clearings
+          path_wobble    - how far the paths wind away from a straight
+                           line
+
+        Arguments:
+          (cx,cy) - chunk coordinates
+
+        Returns:
+          bytearray with the tile ids of the chunk (row-major)
+        """
+        p = self.tipo['makeparams']
+        size = chunks.CHUNK_SIZE
+        (x0, y0) = (cx * size, cy * size)
+        (grass, tree, path) = (chr(tile.TILEIDS['grass']), chr(tile.TILEIDS['tree']), chr(tile.TILEIDS['floor']))
+
+        field = noise.fbm(self.noiseseed, (x0, y0), (size, size), p['scale'], p['octaves'], p['persistence'])
+        cells = field.translate(noise.threshold(p['tree_level'], grass, tree))
+
+        rnd = genrandom.GenRandom(int(noise.lattice(self.noiseseed ^ 0x5bd1e995, cx, cy) * 0x7fffffff))
+        if rnd.random() < p['clearing_ratio']:
+            r = rnd.randint(p['clearing_min'], p['clearing_max'])
+            (ccx, ccy) = (rnd.randint(r, size - r - 1), rnd.randint(r, size - r - 1))
+            for dy in range(-r, r + 1):
+                dx = int((r * r - dy * dy) ** 0.5)
+                row = (ccy + dy) * size
+                cells[row + ccx - dx:row + ccx + dx + 1] = grass * (2 * dx + 1)
+            # joined to the north-south path
+            (a, b) = sorted((ccx, self._path(cx, y0 + ccy, 0) - x0))
+            cells[ccy * size + a:ccy * size + b + 1] = path * (b - a + 1)
+
+        for i in range(size):
+            cells[i * size + self._path(cx, y0 + i, 0) - x0] = path
+            cells[(self._path(cy, x0 + i, 1) - y0) * size + i] = path
+
+        return cells
+
+    def _path(self, c, g, axis):
+        """
+        Gets where a path crosses a row (or column) of the map.
+
+        Arguments:
+          c    - chunk column (or row) of the path
+          g    - map row (or column)
+          axis - 0 for north-south paths, 1 for west-east ones
+
+        Returns:
+          map column (or row) of the path, inside the chunk column (or
+          row)
+        """
+        size = chunks.CHUNK_SIZE
+        wobble = self.tipo['makeparams']['path_wobble']
+        seed = self.noiseseed + 1 + axis
+        base = wobble + int(noise.lattice(seed, c, 0) * (size - 2 * wobble))
+        # smooth 1D value noise, slow enough for the path to move at
+        # most a cell per row
+        spacing = 4 * wobble
+        (i, t) = divmod(g, spacing)
+        (a, b) = (noise.lattice(seed, c, i + 1), noise.lattice(seed, c, i + 2))
+        t = float(t) / spacing
+        v = a + (b - a) * t * t * (3 - 2 * t)
+        return c * size + min(size - 1, base + int(v * wobble))
+
+    def prefetch(self, (x, y), (dx, dy)):
+        """
+        Gets ready, in the background, the chunks around a player and
+        the ones ahead of it.
+
+        Arguments:
+          (x,y)   - new coordinates of the player
+          (dx,dy) - direction of the movement
+        """
+        self.mapa.prefetch((x, y))
+        (ax, ay) = (x + dx * chunks.CHUNK_SIZE, y + dy * chunks.CHUNK_SIZE)
+        if 0 <= ax < self.w and 0 <= ay < self.h:
+            self.mapa.prefetch((ax, ay))
+
 class Labyrinth(Map):
     """
     Builds a labyrinth map.
@@ -500,39 +1375,140 @@ class Labyrinth(Map):
     ######.##.#.#.#.#...#
     ##......#...#.#######
 
+    The labyrinth is a randomized Kruskal maze: maze cells are the map
+    cells with odd coordinates, and the walls between neighbour cells
+    are opened in random order whenever they separate cells not yet
+    connected (tracked with a unionfind.UnionFind). Rooms are carved
+    first and count as already connected cells. Some of the remaining
+    walls may be opened afterwards, to make loops.
+
+    Time and memory are linear in the number of cells, with no
+    recursion, so it works for very big maps too.
+
     Methods:
       make_map
     """
-    def make_map(self, dims, mapa):
+    def make_map(self, (width, height), mapa, rooms=10, room_min_size=5, room_max_size=15, loops=0.05):
         """
-        Make a dungeon map.
+        Make a labyrinth map.
 
         Arguments:
-          dims - map dimensions
-          mapa - a 2D list which holds tile.Tile instances
+          (width, height) - map dimensions
+          mapa            - a tile.TileGrid which holds the map tiles
+          rooms           - parameter, max number of rooms to embed in
+                            the labyrinth. Default: 10
+          room_min_size   - parameter, min size for the
+                            rooms. Default: 5
+          room_max_size   - parameter, max size for the
+                            rooms. Default: 15
+          loops           - parameter, ratio of the walls left by the
+                            maze to open, making loops. Default: 0.05
 
         Returns:
           room.roomgeo list of the generated rooms in the map
-          (corridors may be generated too, but they are not accounted
-          for).
+          (corridors are not accounted for).
         """
         log.debug("Building a labyrinth map")
-        return []
+        rnd = self.new_random()
+        floor = chr(tile.TILEIDS['dung_floor'])
+        cells = mapa.cells
+
+        # maze cells, at odd map coordinates: cell (cx,cy) is map cell
+        # (2*cx+1, 2*cy+1)
+        (cw, ch) = ((width - 1) // 2, (height - 1) // 2)
+        if cw < 1 or ch < 1:
+            raise Exception("map too small for a labyrinth: (%d,%d)" % (width, height))
+        for cy in range(ch):
+            row = (2 * cy + 1) * width
+            cells[row + 1:row + 2 * cw:2] = floor * cw
+
+        sets = unionfind.UnionFind(cw * ch)
+
+        # rooms, aligned to maze cells, all their cells already connected
+        # (inroom tells the room of each maze cell, 0 for none)
+        placed = []
+        inroom = array('H' if rooms < 0xffff else 'i', [0]) * (cw * ch)
+        index = room.RoomIndex((width, height), room_max_size)
+        for r in range(rooms):
+            (rcw, rch) = (rnd.randint(room_min_size, room_max_size) // 2 + 1,
+                          rnd.randint(room_min_size, room_max_size) // 2 + 1)
+            if rcw > cw or rch > ch:
+                continue
+            (rcx, rcy) = (rnd.randint(0, cw - rcw), rnd.randint(0, ch - rch))
+            new_room = self.roomgeo((2 * rcx, 2 * rcy), (2 * rcw, 2 * rch))
+            if index.intersects(new_room):
+                continue
+            index.insert(new_room)
+            placed.append(new_room)
+            self.util.fill_rect_room(mapa, new_room, 'dung_floor')
+            for cy in range(rcy, rcy + rch):
+                for cx in range(rcx, rcx + rcw):
+                    sets.union(rcx + rcy * cw, cx + cy * cw)
+                inroom[rcx + cy * cw:rcx + rcw + cy * cw] = array(inroom.typecode, [len(placed)]) * rcw
+
+        # walls between neighbour cells: edge 2*c is the wall to the right
+        # of cell c, edge 2*c+1 the wall below it. The walls inside a room
+        # are floor already, they are left out
+        edges = array('i', [ e for e in xrange(2 * cw * ch)
+                             if ((e & 1 and (e >> 1) < cw * (ch - 1)) or
+                                 (not e & 1 and (e >> 1) % cw < cw - 1)) and
+                                not (inroom[e >> 1] and
+                                     inroom[e >> 1] == inroom[(e >> 1) + (cw if e & 1 else 1)]) ])
+        rnd.shuffle(edges)
+
+        closed = array('i')
+        for e in edges:
+            c = e >> 1
+            d = cw if e & 1 else 1
+            if sets.union(c, c + d) is None:
+                closed.append(e)
+            else:
+                cells[self._wall(c, e, cw, width)] = floor
+
+        for e in closed[:int(len(closed) * loops)]:
+            cells[self._wall(e >> 1, e, cw, width)] = floor
+
+        (self.stx, self.sty) = placed[0].center() if placed else (1, 1)
+        mapa.set_tipo(self.stx, self.sty, 'stairs')
+
+        log.debug(" Dimensions: (%s,%s)" % (str(width) , str(height)))
+        log.debug(" Number of generated rooms: %s" % str(len(placed)))
+
+        return placed
+
+    def _wall(self, c, e, cw, width):
+        """
+        Gets the index in the tile buffer of the wall of an edge.
+        """
+        (x, y) = (2 * (c % cw) + 1, 2 * (c // cw) + 1)
+        if e & 1:
+            return x + (y + 1) * width
+        return x + 1 + y * width
 
 class Special(Map):
     """
     Builds a special map, loaded from a file.
 
+    The file may be the level text file or its compiled binary form
+    (see levfile module).
+
     Methods:
       make_map
+
+    Variables:
+      stairs - list of coordinates of the stairs in the map
     """
+
+    """Loading it is cheaper than caching it."""
+    CACHEABLE = False
+
     def make_map(self, dims, mapa, numlevel):
         """
         Make a special map, loaded from file.
 
         Arguments:
           dims - map dimensions
-          mapa - a 2D list which holds tile.Tile instances
+          mapa - a tile.TileGrid which holds the map tiles
           numlevel - level number, which determines the filename in levels subdir
 
         Returns:
@@ -541,29 +1517,11 @@ class Special(Map):
           for).
         """
         rooms = []
-        x,y = 0,0
-        # file_chars = [ getattr(tile.TILETYPES, k)['file_char'] for k in tile.TILETYPES.__dict__.keys() if '__' not in k ]
-
-        with copen('world/levels/{}.lev'.format(str(numlevel).replace('-','m')), 'r', 'utf8') as f:
-            for l in f.readlines():
-                if y > DEF_MAP_DIMS[1]:
-                    raise Exception("ydim exceeds max")
-
-                x = 0
-                for c in [ char for char in l if char!=u"\n" ]:
-                    if x > DEF_MAP_DIMS[0]:
-                        raise Exception("xdim exceeds max")
-                    try:
-                        # mapa[x][y].tipo = [ getattr(tile.TILETYPES, k) for k in tile.TILETYPES.__dict__.keys()
-                        #                     if '__' not in k and getattr(tile.TILETYPES, k)['file_char']==c ][0]
-                        mapa[x][y].tipo = [ k for k,v in tile.TILETYPES.iteritems() if v['file_char']==c ][0]
-
-                        if c == u'h':
-                            self.stx, self.sty = x,y
-                    except IndexError:
-                        raise Exception("({},{}) : unrecognizable character '{}' in file {}.lev".format(x,y,c, str(numlevel).replace('-','m')))
-                    x += 1
-                y += 1
+
+        (initpoint, self.stairs) = levfile.load(numlevel, mapa)
+
+        if initpoint is not None:
+            (self.stx, self.sty) = initpoint
 
         return rooms
 
@@ -573,12 +1531,44 @@ class map_util:
 
     Holds some utility methods for generic use in map classes.
 
+    The carving methods work straight on the tile ids buffer of a
+    tile.TileGrid, writing whole runs of cells with slice assignments
+    (a row is a contiguous slice, a column an extended slice with step
+    the grid width), instead of one cell at a time. Coordinates are
+    inclusive, and every carving method receives the type of tile
+    (TILETYPES key) to carve with.
+
+    A generator may also collect its carving operations as tuples and
+    apply all of them in a single carve call:
+      ('rect',  (x1,y1), (x2,y2), tipo)
+      ('hline', x1, x2, y, tipo)
+      ('vline', y1, y2, x, tipo)
+      ('l',     (x1,y1), (x2,y2), tipo, hfirst)
+      ('mask',  mask, (x,y), mw, tipo)
+
     Methods:
       __init__
       fill_rect_room
+      room_op
+      fill_room
       create_h_tunnel
       create_v_tunnel
+      carve_rect
+      carve_hline
+      carve_vline
+      carve_l
+      carve_mask
+      carve
+      stamp_strip
+      check_rooms
+      connect_regions
+      nearest_room
+      random_cell
     """
+
+    """Runs of non zero bytes in a mask."""
+    MASK_RUNS = re.compile('[^\x00]+')
+
     def __init__(self):
         """
         Initialization...
@@ -592,20 +1582,352 @@ class map_util:
         Goes through the tiles in the rectangle and make them passable
         (leaving a space for wall's surrounding room)
         """
-        for x in range(room.x1 + 1, room.x2):
-            for y in range(room.y1 + 1, room.y2):
-                mapa[x][y].tipo = tile
+        if room.x2 - room.x1 > 1 and room.y2 - room.y1 > 1:
+            self.carve_rect(mapa, (room.x1 + 1, room.y1 + 1), (room.x2 - 1, room.y2 - 1), tile)
+
+    def room_op(self, room, tipo):
+        """
+        Gets the carving operation to fill the floor of a room: a
+        rectangle for rectangular rooms, the floor mask of the room
+        for the others (see room.MaskedRoom).
+
+        Arguments:
+          room - room.roomgeo instance
+          tipo - type of tile (TILETYPES key)
+
+        Returns:
+          carving operation tuple (see carve)
+        """
+        if hasattr(room, 'floor'):
+            return ('mask', room.floor(), (room.x1, room.y1), room.x2 - room.x1 + 1, tipo)
+        return ('rect', (room.x1 + 1, room.y1 + 1), (room.x2 - 1, room.y2 - 1), tipo)
+
+    def fill_room(self, mapa, room, tipo):
+        """
+        Fills the floor of a room of any geometry (leaving its walls).
+
+        Arguments:
+          mapa - tile.TileGrid
+          room - room.roomgeo instance
+          tipo - type of tile (TILETYPES key)
+        """
+        self.carve(mapa, [self.room_op(room, tipo)])
 
     def create_h_tunnel(self, mapa, x1, x2, y, tile):
         """
         Creates a horizontal tunnel connecting two coordinates.
         """
-        for x in range(min(x1, x2), max(x1, x2) + 1):
-            mapa[x][y].tipo = tile
+        self.carve_hline(mapa, x1, x2, y, tile)
 
     def create_v_tunnel(self, mapa, y1, y2, x, tile):
         """
         Creates a vertical tunnel connecting two coordinates.
         """
-        for y in range(min(y1, y2), max(y1, y2) + 1):
-            mapa[x][y].tipo = tile
+        self.carve_vline(mapa, y1, y2, x, tile)
+
+    def _check(self, mapa, x1, y1, x2, y2):
+        """
+        Sorts the corners of a box and checks it lies in the grid.
+        """
+        (x1, x2) = (min(x1, x2), max(x1, x2))
+        (y1, y2) = (min(y1, y2), max(y1, y2))
+        if x1 < 0 or y1 < 0 or x2 >= mapa.w or y2 >= mapa.h:
+            raise IndexError("carving out of the map: (%d,%d)-(%d,%d)" % (x1, y1, x2, y2))
+        return (x1, y1, x2, y2)
+
+    def carve_rect(self, mapa, (x1, y1), (x2, y2), tipo):
+        """
+        Carves a rectangle, one slice per row.
+
+        Arguments:
+          mapa    - tile.TileGrid
+          (x1,y1) - a corner of the rectangle
+          (x2,y2) - the opposite corner of the rectangle
+          tipo    - type of tile (TILETYPES key)
+        """
+        (x1, y1, x2, y2) = self._check(mapa, x1, y1, x2, y2)
+        run = chr(tile.TILEIDS[tipo]) * (x2 - x1 + 1)
+        cells = mapa.cells
+        for row in range(y1 * mapa.w, y2 * mapa.w + 1, mapa.w):
+            cells[row + x1:row + x2 + 1] = run
+
+    def carve_hline(self, mapa, x1, x2, y, tipo):
+        """
+        Carves a horizontal run of cells, from x1 to x2 in row y, in a
+        single slice.
+        """
+        (x1, y, x2, y) = self._check(mapa, x1, y, x2, y)
+        mapa.cells[y * mapa.w + x1:y * mapa.w + x2 + 1] = chr(tile.TILEIDS[tipo]) * (x2 - x1 + 1)
+
+    def carve_vline(self, mapa, y1, y2, x, tipo):
+        """
+        Carves a vertical run of cells, from y1 to y2 in column x, in a
+        single (extended) slice.
+        """
+        (x, y1, x, y2) = self._check(mapa, x, y1, x, y2)
+        mapa.cells[y1 * mapa.w + x:y2 * mapa.w + x + 1:mapa.w] = chr(tile.TILEIDS[tipo]) * (y2 - y1 + 1)
+
+    def carve_l(self, mapa, (x1, y1), (x2, y2), tipo, hfirst=True):
+        """
+        Carves an L shaped corridor between two points.
+
+        Arguments:
+          mapa    - tile.TileGrid
+          (x1,y1) - starting point
+          (x2,y2) - ending point
+          tipo    - type of tile (TILETYPES key)
+          hfirst  - if true the corridor goes horizontally first, then
+                    vertically. Default: True
+        """
+        if hfirst:
+            self.carve_hline(mapa, x1, x2, y1, tipo)
+            self.carve_vline(mapa, y1, y2, x2, tipo)
+        else:
+            self.carve_vline(mapa, y1, y2, x1, tipo)
+            self.carve_hline(mapa, x1, x2, y2, tipo)
+
+    def carve_mask(self, mapa, mask, (x, y), mw, tipo):
+        """
+        Carves the cells set in a mask.
+
+        The mask is a row-major buffer for a box of the map (the whole
+        map or a window of it), every non zero byte in it is a cell to
+        carve. Each run of set cells is carved with a single slice.
+
+        Arguments:
+          mapa  - tile.TileGrid
+          mask  - str/bytearray with the mask, len(mask) must be a
+                  multiple of mw
+          (x,y) - map coordinates of the top left corner of the mask
+          mw    - width of the mask
+          tipo  - type of tile (TILETYPES key)
+        """
+        mh = len(mask) // mw
+        if mh == 0:
+            return
+        self._check(mapa, x, y, x + mw - 1, y + mh - 1)
+        tid = chr(tile.TILEIDS[tipo])
+        cells = mapa.cells
+        mask = str(mask)
+
+        if x == 0 and mw == mapa.w:
+            # the mask rows are contiguous in the grid, runs may go
+            # through several rows
+            offset = y * mapa.w
+            for m in self.MASK_RUNS.finditer(mask):
+                cells[offset + m.start():offset + m.end()] = tid * (m.end() - m.start())
+        else:
+            for my in range(mh):
+                offset = (y + my) * mapa.w + x
+                for m in self.MASK_RUNS.finditer(mask, my * mw, (my + 1) * mw):
+                    cells[offset + m.start() - my * mw:offset + m.end() - my * mw] = tid * (m.end() - m.start())
+
+    def carve(self, mapa, ops):
+        """
+        Applies a batch of carving operations.
+
+        Arguments:
+          mapa - tile.TileGrid
+          ops  - list of carving operations, tuples as given in the
+                 class documentation, applied in order
+        """
+        carvers = {'rect'  : self.carve_rect,
+                   'hline' : self.carve_hline,
+                   'vline' : self.carve_vline,
+                   'l'     : self.carve_l,
+                   'mask'  : self.carve_mask}
+        for op in ops:
+            carvers[op[0]](mapa, *op[1:])
+
+    def stamp_strip(self, mapa, rnd, names, (x, y), length, side, lib=prefab.PREFABS):
+        """
+        Fills a strip of the map with prefab rooms, side by side.
+
+        Rooms are picked at random among those fitting in what is left
+        of the strip, randomly mirrored, and share their side walls
+        with their neighbours. What is left at the end of the strip,
+        when no room fits, is filled with wall.
+
+        Arguments:
+          mapa   - tile.TileGrid
+          rnd    - random.Random like generator
+          names  - names of the prefabs to use
+          (x,y)  - top left corner of the strip
+          length - length of the strip, horizontal for 's' and 'n'
+                   sides, vertical for 'w' and 'e' sides
+          side   - side the doors of the rooms face: 's', 'w', 'n'
+                   or 'e'
+          lib    - prefab.PrefabLibrary. Default: prefab.PREFABS
+
+        Returns:
+          room.Rect list of the stamped rooms
+        """
+        rot = 'swne'.index(side)
+        depth = max(lib.get(name).h for name in names)
+        (pos, end) = (x, x + length) if side in 'sn' else (y, y + length)
+        rooms = []
+
+        while True:
+            fit = [ name for name in names if lib.get(name).w <= end - pos ]
+            if not fit:
+                break
+            p = lib.get(rnd.choice(fit), rot, rnd.randint(0, 1) == 1)
+            # doors aligned to the hallway side of the strip
+            (px, py) = {'s' : (pos, y + depth - p.h),
+                        'n' : (pos, y),
+                        'w' : (x, pos),
+                        'e' : (x + depth - p.w, pos)}[side]
+            p.stamp(mapa, (px, py))
+            rooms.append(room.Rect((px, py), (p.w - 1, p.h - 1)))
+            pos += (p.w if side in 'sn' else p.h) - 1
+
+        if pos < end - 1:
+            if side in 'sn':
+                self.carve_rect(mapa, (pos, y), (end - 1, y + depth - 1), 'wall')
+            else:
+                self.carve_rect(mapa, (x, pos), (x + depth - 1, end - 1), 'wall')
+
+        return rooms
+
+    def check_rooms(self, mapa, rooms, (x, y)):
+        """
+        Checks that every passable cell of the rooms can be reached
+        from a cell (the stairs), as the validate stage does for the
+        whole map.
+
+        Arguments:
+          mapa  - tile.TileGrid
+          rooms - list of room.roomgeo
+          (x,y) - coordinates of the cell the rooms must be reached from
+
+        Raises:
+          Exception, if a room can not be reached
+        """
+        index = regions.RegionIndex(mapa)
+        target = index.region(x, y)
+        for (k, r) in enumerate(rooms):
+            for yy in xrange(r.y1, r.y2 + 1):
+                i = mapa.index(r.x1, yy)
+                for label in index.labels[i:i + r.x2 - r.x1 + 1]:
+                    if label and index.sets.find(label) != target:
+                        raise Exception("map not connected: room %d can not be reached from (%d,%d)" % (k, x, y))
+
+    def connect_regions(self, mapa, index, tipo, fill=None, min_size=0, joins=None):
+        """
+        Repairs a disconnected map, so every passable cell can be
+        reached from any other.
+
+        Regions smaller than min_size are filled (if a fill tile is
+        given); the rest are joined, from the biggest one down, each
+        one with an L shaped corridor to the nearest region already
+        joined (comparing their top left cells).
+
+        Arguments:
+          mapa     - tile.TileGrid
+          index    - regions.RegionIndex of the map, it is stale
+                     afterwards (label it again if still needed)
+          tipo     - type of tile for the corridors (TILETYPES key)
+          fill     - type of tile to fill small regions with
+                     (TILETYPES key). Default: None, no filling
+          min_size - regions with fewer cells are filled. Default: 0
+          joins    - list to append the ((x,y), (x,y)) ends of each
+                     corridor to. Default: None
+
+        Returns:
+          number of corridors carved
+        """
+        found = index.regions()
+        if not found:
+            return 0
+        joined = [found[0][2]]
+        (fills, corridors) = ([], [])
+        for (region, size, (x, y)) in found[1:]:
+            if fill is not None and size < min_size:
+                for (s, e) in index.runs(region):
+                    fills.append(('hline', s % mapa.w, (e - 1) % mapa.w, s // mapa.w, fill))
+            else:
+                (jx, jy) = min(joined, key=lambda (jx, jy): abs(jx - x) + abs(jy - y))
+                corridors.append(('l', (x, y), (jx, jy), tipo, (x + y) % 2 == 0))
+                joined.append((x, y))
+                if joins is not None:
+                    joins.append(((x, y), (jx, jy)))
+        # filling first, so no corridor gets filled where it crosses a
+        # small region
+        self.carve(mapa, fills + corridors)
+        return len(joined) - 1
+
+    def nearest_room(self, rooms, (x, y)):
+        """
+        Finds the room a corridor end leads to: the room whose bounding
+        box holds the cell, else the room with the nearest center.
+
+        Arguments:
+          rooms - list of room.roomgeo
+          (x,y) - coordinates of the cell
+
+        Returns:
+          index in rooms, None if there are no rooms
+        """
+        best = None
+        for (k, r) in enumerate(rooms):
+            if r.x1 <= x <= r.x2 and r.y1 <= y <= r.y2:
+                return k
+            (cx, cy) = r.center()
+            d = abs(cx - x) + abs(cy - y)
+            if best is None or d < best[0]:
+                best = (d, k)
+        return best[1] if best else None
+
+    def random_cell(self, mapa, rnd, table, tries=100):
+        """
+        Picks a random cell of the map with some property.
+
+        Tries random cells first, if none of them has the property,
+        the first one in the map having it is taken. If no cell has
+        it, the center of the map is carved as floor and taken.
+
+        Arguments:
+          mapa  - tile.TileGrid
+          rnd   - random.Random like generator
+          table - property translation table (as
+                  TILEREG.walkable_table)
+          tries - random cells to try. Default: 100
+
+        Returns:
+          (x,y) coordinates of the cell
+        """
+        mask = mapa.mask(table)
+        for t in range(tries):
+            i = rnd.randrange(len(mask))
+            if mask[i]:
+                return (i % mapa.w, i // mapa.w)
+        i = mask.find(chr(1))
+        if i != -1:
+            return (i % mapa.w, i // mapa.w)
+        (x, y) = (mapa.w // 2, mapa.h // 2)
+        mapa.set_tipo(x, y, 'dung_floor')
+        return (x, y)
+
+def generate_state((tipo, seed)):
+    """
+    Builds a map and gets its generated state.
+
+    Meant to be run in worker processes (for whole levels, see
+    world.World.pregenerate, or for the tiles of a split map, see
+    Map.make_split): it receives and returns only picklable data,
+    and builds its own random number generator from the given seed,
+    so the resulting map is the same as building it in the main
+    process with a generator from the same seed.
+
+    Arguments:
+      (tipo, seed) - MAPTYPES of the map and seed for its random
+                     number generator
+
+    Returns:
+      generated state of the map (see Map.get_state)
+    """
+    rg = tcod.random_new_from_seed(seed)
+    try:
+        return globals()[tipo['name']](tipo, rg).get_state()
+    finally:
+        tcod.random_delete(rg)
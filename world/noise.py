@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+noise.py
+
+RogueLike noise fields.
+
+Fractal value noise, for natural looking maps (woods, ...). The noise
+is defined over the infinite plane of integer coordinates: the value
+at a point depends only on the seed and the point (a hashed lattice,
+no state), so any window of the plane can be generated alone, in any
+order, and windows always agree where they meet.
+
+Fields are evaluated a whole row at a time, and come out as a bytes
+buffer with a value (0-255) per cell in row-major order, like the
+masks of tile.TileGrid: thresholding a field is a single str.translate
+with a table from threshold().
+
+  function lattice   : value of a lattice point
+
+  function fbm       : fractal value noise field of a window
+
+  function threshold : translation table to threshold a field
+
+  function quantile  : field value under which a fraction of the cells
+                       are
+"""
+
+import operator
+
+def lattice(seed, ix, iy):
+    """
+    Value of a lattice point, a hash of the seed and the coordinates.
+
+    Arguments:
+      seed    - int seed
+      (ix,iy) - lattice coordinates
+
+    Returns:
+      float in [0, 1)
+    """
+    h = (ix * 0x27d4eb2d ^ iy * 0x165667b1 ^ seed * 0x9e3779b1) & 0xffffffff
+    h = ((h ^ (h >> 15)) * 0x2c1b3c6d) & 0xffffffff
+    h = ((h ^ (h >> 12)) * 0x297a2d39) & 0xffffffff
+    return (h ^ (h >> 15)) / 4294967296.0
+
+def _smooth(t):
+    """
+    Smoothstep interpolation weight.
+    """
+    return t * t * (3 - 2 * t)
+
+def fbm(seed, (x0, y0), (w, h), scale=32, octaves=4, persistence=0.5):
+    """
+    Fractal value noise (fractional brownian motion) field of a window
+    of the plane.
+
+    Each octave is value noise with half the lattice spacing and
+    persistence times the amplitude of the previous one.
+
+    Arguments:
+      seed        - int seed
+      (x0,y0)     - coordinates of the top left corner of the window
+      (w,h)       - dimensions of the window
+      scale       - lattice spacing of the first octave, in
+                    cells. Default: 32
+      octaves     - number of octaves. Default: 4
+      persistence - amplitude ratio between octaves. Default: 0.5
+
+    Returns:
+      bytearray with w*h values (0-255)
+    """
+    layers = []
+    norm = 0.0
+    for o in range(octaves):
+        s = max(1, scale >> o)
+        amp = persistence ** o
+        norm += amp
+        # lattice column and weight of every column of the window
+        lx0 = x0 // s
+        cols = [ (x0 + x) // s - lx0 for x in range(w) ]
+        weights = [ _smooth(((x0 + x) % s) / float(s)) for x in range(w) ]
+        layers.append((seed + o * 0x1000193, s, amp, lx0, (x0 + w - 1) // s - lx0 + 2, cols, weights, {}))
+
+    scale255 = 255.999 / norm
+    out = bytearray(w * h)
+    for y in range(h):
+        gy = y0 + y
+        acc = None
+        for (lseed, s, amp, lx0, lw, cols, weights, rows) in layers:
+            ly = gy // s
+            for j in (ly, ly + 1):
+                if j not in rows:
+                    rows[j] = [ amp * lattice(lseed, lx0 + i, j) for i in range(lw) ]
+            if ly - 1 in rows:
+                del rows[ly - 1]
+            ty = _smooth((gy % s) / float(s))
+            (ra, rb) = (rows[ly], rows[ly + 1])
+            row = [ a + (b - a) * ty for (a, b) in zip(ra, rb) ]
+            diff = map(operator.sub, row[1:], row[:-1])
+            vals = [ row[i] + diff[i] * t for (i, t) in zip(cols, weights) ]
+            acc = vals if acc is None else map(operator.add, acc, vals)
+        out[y * w:(y + 1) * w] = bytearray(int(v * scale255) for v in acc)
+    return out
+
+def threshold(level, below=chr(0), above=chr(1)):
+    """
+    Translation table to threshold a field with str.translate.
+
+    Arguments:
+      level - values from this one up are translated to above
+      below - byte for the values under level. Default: chr(0)
+      above - byte for the values from level up. Default: chr(1)
+
+    Returns:
+      256 bytes translation table
+    """
+    return below * level + above * (256 - level)
+
+def quantile(field, q):
+    """
+    Field value under which (about) a fraction of the cells are.
+
+    Arguments:
+      field - field, as returned by fbm
+      q     - fraction, in [0, 1]
+
+    Returns:
+      int value (0-256)
+    """
+    field = str(field)
+    target = int(q * len(field))
+    count = 0
+    for v in range(256):
+        count += field.count(chr(v))
+        if count > target:
+            return v
+    return 256
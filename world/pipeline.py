@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+pipeline.py
+
+RogueLike map generation pipelines.
+
+A map type may describe its generation as a list of stages (see stages
+module) instead of a single make_map call:
+
+  'stages' : [('fill',          {}),
+              ('scatter_rooms', {'maxrooms' : 50}),
+              ('chain_rooms',   {}),
+              ('stairs',        {'where' : 'first_room'})]
+
+The pipeline runs the stages in order over a Build (the tile grid being
+built plus its metadata), and records the time each stage takes and
+how much it grows the memory of the process.
+
+Intermediate results are cached, keyed by the seed, the dimensions,
+default tile and rooms geometry of the map, and the stages run so far
+with their parameters: pipelines sharing their first stages (a dungeon
+and a cave morphed from the same dungeon, say) build them only once
+for the same seed. Each stage draws its random numbers from its own generator,
+derived from the seed and the position of the stage, so a stage gives
+the same result whether the stages before it were run or restored.
+
+  class Build      : a map being built by stages
+
+  class StageCache : size bounded cache of intermediate builds
+
+  class Pipeline   : runs a list of stages
+
+  CACHE            : the StageCache shared by every pipeline
+"""
+
+import copy
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import genrandom
+import stages
+
+log = logging.getLogger('roguelike.pipeline')
+
+class Build:
+    """
+    A map being built by stages.
+
+    Variables:
+      mapa    - tile.TileGrid being built
+      (w,h)   - map dimensions
+      deftile - default tile of the map type (TILETYPES key)
+      util    - mapa.map_util, carving utilities
+      roomgeo - geometrics for the rooms
+      rnd     - genrandom.GenRandom of the running stage
+      rooms   - list of room.roomgeo, the rooms placed so far
+      links   - list of (i,j) indices in rooms of the rooms joined by
+                the corridors carved so far
+      stairs  - (x,y) of the initial stairs, None until placed
+      meta    - dictionary with anything else the stages leave for the
+                following ones
+    """
+    def __init__(self, mapa, deftile, util, roomgeo):
+        """
+        Initializes an empty build.
+
+        Arguments:
+          mapa    - tile.TileGrid to build the map in
+          deftile - default tile of the map type
+          util    - mapa.map_util
+          roomgeo - geometrics for the rooms
+        """
+        self.mapa = mapa
+        (self.w, self.h) = (mapa.w, mapa.h)
+        self.deftile = deftile
+        self.util = util
+        self.roomgeo = roomgeo
+        self.rnd = None
+        self.rooms = []
+        self.links = []
+        self.stairs = None
+        self.meta = {}
+
+    def snapshot(self):
+        """
+        Gets a copy of the build results so far.
+
+        Returns:
+          (tile ids str, rooms, stairs, meta, links) tuple, not shared
+          with the build
+        """
+        return (self.mapa.dump(), copy.deepcopy(self.rooms), self.stairs, copy.deepcopy(self.meta),
+                list(self.links))
+
+    def restore(self, snap):
+        """
+        Restores the build results from a snapshot.
+
+        Arguments:
+          snap - snapshot, as given by snapshot
+        """
+        (cells, rooms, self.stairs, meta, links) = snap
+        self.mapa.load(cells)
+        self.rooms = copy.deepcopy(rooms)
+        self.meta = copy.deepcopy(meta)
+        self.links = list(links)
+
+class StageCache:
+    """
+    In memory cache of intermediate builds (snapshots of a Build after
+    some stages), least recently used entries dropped when the cache
+    grows beyond its maximum size.
+
+    Methods:
+      __init__
+      get
+      put
+      clear
+
+    Variables:
+      maxsize - maximum size, in bytes of tile ids and of bit grids
+                in the meta of the builds
+      size    - current size
+      entries - OrderedDict of key -> snapshot, least recently used
+                first
+    """
+
+    """Default maximum size (bytes of tile ids and bit grids)."""
+    DEF_MAXSIZE = 32 * 1024 * 1024
+
+    def __init__(self, maxsize=DEF_MAXSIZE):
+        """
+        Initializes an empty cache.
+
+        Arguments:
+          maxsize - maximum size, in bytes. Default: DEF_MAXSIZE
+        """
+        self.maxsize = maxsize
+        self.size = 0
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        """
+        Gets a snapshot.
+
+        Returns:
+          the snapshot, None if not in the cache
+        """
+        snap = self.entries.pop(key, None)
+        if snap is not None:
+            self.entries[key] = snap
+        return snap
+
+    def put(self, key, snap):
+        """
+        Stores a snapshot, dropping old ones to make room if needed.
+        Snapshots bigger than the whole cache are not stored.
+        """
+        size = self._size(snap)
+        if size > self.maxsize:
+            return
+        if key in self.entries:
+            self.size -= self._size(self.entries.pop(key))
+        while self.size + size > self.maxsize:
+            self.size -= self._size(self.entries.popitem(last=False)[1])
+        self.entries[key] = snap
+        self.size += size
+
+    def _size(self, snap):
+        """
+        Size of a snapshot: its tile ids, plus the bit grids (longs) in
+        its meta.
+        """
+        return len(snap[0]) + sum(v.bit_length() // 8 for v in snap[3].itervalues() if isinstance(v, (int, long)))
+
+    def clear(self):
+        """
+        Drops every snapshot.
+        """
+        self.entries.clear()
+        self.size = 0
+
+"""The cache of intermediate builds, shared by every pipeline."""
+CACHE = StageCache()
+
+class Pipeline:
+    """
+    Runs a list of generation stages.
+
+    Methods:
+      __init__
+      run
+      keys
+
+    Variables:
+      stages  - list of (stage name, parameters dictionary)
+      cache   - StageCache, or None
+      timings - list of (stage name, seconds, memory growth in KB,
+                restored from the cache) of the last run
+    """
+    def __init__(self, stagelist, cache=CACHE):
+        """
+        Initializes the pipeline.
+
+        Arguments:
+          stagelist - list of (stage name, parameters dictionary), the
+                      names from stages.STAGES
+          cache     - StageCache for intermediate builds, None for no
+                      caching. Default: CACHE
+        """
+        for (name, params) in stagelist:
+            if name not in stages.STAGES:
+                raise Exception("unknown map generation stage: %s" % name)
+        self.stages = stagelist
+        self.cache = cache
+        self.timings = []
+
+    def keys(self, seed, build):
+        """
+        Gets the cache keys of the build after each stage.
+
+        Arguments:
+          seed  - seed of the pipeline
+          build - Build, for its dimensions, default tile and rooms
+                  geometry
+
+        Returns:
+          list of str keys, one per stage
+        """
+        keys = []
+        sha = hashlib.sha1(repr((seed, (build.w, build.h), build.deftile, build.roomgeo.__name__)))
+        for (name, params) in self.stages:
+            sha.update(repr((name, sorted(params.items()))))
+            keys.append(sha.hexdigest())
+        return keys
+
+    def run(self, build, seed):
+        """
+        Runs the stages over a build.
+
+        The longest prefix of stages found in the cache is restored
+        instead of run, every stage run afterwards is cached.
+
+        Arguments:
+          build - Build, empty
+          seed  - int seed, the random generator of each stage is
+                  derived from it
+
+        Returns:
+          the build
+        """
+        keys = self.keys(seed, build)
+        self.timings = []
+
+        start = 0
+        if self.cache is not None:
+            for i in range(len(keys) - 1, -1, -1):
+                snap = self.cache.get(keys[i])
+                if snap is not None:
+                    t0 = time.time()
+                    build.restore(snap)
+                    self.timings.append(('cached: ' + ' '.join(n for (n, p) in self.stages[:i + 1]),
+                                         time.time() - t0, 0, True))
+                    start = i + 1
+                    break
+
+        for i in range(start, len(self.stages)):
+            (name, params) = self.stages[i]
+            build.rnd = genrandom.GenRandom(seed * 256 + i)
+            (t0, m0) = (time.time(), self._maxrss())
+            stages.STAGES[name](build, **params)
+            self.timings.append((name, time.time() - t0, self._maxrss() - m0, False))
+            if self.cache is not None:
+                self.cache.put(keys[i], build.snapshot())
+
+        build.rnd = None
+        for (name, secs, kb, cached) in self.timings:
+            log.debug(" Stage %s: %.4fs, +%dKB" % (name, secs, kb))
+        return build
+
+    def _maxrss(self):
+        """
+        Peak memory of the process, in KB (0 where unknown).
+        """
+        if resource is None:
+            return 0
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+prefab.py
+
+RogueLike prefabricated rooms, stamped whole into the maps.
+
+A prefab is a small block of tiles (a classroom, a lab, ...) written
+in the same format as the level files (see levfile and the file_char
+of each tile.TILETYPES). Templates are decoded only once into tile ids
+rows, and every rotated or mirrored variant is built once and cached
+too, so stamping a prefab into a map is just a slice assignment per
+row.
+
+Templates have their door(s) in the bottom (south) side, facing the
+hallway, at least one of them open so the room can be entered.
+
+  TEMPLATES           : source of the prefab templates
+
+  class Prefab        : a block of tile ids, ready to be stamped
+
+  class PrefabLibrary : decoded templates and their cached variants
+
+  PREFABS             : the PrefabLibrary of TEMPLATES
+"""
+
+import levfile
+from tile import TileGrid
+
+"""
+Prefab templates.
+
+Each one is a list of rows, one file_char per tile, all rows with the
+same length. Doors must be in the bottom row, and at least one of them
+must be an open door ('*'): closed ones ('+') block the way.
+"""
+TEMPLATES = {
+    'classroom' : ['#############',
+                   '#...........#',
+                   '#.%%.%%.%%..#',
+                   '#...........#',
+                   '#.%%.%%.%%..#',
+                   '#...........#',
+                   '##*######+###'],
+
+    'classroom_small' : ['#########',
+                         '#.......#',
+                         '#.%.%.%.#',
+                         '#.......#',
+                         '#.%.%.%.#',
+                         '#.......#',
+                         '####*####'],
+
+    'lab' : ['###########',
+             '#%%%%%%%%%#',
+             '#.........#',
+             '#.%%%.%%%.#',
+             '#.........#',
+             '#.........#',
+             '#####*#####'],
+
+    'office' : ['#######',
+                '#%%...#',
+                '#.....#',
+                '#...%.#',
+                '#.....#',
+                '#.....#',
+                '###*###'],
+    }
+
+class Prefab:
+    """
+    Block of tile ids, ready to be stamped into a tile.TileGrid.
+
+    Methods:
+      __init__
+      rotated
+      mirrored
+      stamp
+
+    Variables:
+      (w,h) - dimensions of the block
+      rows  - list of str with the tile ids of each row
+    """
+    def __init__(self, (w, h), rows):
+        """
+        Initializes the block.
+
+        Arguments:
+          (w, h) - dimensions of the block
+          rows   - list of h str of w tile ids each
+        """
+        self.w = w
+        self.h = h
+        self.rows = rows
+
+    def rotated(self):
+        """
+        Gets the block rotated a quarter turn clockwise (so a door in
+        the south side ends in the west side).
+
+        Returns:
+          a new Prefab
+        """
+        cells = ''.join(self.rows)
+        # each column, from bottom to top, is a new row
+        return Prefab((self.h, self.w), [ cells[x::self.w][::-1] for x in range(self.w) ])
+
+    def mirrored(self):
+        """
+        Gets the block mirrored left to right.
+
+        Returns:
+          a new Prefab
+        """
+        return Prefab((self.w, self.h), [ row[::-1] for row in self.rows ])
+
+    def stamp(self, grid, (x, y)):
+        """
+        Stamps the block into a tile grid.
+
+        Arguments:
+          grid  - tile.TileGrid
+          (x,y) - coordinates for the top left corner of the block
+        """
+        if x < 0 or y < 0 or x + self.w > grid.w or y + self.h > grid.h:
+            raise IndexError("prefab out of map: (%d,%d)-(%d,%d)" % (x, y, x + self.w - 1, y + self.h - 1))
+        i = x + y * grid.w
+        for row in self.rows:
+            grid.cells[i:i + self.w] = row
+            i += grid.w
+
+class PrefabLibrary:
+    """
+    Library of prefabs.
+
+    Every template is decoded when the library is built; variants are
+    built the first time they are asked for, and cached.
+
+    Methods:
+      __init__
+      get
+      names
+
+    Variables:
+      cache - dictionary of (name, rot, mirror) -> Prefab
+    """
+    def __init__(self, templates):
+        """
+        Decodes the templates.
+
+        Arguments:
+          templates - dictionary of name -> list of rows, as TEMPLATES
+        """
+        self.cache = {}
+        for name, rows in templates.iteritems():
+            w = len(rows[0])
+            if any(len(row) != w for row in rows):
+                raise Exception("prefab rows of different lengths: %s" % name)
+            grid = TileGrid((w, len(rows)), 'air')
+            levfile.decode('\n'.join(rows), grid, name)
+            cells = str(grid.cells)
+            self.cache[(name, 0, False)] = Prefab((w, len(rows)), [ cells[i:i + w] for i in range(0, len(cells), w) ])
+
+    def get(self, name, rot=0, mirror=False):
+        """
+        Gets a prefab.
+
+        Arguments:
+          name   - template name
+          rot    - quarter turns clockwise (0 to 3), the door side
+                   goes south (0), west (1), north (2) or east
+                   (3). Default: 0
+          mirror - mirror left to right, before rotating. Default:
+                   False
+
+        Returns:
+          Prefab
+        """
+        rot %= 4
+        key = (name, rot, mirror)
+        if key not in self.cache:
+            if rot:
+                self.cache[key] = self.get(name, rot - 1, mirror).rotated()
+            else:
+                self.cache[key] = self.get(name).mirrored()
+        return self.cache[key]
+
+    def names(self):
+        """
+        Gets the names of the templates.
+        """
+        return sorted(set(k[0] for k in self.cache))
+
+"""The library of the game prefabs."""
+PREFABS = PrefabLibrary(TEMPLATES)
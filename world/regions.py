@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+regions.py
+
+RogueLike map regions.
+
+A region is a set of passable cells connected to each other, moving in
+the 8 directions (as players and monsters do). Labeling the regions of
+a map once answers any 'can X reach Y' question in constant time,
+comparing the labels of both cells.
+
+  class RegionIndex : region labels of a tile.TileGrid, kept up to date
+                      while the map changes
+
+  function label_runs : labels the connected regions of a mask
+"""
+
+import re
+from array import array
+
+from tile import TILEREG
+from unionfind import UnionFind
+
+class RegionIndex:
+    """
+    Connected regions of the passable cells of a tile.TileGrid.
+
+    Labeling works on the passability mask of the grid (see
+    label_runs).
+
+    When a cell changes its passability, update must be called: a new
+    passable cell takes the label of its neighbours, joining their
+    regions if there are several of them (the labels are joined in a
+    UnionFind too, so no cell is relabeled). A cell becoming blocked
+    may split its region, and then the whole grid is labeled again,
+    but only if its passable neighbours do not touch each other
+    around it (else no split is possible).
+
+    Methods:
+      __init__
+      label
+      region
+      same_region
+      update
+      regions
+      runs
+
+    Variables:
+      grid   - the tile.TileGrid
+      table  - passability translation table of the tiles
+      labels - array with the label of every cell, 0 for not passable
+               cells (row-major)
+      sets   - unionfind.UnionFind of the labels, the region of a
+               cell is the root of its label
+      count  - number of regions
+    """
+
+    """Neighbour offsets, around a cell."""
+    RING = ((0, -1), (1, -1), (1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1))
+
+    def __init__(self, grid, table=TILEREG.walkable_table):
+        """
+        Labels the regions of a grid.
+
+        Arguments:
+          grid  - tile.TileGrid
+          table - passability translation table (see
+                  tile.TileRegistry). Default: walkable_table
+        """
+        self.grid = grid
+        self.table = table
+        self.label()
+
+    def label(self):
+        """
+        Labels the whole grid again.
+        """
+        mask = self.grid.mask(self.table)
+        (self.labels, self._runs, self.count) = label_runs(mask, self.grid.w, self.grid.h)
+        self.sets = UnionFind(self.count + 1)
+
+    def region(self, x, y):
+        """
+        Gets the region of a cell.
+
+        Returns:
+          int region id, 0 if the cell is not passable
+        """
+        return self.sets.find(self.labels[self.grid.index(x, y)])
+
+    def same_region(self, (x1, y1), (x2, y2)):
+        """
+        Tells if a cell can be reached from other one.
+
+        Returns:
+          True if both cells are passable and in the same region
+        """
+        r = self.region(x1, y1)
+        return r != 0 and r == self.region(x2, y2)
+
+    def update(self, x, y):
+        """
+        Updates the labels after a change in the tile of a cell.
+
+        Arguments:
+          (x,y) - coordinates of the changed cell
+        """
+        grid = self.grid
+        i = grid.index(x, y)
+        passable = self.table[grid.cells[i]] != chr(0)
+        if passable == (self.labels[i] != 0):
+            return
+        self._runs = None
+
+        around = [ (dx, dy) for (dx, dy) in self.RING
+                   if 0 <= x + dx < grid.w and 0 <= y + dy < grid.h and
+                      self.labels[i + dx + dy * grid.w] != 0 ]
+
+        if passable:
+            roots = set(self.sets.find(self.labels[i + dx + dy * grid.w]) for (dx, dy) in around)
+            if not roots:
+                self.labels[i] = self.sets.add()
+                self.count += 1
+            else:
+                root = roots.pop()
+                self.labels[i] = root
+                for r in roots:
+                    self.sets.union(root, r)
+                    self.count -= 1
+        else:
+            self.labels[i] = 0
+            if not around:
+                self.count -= 1
+            elif self._pieces(around) > 1:
+                self.label()
+
+    def _pieces(self, around):
+        """
+        Counts the groups of neighbours touching each other around a
+        cell.
+        """
+        pieces = 0
+        left = set(around)
+        while left:
+            pieces += 1
+            todo = [left.pop()]
+            while todo:
+                (ax, ay) = todo.pop()
+                near = [ (bx, by) for (bx, by) in left if abs(ax - bx) <= 1 and abs(ay - by) <= 1 ]
+                left.difference_update(near)
+                todo.extend(near)
+        return pieces
+
+    def regions(self):
+        """
+        Gets every region, biggest first.
+
+        Returns:
+          list of (region id, number of cells, (x,y) of its top left
+          cell)
+        """
+        if self._runs is None:
+            self.label()
+        found = {}
+        for (s, e, lab) in self._runs:
+            if lab in found:
+                found[lab][1] += e - s
+            else:
+                found[lab] = [lab, e - s, (s % self.grid.w, s // self.grid.w)]
+        return sorted((tuple(r) for r in found.itervalues()), key=lambda r: (-r[1], r[0]))
+
+    def runs(self, region):
+        """
+        Gets the cells of a region, as runs.
+
+        Arguments:
+          region - region id, as given by regions
+
+        Returns:
+          list of (start, end) slices of the grid cells (row-major, end
+          not included), each one within a row
+        """
+        if self._runs is None:
+            self.label()
+        return [ (s, e) for (s, e, lab) in self._runs if lab == region ]
+
+"""Runs of set cells in a mask."""
+RUNS = re.compile('[^\x00]+')
+
+def label_runs(mask, w, h):
+    """
+    Labels the connected regions (8 directions) of the set cells of a
+    mask.
+
+    Labeling works on runs of set cells (found a row at a time), not
+    on single cells: runs in consecutive rows touching each other are
+    joined with a unionfind.UnionFind, and every run gets the label of
+    its set, written with a single slice assignment.
+
+    Arguments:
+      mask  - str/bytearray, a byte per cell (row-major), non zero for
+              set cells
+      (w,h) - dimensions of the mask
+
+    Returns:
+      (labels, runs, count) tuple: array('i') with the label of every
+      cell (1 to count, 0 for cells not set), list of (start, end,
+      label) of every run (end not included), and the number of
+      regions
+    """
+    mask = str(mask)
+    runs = []
+    sets = UnionFind(0)
+    prev = []
+    for y in range(h):
+        row = [ (m.start(), m.end(), sets.add()) for m in RUNS.finditer(mask, y * w, (y + 1) * w) ]
+        # join runs touching the ones of the previous row, diagonals
+        # included
+        (i, j) = (0, 0)
+        while i < len(prev) and j < len(row):
+            (ps, pe, pr) = prev[i]
+            (cs, ce, cr) = row[j]
+            (ps, pe) = (ps + w, pe + w)
+            if ps <= ce and cs <= pe:
+                sets.union(pr, cr)
+            if pe < ce:
+                i += 1
+            else:
+                j += 1
+        runs.extend(row)
+        prev = row
+
+    # a label for every set, 0 is for cells not set
+    labels = array('i', [0]) * (w * h)
+    roots = {}
+    labeled = []
+    for (s, e, r) in runs:
+        lab = roots.setdefault(sets.find(r), len(roots) + 1)
+        labels[s:e] = array('i', [lab]) * (e - s)
+        labeled.append((s, e, lab))
+    return (labels, labeled, len(roots))
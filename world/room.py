@@ -8,16 +8,30 @@ methods.
 
 Coordinates in this classes are relative to the map ones.
 
+Rooms which are not rectangles (Circle, Hexag) are rasterized into
+masks of the cells they take, walls included, one int per row (bit i
+set for the i-th cell of the row of their bounding box). A mask depends
+only on the shape, size and orientation of the room, so it is built
+once and cached (see MaskedRoom.masks): testing two rooms for overlap
+is a bounding box test and then an AND of the rows of both masks where
+the boxes overlap, and filling a room is a masked write (see
+mapa.map_util.carve_mask).
+
   class Rect         : base class for rectangular rooms
 
+  class MaskedRoom   : base class for rooms with a rasterized mask
+
   class Circle       : base class for circular rooms
 
   class Hexag        : base class for hexagonal rooms
 
-TODO:
-  - implement classes for geometrics different from the Rect one.
+  class RoomIndex    : spatial index of rooms in a map
 """
 
+import math
+
+import bitgrid
+
 class Rect:
     """
     Rectangle, basic unit for rooms, class.
@@ -26,6 +40,7 @@ class Rect:
       __init__
       center
       intersect
+      floor_rows
 
     Variables:
       (x1,y1) - top left corner coordinates of the rectangle
@@ -62,30 +77,71 @@ class Rect:
 
         Returns:
           boolean, true if this room intersects with another room.
+        """
+        if not (self.x1 <= other.x2 and self.x2 >= other.x1 and
+                self.y1 <= other.y2 and self.y2 >= other.y1):
+            return False
+        if isinstance(other, MaskedRoom):
+            return other.intersect(self)
+        return True
+
+    def floor_rows(self):
+        """
+        Gets the floor of the room (the rectangle without its border,
+        the walls), as for MaskedRoom.
 
-        TODO:
-          - currently just supports intersection between rectangular
-            rooms.
+        Returns:
+          list with an int per row of the rectangle, bit i set if the
+          i-th cell of the row is floor
         """
-        return (self.x1 <= other.x2 and self.x2 >= other.x1 and
-                self.y1 <= other.y2 and self.y2 >= other.y1)
+        (w, h) = (self.x2 - self.x1 + 1, self.y2 - self.y1 + 1)
+        inner = ((1 << max(0, w - 2)) - 1) << 1
+        return [0] + [inner] * max(0, h - 2) + [0] if h > 1 else [0]
 
-class Circle:
+class MaskedRoom:
     """
-    Circle, basic unit for rooms, class.
+    Room with a rasterized mask, base class for rooms which are not
+    rectangles.
+
+    The room is the shape inscribed in its bounding box, walls
+    included (as the walls of a Rect are its border); its floor is the
+    mask without its border cells.
+
+    Daughter classes must define:
+      SHAPE       - name of the shape, for the masks cache
+      half_width  - method giving the half width of the (convex)
+                    shape at a row of the bounding box
 
     Methods:
       __init__
       center
       intersect
+      rows
+      floor
+      floor_rows
+      half_width
 
     Variables:
+      (x1,y1) - top left corner coordinates of the bounding box
+      (x2,y2) - bottom right corner coordinates of the bounding box
+      orient  - orientation of the shape
+      masks   - cache of the masks of every (shape, size, orientation),
+                shared by every room
     """
-    def __init__():
+    masks = {}
+
+    def __init__(self, (x, y), (w, h), orient=0):
         """
-        Initializes rooms properties.
+        Initializes the room, inscribed in a bounding box.
+
+        Arguments:
+          (x, y) : coordinates for top left corner of the bounding box
+          (w, h) : size of the bounding box (as for Rect)
+          orient : orientation of the shape. Default: 0
         """
-        pass
+        (self.x1, self.y1) = (x, y)
+        (self.x2, self.y2) = (x + w, y + h)
+        self.orient = orient
 
     def center(self):
         """
@@ -94,54 +150,249 @@ class Circle:
         Returns:
           tuple with int coordinates of the center of the room
         """
-        pass
+        return ((self.x1 + self.x2) / 2, (self.y1 + self.y2) / 2)
+
+    def _mask(self):
+        """
+        Gets the (rows, floor, floor rows) masks of the room,
+        rasterizing them the first time they are asked for.
+        """
+        (w, h) = (self.x2 - self.x1 + 1, self.y2 - self.y1 + 1)
+        key = (self.SHAPE, w, h, self.orient)
+        mask = self.masks.get(key)
+        if mask is None:
+            # shapes are convex, every row is a single run of the cells
+            # whose centers are within the half width of the row
+            rows = []
+            for j in range(h):
+                hw = self.half_width(j, w, h)
+                start = max(0, int(math.ceil(w / 2.0 - hw - 0.5)))
+                end = min(w - 1, int(math.floor(w / 2.0 + hw - 0.5)))
+                rows.append(((1 << (end - start + 1)) - 1) << start if start <= end else 0)
+            # floor cells have their 4 neighbours in the room
+            (floor, floor_rows) = ([], [])
+            for j in range(h):
+                above = rows[j - 1] if j > 0 else 0
+                below = rows[j + 1] if j < h - 1 else 0
+                row = rows[j] & above & below & (rows[j] << 1) & (rows[j] >> 1)
+                floor.append(bin(row | (1 << w))[3:][::-1].translate(bitgrid.DIGITS_TO_MASK))
+                floor_rows.append(row)
+            mask = self.masks[key] = (rows, ''.join(floor), floor_rows)
+        return mask
+
+    def rows(self):
+        """
+        Gets the mask of the room, walls included.
+
+        Returns:
+          list with an int per row of the bounding box, bit i set if
+          the i-th cell of the row is part of the room
+        """
+        return self._mask()[0]
+
+    def floor(self):
+        """
+        Gets the floor mask of the room.
+
+        Returns:
+          str with a byte per cell of the bounding box (row-major),
+          chr(1) for floor cells
+        """
+        return self._mask()[1]
+
+    def floor_rows(self):
+        """
+        Gets the floor mask of the room, as rows.
+
+        Returns:
+          list with an int per row of the bounding box, bit i set if
+          the i-th cell of the row is floor
+        """
+        return self._mask()[2]
 
     def intersect(self, other):
         """
-        Determines if this room intersects with any other.
+        Determines if this room intersects with any other: their
+        bounding boxes overlap, and so do their masks there.
 
         Arguments:
-          other - some other room
+          other - some other room (Rect or MaskedRoom)
 
         Returns:
           boolean, true if this room intersects with another room.
         """
-        pass
+        if not (self.x1 <= other.x2 and self.x2 >= other.x1 and
+                self.y1 <= other.y2 and self.y2 >= other.y1):
+            return False
+        (y1, y2) = (max(self.y1, other.y1), min(self.y2, other.y2) + 1)
+        mine = self.rows()[y1 - self.y1:y2 - self.y1]
+        if isinstance(other, MaskedRoom):
+            theirs = other.rows()[y1 - other.y1:y2 - other.y1]
+        else:
+            theirs = [(1 << (other.x2 - other.x1 + 1)) - 1] * (y2 - y1)
+        # align their rows with mine
+        shift = other.x1 - self.x1
+        if shift >= 0:
+            return any(a & (b << shift) for (a, b) in zip(mine, theirs))
+        return any(a & (b >> -shift) for (a, b) in zip(mine, theirs))
+
+class Circle(MaskedRoom):
+    """
+    Circle, basic unit for rooms, class.
+
+    The circle (an ellipse, for bounding boxes which are not square)
+    inscribed in the bounding box. It has a single orientation.
+
+    Methods:
+      half_width
+    """
+    SHAPE = 'circle'
+
+    def half_width(self, j, w, h):
+        """
+        Gets the half width of the room at a row.
 
-class Hexag:
+        Arguments:
+          j     - row of the bounding box
+          (w,h) - dimensions of the bounding box, in cells
+
+        Returns:
+          float half width, in cells, at the center of the row
+        """
+        dy = (j + 0.5 - h / 2.0) / (h / 2.0)
+        return w / 2.0 * math.sqrt(max(0.0, 1.0 - dy * dy))
+
+class Hexag(MaskedRoom):
     """
     Hexagone, basic unit for rooms, class.
 
+    The hexagon inscribed in the bounding box, with two vertices in
+    the middle of the left and right sides of the box and flat top and
+    bottom (orientation 0), or two vertices in the middle of the top
+    and bottom sides and flat left and right (orientation 1).
+
+    Methods:
+      half_width
+    """
+    SHAPE = 'hexag'
+
+    def half_width(self, j, w, h):
+        """
+        Gets the half width of the room at a row.
+
+        Arguments:
+          j     - row of the bounding box
+          (w,h) - dimensions of the bounding box, in cells
+
+        Returns:
+          float half width, in cells, at the center of the row
+        """
+        dy = abs(j + 0.5 - h / 2.0) / (h / 2.0)
+        if self.orient:
+            return w / 2.0 * min(1.0, 2.0 * (1.0 - dy))
+        return w / 2.0 * (1.0 - dy / 2.0)
+
+class RoomIndex:
+    """
+    Spatial index of the rooms in a map.
+
+    A uniform grid of buckets over the map: each bucket holds the
+    rooms whose bounding box overlaps it. Looking for rooms which
+    intersect a given one checks just the rooms in the buckets the
+    room overlaps, instead of every room in the map, so placing n
+    rooms costs about O(n) instead of O(n^2).
+
+    Rooms must have the bounding box coordinates (x1,y1) and (x2,y2)
+    (as Rect and MaskedRoom do), and an intersect method.
+
     Methods:
       __init__
-      center
-      intersect
+      __len__
+      insert
+      query
+      intersects
 
     Variables:
+      (w,h)   - map dimensions
+      bsize   - bucket size (width and height) in map cells
+      (bw,bh) - dimensions of the grid of buckets
+      buckets - list of buckets (lists of rooms), row-major
+      rooms   - list of every room in the index, in insertion order
     """
-    def __init__():
+    def __init__(self, (w, h), bsize=32):
         """
-        Initializes rooms properties.
+        Initializes an empty index.
+
+        Arguments:
+          (w, h) - map dimensions
+          bsize  - bucket size, in map cells. A good value is about the
+                   size of the biggest rooms. Default: 32
         """
-        pass
+        (self.w, self.h) = (w, h)
+        self.bsize       = max(1, bsize)
+        (self.bw, self.bh) = (w // self.bsize + 1, h // self.bsize + 1)
+        self.buckets     = [ [] for i in range(self.bw * self.bh) ]
+        self.rooms       = []
 
-    def center(self):
+    def __len__(self):
+        return len(self.rooms)
+
+    def _buckets(self, r):
         """
-        Get center coordinates.
+        Gets the indexes of the buckets overlapped by a room bounding
+        box (clipped to the map).
+        """
+        bx1 = min(max(r.x1, 0) // self.bsize, self.bw - 1)
+        by1 = min(max(r.y1, 0) // self.bsize, self.bh - 1)
+        bx2 = min(max(r.x2, 0) // self.bsize, self.bw - 1)
+        by2 = min(max(r.y2, 0) // self.bsize, self.bh - 1)
+        return [ bx + by * self.bw
+                 for by in range(by1, by2 + 1)
+                 for bx in range(bx1, bx2 + 1) ]
+
+    def insert(self, r):
+        """
+        Adds a room to the index.
 
-        Returns:
-          tuple with int coordinates of the center of the room
+        Arguments:
+          r - the room
         """
-        pass
+        for b in self._buckets(r):
+            self.buckets[b].append(r)
+        self.rooms.append(r)
 
-    def intersect(self, other):
+    def query(self, r):
         """
-        Determines if this room intersects with any other.
+        Finds the rooms in the index which intersect a given one.
 
         Arguments:
-          other - some other room
+          r - the room
 
         Returns:
-          boolean, true if this room intersects with another room.
+          list of the intersecting rooms
+        """
+        found = []
+        seen = set()
+        for b in self._buckets(r):
+            for other in self.buckets[b]:
+                if id(other) not in seen:
+                    seen.add(id(other))
+                    if r.intersect(other):
+                        found.append(other)
+        return found
+
+    def intersects(self, r):
+        """
+        Tells if a room intersects any room in the index.
+
+        Arguments:
+          r - the room
+
+        Returns:
+          boolean, true if the room intersects some room in the index
         """
-        pass
+        for b in self._buckets(r):
+            for other in self.buckets[b]:
+                if r.intersect(other):
+                    return True
+        return False
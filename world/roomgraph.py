@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+roomgraph.py
+
+RogueLike rooms of a generated map, cell by cell.
+
+The rooms of a map (see mapa.Map.rooms) are just their geometries. A
+RoomMap rasterizes them into a room id per cell, so the room a cell
+belongs to is known in constant time, and keeps the graph of the
+rooms: two rooms are adjacent when the generator carved a corridor
+between them (see mapa.Map.links), or when their floors touch.
+
+  class RoomMap : room ids of the cells of a map and adjacency graph of
+                  its rooms
+"""
+
+from array import array
+
+import regions
+from tile import TILEREG
+from unionfind import UnionFind
+
+class RoomMap:
+    """
+    Room ids of the cells of a map, and adjacency graph of its rooms.
+
+    Room ids are 1 to the number of rooms, in the order of the rooms
+    list (room id k is rooms[k - 1]); cells out of any room floor
+    (walls, corridors, rock) have room id 0. Overlapping rooms leave
+    the id of the last one in the overlap. Rooms floors are taken from
+    their geometry (see floor_rows in room.Rect and room.MaskedRoom),
+    whose rows must be runs of cells (convex rooms).
+
+    The edges of the graph are the corridors as carved by the
+    generator (the links of the map): corridors crossing each other
+    merge in the tiles, so telling from the tiles which rooms a
+    corridor joins would make almost every room adjacent to every
+    other one. Which rooms can be reached from each other is found
+    from the tiles, though: the passable cells out of any room floor
+    are labeled as corridors (see regions.label_runs), and the ring of
+    cells around the floor of each room tells the corridors it opens
+    to, rooms opening to the same corridor being connected. It is not
+    updated when the map changes, a new RoomMap must be built then.
+
+    Methods:
+      __init__
+      room_at
+      room
+      neighbours
+      connected
+      corridors
+
+    Variables:
+      (w,h)     - map dimensions
+      rooms     - list of the rooms
+      ids       - array with the room id of every cell (row-major)
+      adjacent  - list with the set of adjacent room ids of every room
+                  (index 0 unused), by links or touching floors
+      doors     - list with the set of corridor labels every room
+                  opens to (index 0 unused)
+      sets      - unionfind.UnionFind of the room ids, joined when
+                  they are connected through the tiles
+    """
+    def __init__(self, grid, rooms, links=(), table=TILEREG.walkable_table):
+        """
+        Rasterizes the rooms and builds their graph.
+
+        Arguments:
+          grid  - tile.TileGrid of the map
+          rooms - list of rooms (room.roomgeo instances)
+          links - list of (i,j) indices in rooms of the rooms joined by
+                  corridors. Default: none
+          table - passability translation table (see
+                  tile.TileRegistry). Default: walkable_table
+        """
+        (w, h) = (self.w, self.h) = (grid.w, grid.h)
+        self.rooms = rooms
+        self.ids = array('H' if len(rooms) < 0xffff else 'i', [0]) * (w * h)
+
+        # room floors, a slice per row
+        spans = []
+        for (k, r) in enumerate(rooms):
+            k += 1
+            rowspans = []
+            for (j, row) in enumerate(r.floor_rows()):
+                y = r.y1 + j
+                if not row or not 0 <= y < h:
+                    continue
+                (s, e) = (max(0, r.x1 + (row & -row).bit_length() - 1), min(w, r.x1 + row.bit_length()))
+                if s < e:
+                    self.ids[y * w + s:y * w + e] = array(self.ids.typecode, [k]) * (e - s)
+                    rowspans.append((y, s, e))
+            spans.append(rowspans)
+
+        # corridors: passable cells out of the room floors
+        mask = grid.mask(table)
+        for rowspans in spans:
+            for (y, s, e) in rowspans:
+                mask[y * w + s:y * w + e] = bytearray(e - s)
+        (labels, runs, count) = regions.label_runs(mask, w, h)
+        self._corridors = count
+
+        self.adjacent = [ set() for i in range(len(rooms) + 1) ]
+        for (i, j) in links:
+            if i != j:
+                self.adjacent[i + 1].add(j + 1)
+                self.adjacent[j + 1].add(i + 1)
+
+        self.doors = [ set() for i in range(len(rooms) + 1) ]
+        opens = {}
+        for (k, rowspans) in enumerate(spans):
+            k += 1
+            floor = dict((y, (s, e)) for (y, s, e) in rowspans)
+            for (y, s, e) in rowspans:
+                # the cells around the floor run: at its ends, and in
+                # the rows above and below it where they are not floor
+                # of the room too
+                ring = []
+                if s > 0:
+                    ring.append(y * w + s - 1)
+                if e < w:
+                    ring.append(y * w + e)
+                for yy in (y - 1, y + 1):
+                    if not 0 <= yy < h:
+                        continue
+                    (a, b) = (max(0, s - 1), min(w, e + 1))
+                    (fs, fe) = floor.get(yy, (a, a))
+                    ring.extend(xrange(yy * w + a, yy * w + max(a, min(b, fs))))
+                    ring.extend(xrange(yy * w + max(a, min(b, fe)), yy * w + b))
+                for i in ring:
+                    lab = labels[i]
+                    if lab:
+                        self.doors[k].add(lab)
+                        opens.setdefault(lab, set()).add(k)
+                    elif self.ids[i] and self.ids[i] != k:
+                        self.adjacent[k].add(self.ids[i])
+                        self.adjacent[self.ids[i]].add(k)
+
+        self.sets = UnionFind(len(rooms) + 1)
+        for joined in opens.itervalues():
+            first = min(joined)
+            for k in joined:
+                self.sets.union(first, k)
+        for (k, adj) in enumerate(self.adjacent):
+            for m in adj:
+                self.sets.union(k, m)
+
+    def room_at(self, x, y):
+        """
+        Gets the room a cell is in.
+
+        Returns:
+          int room id, 0 if the cell is not in the floor of any room
+        """
+        return self.ids[x + y * self.w]
+
+    def room(self, k):
+        """
+        Gets a room by its id.
+
+        Returns:
+          the room (room.roomgeo instance)
+        """
+        return self.rooms[k - 1]
+
+    def neighbours(self, k):
+        """
+        Gets the rooms adjacent to a room: joined to it by a corridor
+        of the generator, or touching its floor.
+
+        Arguments:
+          k - room id
+
+        Returns:
+          sorted list of room ids
+        """
+        return sorted(self.adjacent[k])
+
+    def connected(self, a, b):
+        """
+        Tells if a room can be reached from other one, going through
+        rooms and corridors.
+
+        Arguments:
+          a - room id
+          b - other room id
+
+        Returns:
+          True if both are rooms and connected
+        """
+        return a != 0 and b != 0 and self.sets.same(a, b)
+
+    def corridors(self):
+        """
+        Gets the number of corridors (connected passable cells out of
+        any room) of the map.
+        """
+        return self._corridors
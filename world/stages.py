@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+stages.py
+
+RogueLike map generation stages.
+
+A map generated by stages (see pipeline module) is built by a list of
+small steps, each one a function over the tile grid and the metadata
+of the map being built (a pipeline.Build): fill the grid, place rooms,
+connect them, morph the walls, place the stairs, validate... Stages
+are named in the 'stages' list of the map types (see mapa.MAPTYPES),
+with their parameters.
+
+Every stage receives the Build as first argument, and its parameters
+as keyword arguments. Random numbers must be taken from build.rnd only
+(each stage gets its own genrandom.GenRandom, see pipeline.Pipeline,
+better drawn in batches), and whatever a stage leaves for the
+following ones goes into build.meta.
+
+  function fill        : fills the whole grid with a tile
+
+  function scatter_rooms : places non overlapping random rooms
+
+  function chain_rooms : joins every room with the previous one
+
+  function noise       : random walls, for a cellular automaton
+
+  function morph       : noise around the floor, to morph a dungeon
+
+  function automaton   : runs a cellular automaton over the walls
+
+  function connect     : fills tiny regions and joins the rest
+
+  function stairs      : places the initial stairs
+
+  function validate    : checks the map is playable
+
+  STAGES               : stage functions by name
+"""
+
+import bitgrid
+import regions
+import room
+import tile
+
+def fill(build, tipo=None):
+    """
+    Fills the whole grid with a tile.
+
+    Arguments:
+      tipo - type of tile (TILETYPES key). Default: None, the default
+             tile of the map type
+    """
+    mapa = build.mapa
+    mapa.cells[:] = chr(tile.TILEIDS[tipo or build.deftile]) * len(mapa.cells)
+
+def scatter_rooms(build, maxrooms=50, room_min_size=10, room_max_size=30, tipo='dung_floor', shapes=None):
+    """
+    Places random rooms, dropping the ones overlapping others.
+
+    The rooms (leaving their walls) are carved all at once at the
+    end, and added to build.rooms.
+
+    Arguments:
+      maxrooms      - number of rooms to try. Default: 50
+      room_min_size - min size for the rooms. Default: 10
+      room_max_size - max size for the rooms. Default: 30
+      tipo          - type of tile for the rooms floor. Default:
+                      'dung_floor'
+      shapes        - names of the room geometries (room module
+                      classes, as 'Circle') to pick from at random for
+                      each room. Default: None, the map roomgeo
+    """
+    (width, height) = (build.w, build.h)
+    (lo, hi) = (min(room_min_size, room_max_size), max(room_min_size, room_max_size))
+    index = room.RoomIndex((width, height), hi)
+    geos = [ getattr(room, name) for name in shapes ] if shapes else [build.roomgeo]
+    ops = []
+    # every candidate room takes 5 words: width, height, x, y and
+    # geometry
+    words = build.rnd.words(5 * maxrooms)
+    for r in range(0, 5 * maxrooms, 5):
+        (rw, rh) = (lo + (words[r] * (hi - lo + 1) >> 32), lo + (words[r + 1] * (hi - lo + 1) >> 32))
+        (x, y) = (words[r + 2] * (width - rw) >> 32, words[r + 3] * (height - rh) >> 32)
+        geo = geos[words[r + 4] * len(geos) >> 32]
+        new_room = geo((x, y), (rw, rh))
+        if not index.intersects(new_room):
+            ops.append(build.util.room_op(new_room, tipo))
+            build.rooms.append(new_room)
+            index.insert(new_room)
+    build.util.carve(build.mapa, ops)
+
+def chain_rooms(build, tipo='dung_floor'):
+    """
+    Joins every room with the previous one, with L shaped corridors
+    between their centers (going horizontally or vertically first at
+    random), adding the joined rooms to build.links.
+
+    Arguments:
+      tipo - type of tile for the corridors. Default: 'dung_floor'
+    """
+    ops = []
+    for (k, (prev, new)) in enumerate(zip(build.rooms, build.rooms[1:])):
+        ops.append(('l', prev.center(), new.center(), tipo, build.rnd.randint(0, 1) == 1))
+        build.links.append((k, k + 1))
+    build.util.carve(build.mapa, ops)
+
+def noise(build, fill=0.45):
+    """
+    Random walls, as the start of a cellular automaton.
+
+    Leaves in build.meta:
+      walls - bitgrid with the walls
+      floor - bitgrid with the cells to keep as floor (none)
+
+    Arguments:
+      fill - ratio of walls. Default: 0.45
+    """
+    build.meta['walls'] = bitgrid.random_bits(build.rnd, build.w * build.h, fill)
+    build.meta['floor'] = 0
+
+def morph(build, noise=0.35, reach=3):
+    """
+    Takes the floor of the grid (a dungeon, usually) to be morphed by
+    a cellular automaton: everything but the floor is wall, and some
+    cells near the floor are flipped.
+
+    Leaves in build.meta:
+      walls - bitgrid with the walls
+      floor - bitgrid with the floor cells, kept as floor
+
+    Arguments:
+      noise - ratio of cells flipped near the floor. Default: 0.35
+      reach - how far from the floor cells get flipped. Default: 3
+    """
+    (w, h) = (build.w, build.h)
+    full = (1 << (w * h)) - 1
+    floor = bitgrid.from_mask(build.mapa.mask(tile.TILEREG.walkable_table))
+    near = bitgrid.dilate(floor, w, h, reach)
+    build.meta['walls'] = (full ^ floor) ^ (bitgrid.random_bits(build.rnd, w * h, noise) & near)
+    build.meta['floor'] = floor
+
+def automaton(build, birth=5, survival=4, iterations=5, tipo='dung_floor'):
+    """
+    Runs a cellular automaton over the walls left by noise or morph,
+    and writes the result into the grid: a cell becomes wall if it has
+    at least birth wall neighbours, and a wall stays if it has at least
+    survival wall neighbours. Walls are the default tile of the map
+    type, floor cells (the kept ones too) are tipo.
+
+    Arguments:
+      birth      - minimum wall neighbours for a floor cell to become
+                   wall. Default: 5
+      survival   - minimum wall neighbours for a wall to stay. Default:
+                   4
+      iterations - automaton iterations. Default: 5
+      tipo       - type of tile for the floor. Default: 'dung_floor'
+    """
+    (w, h) = (build.w, build.h)
+    n = w * h
+    floor = build.meta['floor']
+    walls = bitgrid.automaton(build.meta['walls'], w, h, birth, survival, iterations)
+    walls &= ((1 << n) - 1) ^ floor
+    build.meta['walls'] = walls
+
+    table = (chr(tile.TILEIDS[tipo]) + chr(tile.TILEIDS[build.deftile])).ljust(256, chr(0))
+    build.mapa.cells[:] = bitgrid.to_mask(walls, n).translate(table)
+
+def connect(build, min_region=12, tipo='dung_floor'):
+    """
+    Makes every passable cell reachable: regions smaller than
+    min_region are filled with the default tile of the map type, and
+    the rest joined (see mapa.map_util.connect_regions). The rooms
+    nearest to the ends of each corridor are added to build.links.
+
+    Arguments:
+      min_region - regions with fewer cells are filled. Default: 12
+      tipo       - type of tile for the corridors. Default:
+                   'dung_floor'
+    """
+    joins = []
+    build.util.connect_regions(build.mapa, regions.RegionIndex(build.mapa), tipo, build.deftile, min_region, joins)
+    for (a, b) in joins:
+        (i, j) = (build.util.nearest_room(build.rooms, a), build.util.nearest_room(build.rooms, b))
+        if i is not None and i != j:
+            build.links.append((i, j))
+
+def stairs(build, where='random'):
+    """
+    Places the initial stairs of the map.
+
+    Arguments:
+      where - 'first_room' for a random cell inside the first room,
+              'random' for a random passable cell. Default: 'random'
+    """
+    if where == 'first_room' and build.rooms:
+        first = build.rooms[0]
+        if hasattr(first, 'floor'):
+            floor = first.floor()
+            i = build.rnd.choice([ i for (i, c) in enumerate(floor) if c != chr(0) ])
+            mw = first.x2 - first.x1 + 1
+            build.stairs = (first.x1 + i % mw, first.y1 + i // mw)
+        else:
+            build.stairs = (build.rnd.randint(first.x1 + 1, first.x2 - 1),
+                            build.rnd.randint(first.y1 + 1, first.y2 - 1))
+    else:
+        build.stairs = build.util.random_cell(build.mapa, build.rnd, tile.TILEREG.walkable_table)
+    build.mapa.set_tipo(build.stairs[0], build.stairs[1], 'stairs')
+
+def validate(build, connected=True):
+    """
+    Checks the map is playable: it has stairs, and (if asked for)
+    every passable cell can be reached from them.
+
+    Leaves in build.meta:
+      regions - number of regions of the map (when checked)
+
+    Arguments:
+      connected - check the map is connected. Default: True
+
+    Raises:
+      Exception, if the map is not playable
+    """
+    if build.stairs is None or build.mapa.tipo(build.stairs[0], build.stairs[1]) != 'stairs':
+        raise Exception("map without stairs")
+    if connected:
+        count = regions.RegionIndex(build.mapa).count
+        build.meta['regions'] = count
+        if count != 1:
+            raise Exception("map not connected: %d regions" % count)
+
+"""Stage functions, by the names used in the map types."""
+STAGES = {'fill'          : fill,
+          'scatter_rooms' : scatter_rooms,
+          'chain_rooms'   : chain_rooms,
+          'noise'         : noise,
+          'morph'         : morph,
+          'automaton'     : automaton,
+          'connect'       : connect,
+          'stairs'        : stairs,
+          'validate'      : validate}
@@ -7,10 +7,21 @@ RogueLike tiles for the maps.
   class TILETYPES    : holds dictionaries to define each type of tile a
                        map can have
 
+  class TileRegistry : tile types compiled to integer ids and
+                       property lookup tables
+
   class Tile         : defines a tile in the map
 
+  class TileGrid     : compact 2D grid of tiles, the storage for a map
+
+  class TileColumn   : column accessor for a TileGrid (compatibility)
+
+  class TileView     : single tile accessor for a TileGrid
+                       (compatibility)
+
 """
 
+import hashlib
 
 """
 Types for the tiles in the map.
@@ -246,3 +257,408 @@ class Tile:
         self.tipo     = tipo
         # 'explored by the player' status
         self.explored = False
+
+class TileRegistry:
+    """
+    Registry of the tile types, compiled from a TILETYPES like
+    dictionary.
+
+    Each tile type gets a dense integer id (sorted by name, so a given
+    id means the same tile type across runs), and every property of
+    the tile types gets a lookup list indexed by that id. This way hot
+    code can tell what a tile is with a list index instead of dict
+    lookups and string comparisons.
+
+    The boolean properties also get a 256 bytes translation table
+    (chr(1) if the property holds, chr(0) if not) so a whole buffer of
+    tile ids can be turned into a property mask in a single
+    translate() call (see TileGrid.mask).
+
+    Methods:
+      __init__
+
+    Variables:
+      names             - tile type names (TILETYPES keys), by id
+      ids               - map of tile type name to id
+      block_pass        - block_pass property, by id
+      block_sight       - block_sight property, by id
+      just_color        - just_color property, by id
+      char              - char property (unicode), by id
+      glyph             - char to draw for the tile (utf8 encoded str,
+                          a blank if the tile is drawn just as color),
+                          by id
+      color             - color property, by id
+      nv_color          - nv_color property, by id
+      file_char         - file_char property (unicode), by id
+      block_pass_table  - translation table, tile id to block_pass
+      block_sight_table - translation table, tile id to block_sight
+      walkable_table    - translation table, tile id to not block_pass
+      transparent_table - translation table, tile id to not
+                          block_sight
+      fov_table         - translation table, tile id to its FOV map
+                          cell (1 if transparent, plus 2 if walkable,
+                          see fovmap)
+      file_table        - translation table, level file character
+                          (byte) to tile id, FILE_UNKNOWN for
+                          characters which are not a file_char
+      hash              - sha1 digest (str) of the tile ids
+                          assignment, anything storing tile ids
+                          should check it before trusting them
+    """
+
+    """Tile id given by file_table to unknown file characters."""
+    FILE_UNKNOWN = 255
+
+    def __init__(self, tiletypes):
+        """
+        Compiles the registry.
+
+        Arguments:
+          tiletypes - dictionary of tile types, as TILETYPES
+        """
+        if len(tiletypes) > 255:
+            raise Exception("too many tile types: %d" % len(tiletypes))
+
+        self.names       = sorted(tiletypes.keys())
+        self.ids         = dict((name, tid) for tid, name in enumerate(self.names))
+
+        types = [ tiletypes[name] for name in self.names ]
+        self.block_pass  = [ t['block_pass'] for t in types ]
+        self.block_sight = [ t['block_sight'] for t in types ]
+        self.just_color  = [ t['just_color'] for t in types ]
+        self.char        = [ t['char'] for t in types ]
+        self.glyph       = [ ' ' if t['just_color'] else t['char'].encode('utf8') for t in types ]
+        self.color       = [ t['color'] for t in types ]
+        self.nv_color    = [ t['nv_color'] for t in types ]
+        self.file_char   = [ t['file_char'] for t in types ]
+
+        self.block_pass_table  = self._table(self.block_pass)
+        self.block_sight_table = self._table(self.block_sight)
+        self.walkable_table    = self._table([ not b for b in self.block_pass ])
+        self.transparent_table = self._table([ not b for b in self.block_sight ])
+        self.fov_table         = ''.join(chr((not s) + 2 * (not p))
+                                         for (s, p) in zip(self.block_sight, self.block_pass)).ljust(256, chr(0))
+
+        file_table = [chr(self.FILE_UNKNOWN)] * 256
+        for tid, c in enumerate(self.file_char):
+            c = c.encode('utf8')
+            if len(c) != 1:
+                raise Exception("file_char must be a single byte character: %s" % self.names[tid])
+            if file_table[ord(c)] != chr(self.FILE_UNKNOWN):
+                raise Exception("file_char '%s' is not unique" % c)
+            file_table[ord(c)] = chr(tid)
+        self.file_table = ''.join(file_table)
+
+        self.hash = hashlib.sha1('\n'.join(self.names)).digest()
+
+    def _table(self, flags):
+        """
+        Builds a 256 bytes translation table from a list of flags
+        indexed by tile id. Unused ids translate to chr(0).
+        """
+        return ''.join(chr(1) if f else chr(0) for f in flags).ljust(256, chr(0))
+
+"""Registry of the tile types in TILETYPES."""
+TILEREG = TileRegistry(TILETYPES)
+
+"""Tile type names, indexed by its integer tile id."""
+TILENAMES = TILEREG.names
+
+"""Integer tile id for each tile type name."""
+TILEIDS = TILEREG.ids
+
+class TileGrid:
+    """
+    Compact 2D grid of tiles, the tile storage of a map.
+
+    Instead of holding one tile.Tile instance per cell, the grid holds
+    a contiguous buffer of small integer tile ids (see TileRegistry), one
+    byte per cell, plus a separate buffer with the explored flag of
+    each cell. Both buffers are row-major: cell (x,y) is at index
+    x + y*w, so a whole row of the map is a contiguous slice which can
+    be read or written in bulk.
+
+    For compatibility, grid[x][y] still gives an object with the
+    'tipo' and 'explored' attributes of a tile.Tile, but it is slow
+    and should not be used on hot paths.
+
+    Methods:
+      __init__
+      __len__
+      __getitem__
+      index
+      get
+      set
+      tipo
+      set_tipo
+      is_explored
+      set_explored
+      window
+      blit
+      mask
+      find_all
+      dump
+      load
+
+    Variables:
+      (w,h)    - grid dimensions
+      cells    - bytearray with the tile id of each cell
+      explored - bytearray with the explored flag (0 or 1) of each
+                 cell
+    """
+    def __init__(self, (w, h), tipo = 'wall'):
+        """
+        Initializes the grid, every cell with the same type of tile.
+
+        Arguments:
+          (w, h) - grid dimensions
+          tipo   - the type of tile to fill the grid with. Default:
+                   TILETYPES.wall
+        """
+        (self.w, self.h) = (w, h)
+        self.cells       = bytearray(chr(TILEIDS[tipo])) * (w * h)
+        self.explored    = bytearray(w * h)
+
+    def __len__(self):
+        """
+        Grid width, as the length of the old list of columns.
+        """
+        return self.w
+
+    def __getitem__(self, x):
+        """
+        Gets a column of the grid (compatibility accessor).
+
+        Arguments:
+          x - column coordinate
+
+        Returns:
+          TileColumn for the given column, so grid[x][y] works as in
+          a 2D list of tile.Tile instances
+        """
+        if not 0 <= x < self.w:
+            raise IndexError("x coordinate out of grid: %s" % str(x))
+        return TileColumn(self, x)
+
+    def index(self, x, y):
+        """
+        Gets the index of some coordinates in the grid buffers.
+
+        Raises IndexError if the coordinates are out of the grid.
+        """
+        if not (0 <= x < self.w and 0 <= y < self.h):
+            raise IndexError("coordinates out of grid: (%s,%s)" % (str(x), str(y)))
+        return x + y * self.w
+
+    def get(self, x, y):
+        """
+        Gets the tile id at some coordinates.
+        """
+        return self.cells[self.index(x, y)]
+
+    def set(self, x, y, tid):
+        """
+        Sets the tile id at some coordinates.
+        """
+        self.cells[self.index(x, y)] = tid
+
+    def tipo(self, x, y):
+        """
+        Gets the type of tile (TILETYPES key) at some coordinates.
+        """
+        return TILENAMES[self.cells[self.index(x, y)]]
+
+    def set_tipo(self, x, y, tipo):
+        """
+        Sets the type of tile (TILETYPES key) at some coordinates.
+        """
+        self.cells[self.index(x, y)] = TILEIDS[tipo]
+
+    def is_explored(self, x, y):
+        """
+        Tells if the tile at some coordinates has been explored.
+        """
+        return self.explored[self.index(x, y)] == 1
+
+    def set_explored(self, x, y, explored = True):
+        """
+        Sets the explored flag for the tile at some coordinates.
+        """
+        self.explored[self.index(x, y)] = 1 if explored else 0
+
+    def window(self, (x, y), (w, h)):
+        """
+        Copies a box of the grid.
+
+        Arguments:
+          (x,y) - top left corner of the box
+          (w,h) - dimensions of the box
+
+        Returns:
+          TileGrid with the tiles and explored flags of the box
+        """
+        if x < 0 or y < 0 or x + w > self.w or y + h > self.h:
+            raise IndexError("box out of grid: (%d,%d)-(%d,%d)" % (x, y, x + w - 1, y + h - 1))
+        grid = TileGrid((w, h))
+        for yy in range(h):
+            (i, o) = (yy * w, x + (y + yy) * self.w)
+            grid.cells[i:i + w]    = self.cells[o:o + w]
+            grid.explored[i:i + w] = self.explored[o:o + w]
+        return grid
+
+    def blit(self, grid, (x, y)):
+        """
+        Writes other grid (tiles and explored flags) into a box of this
+        one.
+
+        Arguments:
+          grid  - TileGrid
+          (x,y) - top left corner of the box
+        """
+        if x < 0 or y < 0 or x + grid.w > self.w or y + grid.h > self.h:
+            raise IndexError("box out of grid: (%d,%d)-(%d,%d)" % (x, y, x + grid.w - 1, y + grid.h - 1))
+        for yy in range(grid.h):
+            (i, o) = (yy * grid.w, x + (y + yy) * self.w)
+            self.cells[o:o + grid.w]    = grid.cells[i:i + grid.w]
+            self.explored[o:o + grid.w] = grid.explored[i:i + grid.w]
+
+    def mask(self, table):
+        """
+        Gets a property mask for the whole grid.
+
+        Arguments:
+          table - translation table from tile id to mask value, as
+                  TILEREG.block_pass_table
+
+        Returns:
+          bytearray with the mask value of each cell, same layout as
+          cells
+        """
+        return self.cells.translate(table)
+
+    def find_all(self, tipo):
+        """
+        Finds every tile of a given type in the grid.
+
+        Arguments:
+          tipo - the type of tile (TILETYPES key) to look for
+
+        Returns:
+          list of (x,y) coordinates, in row-major order
+        """
+        tid = chr(TILEIDS[tipo])
+        found = []
+        i = self.cells.find(tid)
+        while i != -1:
+            found.append((i % self.w, i // self.w))
+            i = self.cells.find(tid, i + 1)
+        return found
+
+    def dump(self):
+        """
+        Gets the tiles of the grid, compact and picklable.
+
+        Returns:
+          str with the tile id of each cell
+        """
+        return str(self.cells)
+
+    def load(self, data):
+        """
+        Restores the tiles of the grid.
+
+        Arguments:
+          data - tiles, as given by dump
+
+        Raises:
+          ValueError, if data is not a tile per cell of the grid
+        """
+        if len(data) != self.w * self.h:
+            raise ValueError("tiles size %d does not match the grid (%d,%d)" % (len(data), self.w, self.h))
+        self.cells[:] = data
+
+class TileColumn:
+    """
+    A column of a TileGrid.
+
+    Compatibility accessor, so old code indexing the map as a 2D list
+    of tile.Tile (mapa[x][y]) keeps working.
+
+    Methods:
+      __init__
+      __len__
+      __getitem__
+      __setitem__
+
+    Variables:
+      grid - the TileGrid
+      x    - column coordinate
+    """
+    def __init__(self, grid, x):
+        """
+        Initializes the column accessor.
+        """
+        self.grid = grid
+        self.x    = x
+
+    def __len__(self):
+        return self.grid.h
+
+    def __getitem__(self, y):
+        """
+        Gets a tile accessor for the cell (x,y).
+        """
+        if not 0 <= y < self.grid.h:
+            raise IndexError("y coordinate out of grid: %s" % str(y))
+        return TileView(self.grid, self.x, y)
+
+    def __setitem__(self, y, t):
+        """
+        Stores a tile.Tile (or alike) in the cell (x,y).
+
+        Only the type and explored flag of the tile are kept, the
+        instance itself is not.
+        """
+        self.grid.set_tipo(self.x, y, t.tipo)
+        self.grid.set_explored(self.x, y, t.explored)
+
+class TileView(object):
+    """
+    A single tile of a TileGrid.
+
+    Duck-types tile.Tile, reading and writing its attributes straight
+    from/to the grid.
+
+    Variables:
+      tipo     - the type for the tile (from tile.TILETYPES)
+      explored - the explored flag for the tile
+    """
+    __slots__ = ('grid', 'x', 'y')
+
+    def __init__(self, grid, x, y):
+        """
+        Initializes the tile accessor.
+
+        Arguments:
+          grid  - the TileGrid (or alike)
+          (x,y) - coordinates of the tile
+        """
+        self.grid = grid
+        self.x    = x
+        self.y    = y
+
+    def _get_tipo(self):
+        return self.grid.tipo(self.x, self.y)
+
+    def _set_tipo(self, tipo):
+        self.grid.set_tipo(self.x, self.y, tipo)
+
+    tipo = property(_get_tipo, _set_tipo)
+
+    def _get_explored(self):
+        return self.grid.is_explored(self.x, self.y)
+
+    def _set_explored(self, explored):
+        self.grid.set_explored(self.x, self.y, explored)
+
+    explored = property(_get_explored, _set_explored)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+unionfind.py
+
+RogueLike disjoint sets.
+
+  class UnionFind : disjoint sets of integers (union-find), over flat
+                    arrays
+"""
+
+from array import array
+
+class UnionFind:
+    """
+    Disjoint sets of the integers 0..n-1.
+
+    The sets forest is held in flat arrays (no per element objects),
+    with path compression (halving) on find and union by rank, so any
+    sequence of operations takes about linear time, and memory is a
+    few bytes per element. No recursion is used, so it works for
+    millions of elements.
+
+    Methods:
+      __init__
+      __len__
+      find
+      union
+      same
+      add
+
+    Variables:
+      parent - array with the parent of each element (itself for the
+               roots)
+      rank   - bytearray with the rank of each root
+      sets   - number of disjoint sets
+    """
+    def __init__(self, n):
+        """
+        Initializes n singleton sets.
+
+        Arguments:
+          n - number of elements
+        """
+        self.parent = array('i', xrange(n))
+        self.rank   = bytearray(n)
+        self.sets   = n
+
+    def __len__(self):
+        return len(self.parent)
+
+    def find(self, i):
+        """
+        Finds the root (representative) of the set of an element.
+        """
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        """
+        Joins the sets of two elements.
+
+        Returns:
+          the root of the joined set, or None if both elements were
+          already in the same set
+        """
+        (ri, rj) = (self.find(i), self.find(j))
+        if ri == rj:
+            return None
+        if self.rank[ri] < self.rank[rj]:
+            (ri, rj) = (rj, ri)
+        self.parent[rj] = ri
+        if self.rank[ri] == self.rank[rj] and self.rank[ri] < 255:
+            self.rank[ri] += 1
+        self.sets -= 1
+        return ri
+
+    def same(self, i, j):
+        """
+        Tells if two elements are in the same set.
+        """
+        return self.find(i) == self.find(j)
+
+    def add(self):
+        """
+        Adds a new singleton set.
+
+        Returns:
+          the new element
+        """
+        self.parent.append(len(self.parent))
+        self.rank.append(0)
+        self.sets += 1
+        return len(self.parent) - 1
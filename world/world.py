@@ -24,13 +24,19 @@ for a multi-user game.
   class World         : the world logic class
 
   class WORLDBRANCHES : the branches on which the levels are grouped
+
+  function level_seed : derives the seed of a level from the world
+                        seed
 """
 
 import libtcod.libtcodpy as tcod
+import hashlib
 import logging
+import multiprocessing
 import time, calendar
 
 import level
+import levelcache
 import mapa
 import objects.player as player
 
@@ -54,13 +60,40 @@ class WORLDBRANCHES:
                   'maptypes': [mapa.MAPTYPES.dungeon, mapa.MAPTYPES.dungeon2]}
 
     woods      = {'name'    : 'woods',
-                  'maptypes': [mapa.MAPTYPES.wood]}
+                  'maptypes': [mapa.MAPTYPES.overworld, mapa.MAPTYPES.wood]}
 
     from_file  = {'name'    : 'from_file',
                   'maptypes': [mapa.MAPTYPES.special]}
 
     # hogsmeade, london, ministery, diagon_alley, gringotts, country (riddles,burrow,etc)
 
+"""
+How the seed of each level is derived from the world seed (see
+level_seed). Logged along with the world seed, so a world can be
+reproduced from the logs.
+"""
+SEED_DERIVATION = "sha1('<wrldseed>:<branch name>:<numlevel>')[:4 bytes] & 0x7fffffff"
+
+def level_seed(wrldseed, branch, numlevel):
+    """
+    Derives the seed of a level from the world seed.
+
+    Each (branch, numlevel) gets its own independent seed, so the
+    random number stream of a level depends only on the world seed and
+    the level itself, not on how many levels there are or in which
+    order they get built. See SEED_DERIVATION.
+
+    Arguments:
+      wrldseed - the world seed
+      branch   - WORLDBRANCHES the level belongs to
+      numlevel - the level id number
+
+    Returns:
+      int seed for the level random number generator
+    """
+    digest = hashlib.sha1('%d:%s:%d' % (wrldseed, branch['name'], numlevel)).hexdigest()
+    return int(digest[:8], 16) & 0x7fffffff
+
 class World:
     """
     Entire world of the game.
@@ -68,28 +101,56 @@ class World:
     Methods:
       __init__
       initWorld
+      new_level
+      get_levels
+      pregenerate
+      new_game
 
     Variables:
-      wrldseed  - seed for random number generator
+      wrldseed  - seed for random number generator, every level seed
+                  is derived from it (see level_seed)
       wrldrg    - global random number generator
+      workers   - number of worker processes to generate the levels
+                  maps in, 0 to build them lazily, one by one
+      cache     - levelcache.LevelCache for the generated levels, or
+                  None
       levels    - generated levels of the world
       players   - players of the game
     """
-    def __init__(self):
+    def __init__(self, seed=None, workers=0, cachedir=None, cachesize=levelcache.LevelCache.DEF_MAXSIZE):
         """
         Initialize game's world.
+
+        Arguments:
+          seed    - the world seed, the same seed gives the same
+                    world. Default: None (a seed is taken from the
+                    current time)
+          workers - if given, the maps of every level are built right
+                    away, in parallel in this many worker processes
+                    (see pregenerate). Default: 0 (levels maps are
+                    built when first needed)
+          cachedir  - directory for the cache of generated levels.
+                      Default: None (no cache)
+          cachesize - maximum size of the cache, in bytes. Default:
+                      levelcache.LevelCache.DEF_MAXSIZE
         """
-        self.wrldseed = calendar.timegm(time.gmtime())
-        log.debug("World seed: %s" % str(self.wrldseed))
-        # self.wrldrg = tcod.random_new_from_seed(self.wrldseed)
-        self.wrldrg = tcod.random_new()
+        self.wrldseed = seed if seed is not None else calendar.timegm(time.gmtime())
+        log.info("World seed: %s" % str(self.wrldseed))
+        log.info("Level seeds derivation: %s" % SEED_DERIVATION)
+        self.wrldrg = tcod.random_new_from_seed(self.wrldseed)
 
         self.levels = {} # levels' empty graph
 
         self.players = []
 
+        self.workers = workers
+        self.cache = levelcache.LevelCache(cachedir, cachesize) if cachedir else None
+
         self.initWorld()
 
+        if self.workers:
+            self.pregenerate(self.workers)
+
     def initWorld(self):
         """
         Initialize the  world's map graph.
@@ -98,6 +159,9 @@ class World:
         with each other (as edges in a graph). The first level (index
         0) is the entrance of the game (where it all begins).
 
+        Levels are just descriptors here, each level map gets built
+        when the level is first entered (see level.Level).
+
         ref: http://www.python.org/doc/essays/graphs.html
 
         TODO:
@@ -107,15 +171,88 @@ class World:
         """
         levels = [] # just a list of all the levels in the world
 
-        levels.append(level.Level(0, 'init', WORLDBRANCHES.from_file, self.wrldrg))
-        levels.append(level.Level(1, 'up', WORLDBRANCHES.from_file, self.wrldrg))
-        levels.append(level.Level(-1, 'down', WORLDBRANCHES.from_file, self.wrldrg))
+        levels.append(self.new_level(0, 'init', WORLDBRANCHES.from_file))
+        levels.append(self.new_level(1, 'up', WORLDBRANCHES.from_file))
+        levels.append(self.new_level(-1, 'down', WORLDBRANCHES.from_file))
 
         # directed graph relating levels to connecting levels
         self.levels[levels[0].name] = [(levels[0],'.'),(levels[1],'<'),(levels[2],'>')]
         self.levels[levels[1].name] = [(levels[1],'.'),(levels[0],'>')]
         self.levels[levels[2].name] = [(levels[2],'.'),(levels[0],'<')]
 
+    def new_level(self, numlevel, name, branch):
+        """
+        Creates a level of the world.
+
+        Each level gets its own seed, derived from the world seed and
+        the level branch and number (see level_seed), so the map of a
+        level doesn't depend on when (or where) it gets built.
+
+        Arguments:
+          numlevel - the level id number
+          name     - the generic name for the level
+          branch   - the branch in the world to which the level belongs
+
+        Returns:
+          the new level.Level
+        """
+        seed = level_seed(self.wrldseed, branch, numlevel)
+        log.debug("Level %s (%s/%s) seed: %d" % (str(numlevel), branch['name'], name, seed))
+        return level.Level(numlevel, name, branch, seed, self.cache)
+
+    def get_levels(self):
+        """
+        Gets every level in the world.
+
+        Returns:
+          list of level.Level, sorted by level number
+        """
+        return sorted([ conns[0][0] for conns in self.levels.itervalues() ], key=lambda lev: lev.numlevel)
+
+    def pregenerate(self, workers=0):
+        """
+        Builds the maps of every level in the world not yet built.
+
+        With several workers, the maps are generated in a pool of
+        worker processes: each worker gets the map type and the seed of
+        a level, and gives back the generated state of the map (its
+        tile ids, rooms, stairs...) which then gets restored in its
+        level. Since each level has its own seed, the maps are the same
+        as the ones generated one by one. Levels found in the cache are
+        not generated again. Split maps built here, in the main process,
+        get their tiles generated in the same number of workers (see
+        mapa.SPLIT_WORKERS).
+
+        Arguments:
+          workers - number of worker processes, 0 or 1 to generate the
+                    maps serially. Default: 0
+        """
+        pending = [ lev for lev in self.get_levels() if not lev.is_materialized() ]
+        t0 = time.time()
+
+        states = dict((lev, None) for lev in pending)
+        togenerate = [ lev for lev in pending
+                       if lev.cache_key() is None or not lev.cache.has(lev.cache_key()) ]
+        if workers > 1 and len(togenerate) > 1:
+            pool = multiprocessing.Pool(min(workers, len(togenerate)))
+            try:
+                states.update(zip(togenerate,
+                                  pool.map(mapa.generate_state, [ (lev.maptype, lev.seed) for lev in togenerate ])))
+            finally:
+                pool.close()
+                pool.join()
+
+        split_workers = mapa.SPLIT_WORKERS
+        if workers > 1:
+            mapa.SPLIT_WORKERS = workers
+        try:
+            for lev in pending:
+                lev.materialize(states[lev])
+        finally:
+            mapa.SPLIT_WORKERS = split_workers
+
+        log.debug("Generated %d levels in %.3fs (workers: %s)" % (len(pending), time.time() - t0, str(workers)))
+
     def new_game(self):
         """
         Initialize for a new game.